@@ -17,7 +17,7 @@ KEY = os.getenv("TOKEN_SECRET")
 NONCE_SIZE = 12
 
 
-client = Client("API")
+client = Client("API", durable=True)
 
 
 @client.wrap_class
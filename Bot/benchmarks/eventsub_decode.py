@@ -0,0 +1,145 @@
+"""
+Бенчмарк разбора кадров EventSub, сообщений в секунду на одно ядро.
+
+Старый путь: orjson.loads + pydantic Message на каждый кадр, включая keepalive.
+Новый путь: decoder.decode, keepalive узнаётся без разбора, уведомления собираются
+в ChatMessage без валидации.
+
+Корпус берётся из JSONL файла (один кадр на строку, например записанный трафик),
+без аргумента генерируется синтетический: 90% чата, 10% keepalive.
+
+    python Bot/benchmarks/eventsub_decode.py [frames.jsonl]
+"""
+
+import random
+import sys
+from pathlib import Path
+from time import perf_counter
+
+import orjson
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "twitch"))
+
+from decoder import decode
+from models import Message
+
+FRAMES = 50_000
+
+
+def chat_frame(index: int) -> bytes:
+    broadcaster = str(100000 + index % 1000)
+    chatter = str(500000 + index % 20000)
+    text = random.choice(["!song", "Kappa lol", "hello chat", "PogChamp " * 5])
+    return orjson.dumps(
+        {
+            "metadata": {
+                "message_id": f"msg-{index}",
+                "message_type": "notification",
+                "message_timestamp": "2024-01-01T00:00:00.123456789Z",
+                "subscription_type": "channel.chat.message",
+                "subscription_version": "1",
+            },
+            "payload": {
+                "subscription": {
+                    "id": f"sub-{broadcaster}",
+                    "status": "enabled",
+                    "type": "channel.chat.message",
+                    "version": "1",
+                    "condition": {
+                        "broadcaster_user_id": broadcaster,
+                        "user_id": "1",
+                    },
+                    "transport": {"method": "websocket", "session_id": "session"},
+                    "created_at": "2024-01-01T00:00:00.123456789Z",
+                    "cost": 0,
+                },
+                "event": {
+                    "broadcaster_user_id": broadcaster,
+                    "broadcaster_user_login": f"channel{broadcaster}",
+                    "broadcaster_user_name": f"Channel{broadcaster}",
+                    "chatter_user_id": chatter,
+                    "chatter_user_login": f"user{chatter}",
+                    "chatter_user_name": f"User{chatter}",
+                    "message_id": f"chat-{index}",
+                    "message": {
+                        "text": text,
+                        "fragments": [
+                            {
+                                "type": "text",
+                                "text": text,
+                                "cheermote": None,
+                                "emote": None,
+                                "mention": None,
+                            }
+                        ],
+                    },
+                    "color": "#00FF7F",
+                    "badges": [
+                        {"set_id": "subscriber", "id": "12", "info": "14"},
+                        {"set_id": "premium", "id": "1", "info": ""},
+                    ],
+                    "message_type": "text",
+                    "cheer": None,
+                    "reply": None,
+                    "channel_points_custom_reward_id": None,
+                    "source_broadcaster_user_id": None,
+                    "source_broadcaster_user_login": None,
+                    "source_broadcaster_user_name": None,
+                    "source_message_id": None,
+                    "source_badges": None,
+                    "is_source_only": False,
+                },
+            },
+        }
+    )
+
+
+def keepalive_frame(index: int) -> bytes:
+    return orjson.dumps(
+        {
+            "metadata": {
+                "message_id": f"keepalive-{index}",
+                "message_type": "session_keepalive",
+                "message_timestamp": "2024-01-01T00:00:00.123456789Z",
+            },
+            "payload": {},
+        }
+    )
+
+
+def load_corpus() -> list[bytes]:
+    if len(sys.argv) > 1:
+        return Path(sys.argv[1]).read_bytes().splitlines()
+
+    random.seed(1)
+    return [
+        keepalive_frame(index) if index % 10 == 0 else chat_frame(index)
+        for index in range(FRAMES)
+    ]
+
+
+def legacy(data: bytes):
+    return Message(**orjson.loads(data))
+
+
+def measure(name: str, corpus: list[bytes], parse) -> float:
+    for data in corpus[:1000]:
+        parse(data)
+    start = perf_counter()
+    for data in corpus:
+        parse(data)
+    rate = len(corpus) / (perf_counter() - start)
+    print(f"{name:<32} {rate:10.0f} msgs/s")
+    return rate
+
+
+def main():
+    corpus = load_corpus()
+    print(f"{len(corpus)} frames, {sum(map(len, corpus)) / len(corpus):.0f} bytes avg")
+    before = measure("orjson + pydantic Message", corpus, legacy)
+    after = measure("decoder.decode", corpus, decode)
+    print(f"{'speedup':<32} {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
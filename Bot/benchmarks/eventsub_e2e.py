@@ -0,0 +1,172 @@
+"""
+Сквозной бенчмарк TwitchBot на локальном симуляторе EventSub.
+
+Симулятор (Bot/mock/eventsub.py) запускается отдельным процессом, бот подписывается
+на --channels каналов через его Helix и получает чат по --sessions websocket
+сессиям. Скорость поднимается ступенями, на каждой считается задержка от отправки
+сообщения симулятором до вызова обработчика и доля доставленных сообщений.
+Ступень выдержана, если доставлено не меньше 99% отправленного, симулятор успел
+отправить не меньше 95% заданного и p99 задержки не больше --max-latency.
+
+    python Bot/benchmarks/eventsub_e2e.py --channels 3000 --sessions 10
+    python Bot/benchmarks/eventsub_e2e.py --rates 1000,5000,20000 --duration 5
+"""
+
+import argparse
+import asyncio
+from pathlib import Path
+import subprocess
+import sys
+from time import monotonic, time_ns
+
+from aiohttp import ClientSession
+from loguru import logger
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "twitch"))
+
+import bot as bot_module
+import helix
+from bot import TwitchBot
+from decoder import ChatMessage
+
+ROOT = Path(__file__).resolve().parents[1]
+WARMUP = 2.0
+
+
+def percentile(values: list[int], share: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * share), len(values) - 1)] / 1e6
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.url = f"http://127.0.0.1:{args.port}"
+        self.received = 0
+        self.latencies: list[int] = []
+
+    async def handler(self, event: ChatMessage) -> None:
+        sent = int(event.message_id.split("-", 1)[0])
+        self.latencies.append(time_ns() - sent)
+        self.received += 1
+
+    async def control(self, http: ClientSession, path: str, **params) -> dict:
+        method = "GET" if path == "stats" else "POST"
+        params = {key: str(value) for key, value in params.items()}
+        async with http.request(
+            method, f"{self.url}/control/{path}", params=params
+        ) as response:
+            return await response.json()
+
+    async def run(self, bot: TwitchBot) -> None:
+        args = self.args
+        bot.on("channel.chat.message")(self.handler)
+        await bot.start()
+        async with ClientSession() as http:
+            channels = {str(100000 + index) for index in range(args.channels)}
+            await bot.sync(channels)
+            deadline = monotonic() + 60
+            while bot._pool.assigned < len(channels) and monotonic() < deadline:
+                await asyncio.sleep(0.2)
+            print(
+                f"{bot._pool.assigned}/{len(channels)} channels over "
+                f"{args.sessions} sessions"
+            )
+
+            print(
+                f"{'target':>8} {'sent/s':>8} {'handled/s':>10} {'p50 ms':>8} "
+                f"{'p99 ms':>8} {'max ms':>8} {'dropped':>8}"
+            )
+            best = 0.0
+            for rate in args.rates:
+                await self.control(http, "rate", value=rate)
+                await asyncio.sleep(WARMUP)
+
+                start_sent = (await self.control(http, "stats"))["sent"]
+                start_dropped = bot.stats()["queues"]["dropped"]
+                self.received = 0
+                self.latencies = []
+                start = monotonic()
+                await asyncio.sleep(args.duration)
+                elapsed = monotonic() - start
+                sent = (await self.control(http, "stats"))["sent"] - start_sent
+                dropped = bot.stats()["queues"]["dropped"] - start_dropped
+
+                latencies = sorted(self.latencies)
+                p99 = percentile(latencies, 0.99)
+                print(
+                    f"{rate:8.0f} {sent / elapsed:8.0f} {self.received / elapsed:10.0f} "
+                    f"{percentile(latencies, 0.5):8.1f} {p99:8.1f} "
+                    f"{percentile(latencies, 1.0):8.1f} {dropped:8}"
+                )
+                if (
+                    sent >= rate * elapsed * 0.95
+                    and self.received >= sent * 0.99
+                    and p99 <= args.max_latency
+                ):
+                    best = rate
+                else:
+                    break
+
+            await self.control(http, "rate", value=0)
+        print(f"max sustainable rate: {best:.0f} msgs/s")
+        await bot.exit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TwitchBot end-to-end benchmark")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--channels", type=int, default=3000)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--replay", type=Path)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--max-latency", type=float, default=100.0, help="p99, ms")
+    parser.add_argument(
+        "--rates",
+        type=lambda value: [float(rate) for rate in value.split(",")],
+        default=[1000, 2000, 5000, 10000, 20000, 50000],
+    )
+    args = parser.parse_args()
+
+    command = [
+        sys.executable,
+        str(ROOT / "mock" / "eventsub.py"),
+        "--host",
+        "127.0.0.1",
+        "--port",
+        str(args.port),
+        "--skew",
+        str(args.skew),
+    ]
+    if args.replay:
+        command += ["--replay", str(args.replay)]
+    simulator = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    bot_module.WS_URL = f"ws://127.0.0.1:{args.port}/ws"
+    helix.HELIX_URL = f"http://127.0.0.1:{args.port}"
+    bot = TwitchBot("benchmark", "token", "1", sessions=args.sessions)
+    try:
+        bot.loop.run_until_complete(wait_for_simulator(args.port))
+        bot.loop.run_until_complete(Bench(args).run(bot))
+    finally:
+        simulator.terminate()
+        simulator.wait()
+
+
+async def wait_for_simulator(port: int) -> None:
+    async with ClientSession() as http:
+        for _ in range(100):
+            try:
+                async with http.get(f"http://127.0.0.1:{port}/control/stats"):
+                    return
+            except OSError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("EventSub simulator didn't start")
+
+
+if __name__ == "__main__":
+    main()
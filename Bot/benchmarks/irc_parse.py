@@ -0,0 +1,207 @@
+"""
+Бенчмарк разбора IRC старого бота (Bot/old_twitch), строк в секунду на одно ядро.
+
+Старый путь: split по строкам, на каждую строку _parse_event + _parse_tags со
+всеми тегами, включая badges и emotes, и отдельная задача на строку.
+Новый путь: irc.parse_frame, один проход по кадру, ленивые badges и emotes и одна
+задача, которая разбирает очередь кадров.
+
+Лог берётся из файла (одна строка IRC на строку, например записанный трафик), без
+аргумента генерируется синтетический: в основном PRIVMSG, плюс USERSTATE,
+ROOMSTATE, CLEARCHAT и USERNOTICE, которые бот не обрабатывает.
+
+    python Bot/benchmarks/irc_parse.py [irc.log]
+"""
+
+import asyncio
+import random
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "old_twitch"))
+
+from irc import parse_frame
+
+LINES = 200_000
+# Twitch склеивает несколько строк в один кадр websocket
+LINES_PER_FRAME = 8
+COMMANDS = {"PRIVMSG", "PING", "NOTICE", "JOIN", "PART", "GLOBALUSERSTATE"}
+
+
+def privmsg(index: int) -> str:
+    channel = f"channel{index % 1000}"
+    login = f"user{index % 20000}"
+    text = random.choice(["!song", "Kappa lol", "hello chat", "PogChamp " * 5])
+    emotes = "25:0-4/354:6-10" if index % 5 == 0 else ""
+    return (
+        f"@badge-info=subscriber/14;badges=subscriber/12,premium/1;client-nonce="
+        f"a1b2c3d4e5f6;color=#00FF7F;display-name={login.capitalize()};emotes={emotes};"
+        f"first-msg=0;flags=;id=885196de-cb67-427a-baa8-82f9b0fcd05f;mod=0;"
+        f"returning-chatter=0;room-id={100000 + index % 1000};subscriber=1;"
+        f"tmi-sent-ts=1700000000{index % 1000:03};turbo=0;user-id={500000 + index % 20000};"
+        f"user-type= :{login}!{login}@{login}.tmi.twitch.tv PRIVMSG #{channel} :{text}"
+    )
+
+
+def other(index: int) -> str:
+    channel = f"channel{index % 1000}"
+    return random.choice(
+        [
+            f"@badge-info=;badges=moderator/1;color=;display-name=hoIy_bot;"
+            f"emote-sets=0,300374282;mod=1;subscriber=0;user-type=mod "
+            f":tmi.twitch.tv USERSTATE #{channel}",
+            f"@emote-only=0;followers-only=-1;r9k=0;room-id=1;slow=0;subs-only=0 "
+            f":tmi.twitch.tv ROOMSTATE #{channel}",
+            f"@ban-duration=600;room-id=1;target-user-id=2;tmi-sent-ts=1700000000000 "
+            f":tmi.twitch.tv CLEARCHAT #{channel} :spammer",
+            f"@badge-info=;badges=;color=;display-name=Sub;emotes=;flags=;id=1;"
+            f"login=sub;mod=0;msg-id=sub;msg-param-cumulative-months=5;room-id=1;"
+            f"subscriber=1;system-msg=Sub\\ssubscribed;tmi-sent-ts=1700000000000;"
+            f"user-id=3;user-type= :tmi.twitch.tv USERNOTICE #{channel} :hi",
+        ]
+    )
+
+
+def load_frames() -> list[str]:
+    if len(sys.argv) > 1:
+        lines = Path(sys.argv[1]).read_text().splitlines()
+    else:
+        random.seed(1)
+        lines = [
+            other(index) if index % 10 == 0 else privmsg(index)
+            for index in range(LINES)
+        ]
+    return [
+        "\r\n".join(lines[index : index + LINES_PER_FRAME]) + "\r\n"
+        for index in range(0, len(lines), LINES_PER_FRAME)
+    ]
+
+
+# Разбор до перехода на irc.parse_frame
+
+
+def legacy_parse_event(message: str) -> dict:
+    idx = 0
+    event = {"text": None, "command": None}
+    if message[idx] == "@":
+        end_idx = message.find(" ")
+        legacy_parse_tags(message[1:end_idx], event)
+        idx = end_idx + 1
+    if message[idx] == ":":
+        idx += 1
+        end_idx = message.find(" ", idx)
+        source_parts = message[idx:end_idx].split("!")
+        event["login"] = source_parts[0] if len(source_parts) == 2 else None
+        idx = end_idx + 1
+    end_idx = message.find(":", idx)
+    if end_idx == -1:
+        end_idx = len(message)
+    command_parts = message[idx:end_idx].strip().split(" ")
+    if command_parts[0] in COMMANDS:
+        event["command"] = command_parts[0]
+        if len(command_parts) == 2:
+            event["channel"] = command_parts[1].replace("#", "")
+    else:
+        return None
+    if end_idx != len(message):
+        idx = end_idx + 1
+        event["text"] = message[idx:]
+    return event
+
+
+def legacy_parse_tags(tags: str, event: dict) -> None:
+    tags_to_ignore = ("client-nonce", "flags", "emote-sets")
+    parsed_tags = tags.split(";")
+    for tag in parsed_tags:
+        parsed_tag = tag.split("=")
+        if parsed_tag[1] in tags_to_ignore:
+            continue
+        elif not parsed_tag[1]:
+            event[parsed_tag[0]] = None
+        elif parsed_tag[0] in ("badges", "badge-info"):
+            event[parsed_tag[0]] = tuple(
+                pair.split("/")[0] for pair in parsed_tag[1].split(",")
+            )
+        elif parsed_tag[0] == "emotes":
+            event[parsed_tag[0]] = {}
+            for emote in parsed_tag[1].split("/"):
+                emote_parts = emote.split(":")
+                event[parsed_tag[0]][emote_parts[0]] = []
+                positions = emote_parts[1].split(",")
+                for position in positions:
+                    position_parts = position.split("-")
+                    event[parsed_tag[0]][emote_parts[0]].append(
+                        {
+                            "start_position": position_parts[0],
+                            "end_position": position_parts[1],
+                        }
+                    )
+        elif parsed_tag[0] in ("first-msg", "mod", "subscriber", "turbo", "emote-only"):
+            event[parsed_tag[0]] = parsed_tag[1] == "1"
+        elif parsed_tag[0] in ("tmi-sent-ts"):
+            event[parsed_tag[0]] = int(parsed_tag[1]) / 1000
+        else:
+            event[parsed_tag[0]] = parsed_tag[1]
+
+
+async def handle(event: dict) -> None:
+    event["user-id"]
+
+
+async def legacy(frames: list[str]) -> None:
+    async def process(line: str) -> None:
+        event = legacy_parse_event(line.strip())
+        if event:
+            await handle(event)
+
+    loop = asyncio.get_running_loop()
+    tasks = []
+    for data in frames:
+        for line in data.split("\r\n"):
+            if line:
+                tasks.append(loop.create_task(process(line)))
+        # Чтение сокета отдаёт управление циклу между кадрами
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+
+async def current(frames: list[str]) -> None:
+    queue = asyncio.Queue()
+
+    async def consume() -> None:
+        while True:
+            for event in await queue.get():
+                await handle(event)
+            queue.task_done()
+
+    consumer = asyncio.create_task(consume())
+    for data in frames:
+        events = parse_frame(data, COMMANDS)
+        if events:
+            queue.put_nowait(events)
+        await asyncio.sleep(0)
+    await queue.join()
+    consumer.cancel()
+
+
+def measure(name: str, frames: list[str], lines: int, run) -> float:
+    asyncio.run(run(frames[:1000]))
+    start = perf_counter()
+    asyncio.run(run(frames))
+    rate = lines / (perf_counter() - start)
+    print(f"{name:<32} {rate:10.0f} lines/s")
+    return rate
+
+
+def main():
+    frames = load_frames()
+    lines = sum(data.count("\r\n") for data in frames)
+    print(f"{lines} lines in {len(frames)} frames")
+    before = measure("per-line tasks, full parse", frames, lines, legacy)
+    after = measure("parse_frame + one consumer", frames, lines, current)
+    print(f"{'speedup':<32} {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
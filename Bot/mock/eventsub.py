@@ -0,0 +1,511 @@
+"""
+Локальный симулятор Twitch EventSub для разработки и нагрузочных тестов бота.
+
+Отдаёт websocket на /ws (welcome, keepalive, notification, session_reconnect,
+revocation) и Helix /eventsub/subscriptions, на который бот создаёт подписки.
+Уведомления channel.chat.message генерируются с заданной скоростью по всем
+подписанным каналам, либо проигрываются из записанного трафика (JSONL, один кадр
+на строку), каналы записи раскладываются по подписанным каналам.
+
+message_id синтетического сообщения чата начинается со времени отправки в
+наносекундах, по нему бенчмарк считает задержку до обработчика.
+
+    python Bot/mock/eventsub.py --rate 5000 --skew 1.0
+    python Bot/mock/eventsub.py --replay frames.jsonl --rate 2000
+
+Управление во время работы:
+
+    POST /control/rate?value=10000
+    POST /control/reconnect[?session=<id>]
+    POST /control/revoke?broadcaster_user_id=<id>
+    GET  /control/stats
+"""
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+from http import HTTPStatus
+from itertools import accumulate, count
+from pathlib import Path
+import random
+from time import monotonic, time, time_ns
+from uuid import uuid4
+
+from aiohttp import WSMsgType, web
+from loguru import logger
+import orjson
+
+KEEPALIVE_TIMEOUT = 10
+# Twitch закрывает старое соединение через 30 секунд после session_reconnect
+RECONNECT_GRACE = 30.0
+TICK = 0.01
+PAGE_SIZE = 100
+TEXTS = ("!song", "Kappa lol", "hello chat", "PogChamp " * 5, "@streamer gg wp")
+
+
+def timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class MockSession:
+    __slots__ = ("id", "ws", "url", "subscriptions", "last_sent", "keepalive")
+
+    def __init__(self, ws: web.WebSocketResponse, url: str) -> None:
+        self.id = str(uuid4())
+        self.ws = ws
+        # Адрес для reconnect_url, тот же хост, к которому подключился клиент
+        self.url = url
+        # broadcaster_id -> subscription
+        self.subscriptions: dict[str, dict] = {}
+        self.last_sent = monotonic()
+        self.keepalive: asyncio.Task | None = None
+
+
+class Simulator:
+    def __init__(
+        self,
+        rate: float = 0.0,
+        skew: float = 1.0,
+        replay: list[dict] | None = None,
+        reconnect_every: float = 0.0,
+        helix_limit: int = 0,
+        keepalive_timeout: int = KEEPALIVE_TIMEOUT,
+    ) -> None:
+        self.rate = rate
+        self.sent = 0
+        self.__skew = skew
+        self.__replay = replay
+        self.__reconnect_every = reconnect_every
+        self.__helix_limit = helix_limit
+        self.__helix_window = (0.0, 0)
+        self.__keepalive_timeout = keepalive_timeout
+        self.__sessions: dict[str, MockSession] = {}
+        self.__subscriptions: dict[str, dict] = {}
+        # Подписки на чат, из которых выбираются каналы для сообщений
+        self.__targets: list[tuple[MockSession, dict]] = []
+        self.__weights: list[float] = []
+        self.__dirty = False
+        self.__sequence = count()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/ws", self.__websocket)
+        app.router.add_route("*", "/eventsub/subscriptions", self.__helix)
+        app.router.add_post("/control/rate", self.__set_rate)
+        app.router.add_post("/control/reconnect", self.__control_reconnect)
+        app.router.add_post("/control/revoke", self.__control_revoke)
+        app.router.add_get("/control/stats", self.__stats)
+        app.on_startup.append(self.__start)
+        app.on_cleanup.append(self.__stop)
+        return app
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "rate": self.rate,
+            "sent": self.sent,
+            "sessions": len(self.__sessions),
+            "subscriptions": sum(
+                len(session.subscriptions) for session in self.__sessions.values()
+            ),
+        }
+
+    # Frames
+
+    def __frame(self, message_type: str, payload: dict, **metadata) -> bytes:
+        return orjson.dumps(
+            {
+                "metadata": {
+                    "message_id": str(next(self.__sequence)),
+                    "message_type": message_type,
+                    "message_timestamp": timestamp(),
+                    **metadata,
+                },
+                "payload": payload,
+            }
+        )
+
+    def __session_frame(
+        self, message_type: str, session: MockSession, reconnect_url: str | None
+    ) -> bytes:
+        return self.__frame(
+            message_type,
+            {
+                "session": {
+                    "id": session.id,
+                    "status": "reconnecting" if reconnect_url else "connected",
+                    "connected_at": timestamp(),
+                    "keepalive_timeout_seconds": (
+                        None if reconnect_url else self.__keepalive_timeout
+                    ),
+                    "reconnect_url": reconnect_url,
+                }
+            },
+        )
+
+    def __chat_frame(self, subscription: dict, event: dict | None = None) -> bytes:
+        sequence = next(self.__sequence)
+        broadcaster_id = subscription["condition"]["broadcaster_user_id"]
+        if event is None:
+            chatter = str(500000 + sequence % 20000)
+            text = random.choice(TEXTS)
+            event = {
+                "broadcaster_user_login": f"channel{broadcaster_id}",
+                "broadcaster_user_name": f"Channel{broadcaster_id}",
+                "chatter_user_id": chatter,
+                "chatter_user_login": f"user{chatter}",
+                "chatter_user_name": f"User{chatter}",
+                "message": {
+                    "text": text,
+                    "fragments": [
+                        {
+                            "type": "text",
+                            "text": text,
+                            "cheermote": None,
+                            "emote": None,
+                            "mention": None,
+                        }
+                    ],
+                },
+                "color": "#00FF7F",
+                "badges": [{"set_id": "subscriber", "id": "12", "info": "14"}],
+                "message_type": "text",
+                "cheer": None,
+                "reply": None,
+                "channel_points_custom_reward_id": None,
+                "source_broadcaster_user_id": None,
+                "source_broadcaster_user_login": None,
+                "source_broadcaster_user_name": None,
+                "source_message_id": None,
+                "source_badges": None,
+                "is_source_only": False,
+            }
+        event = {
+            **event,
+            "broadcaster_user_id": broadcaster_id,
+            "message_id": f"{time_ns()}-{sequence}",
+        }
+        return orjson.dumps(
+            {
+                "metadata": {
+                    "message_id": str(sequence),
+                    "message_type": "notification",
+                    "message_timestamp": timestamp(),
+                    "subscription_type": subscription["type"],
+                    "subscription_version": subscription["version"],
+                },
+                "payload": {"subscription": subscription, "event": event},
+            }
+        )
+
+    async def __send(self, session: MockSession, data: bytes) -> None:
+        session.last_sent = monotonic()
+        try:
+            await session.ws.send_frame(data, WSMsgType.TEXT)
+        except ConnectionError:
+            pass
+
+    # Websocket
+
+    async def __websocket(self, request: web.Request) -> web.WebSocketResponse:
+        # Без permessage-deflate, иначе бенчмарк меряет в основном zlib
+        ws = web.WebSocketResponse(compress=False)
+        await ws.prepare(request)
+
+        session = self.__sessions.get(request.query.get("reconnect"))
+        if session is None:
+            session = MockSession(ws, f"ws://{request.host}/ws")
+            self.__sessions[session.id] = session
+            session.keepalive = asyncio.create_task(self.__keepalive(session))
+        else:
+            # Новое соединение получает ту же сессию вместе с подписками
+            old, session.ws = session.ws, ws
+            asyncio.get_running_loop().call_later(RECONNECT_GRACE, self.__expire, old)
+        await self.__send(
+            session, self.__session_frame("session_welcome", session, None)
+        )
+
+        async for message in ws:
+            if message.type is not WSMsgType.CLOSE:
+                # Twitch не принимает входящие сообщения
+                await ws.close(code=4001)
+
+        if session.ws is ws:
+            self.__disconnect(session)
+        return ws
+
+    def __expire(self, ws: web.WebSocketResponse) -> None:
+        if not ws.closed:
+            asyncio.create_task(ws.close(code=4004))
+
+    def __disconnect(self, session: MockSession) -> None:
+        del self.__sessions[session.id]
+        if session.keepalive is not None:
+            session.keepalive.cancel()
+        for subscription in session.subscriptions.values():
+            subscription["status"] = "websocket_disconnected"
+        session.subscriptions.clear()
+        self.__dirty = True
+
+    async def __keepalive(self, session: MockSession) -> None:
+        while True:
+            delay = session.last_sent + self.__keepalive_timeout * 0.8 - monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            await self.__send(session, self.__frame("session_keepalive", {}))
+
+    async def reconnect(self, session: MockSession) -> None:
+        frame = self.__session_frame(
+            "session_reconnect", session, f"{session.url}?reconnect={session.id}"
+        )
+        await self.__send(session, frame)
+
+    async def revoke(self, broadcaster_id: str, status: str = "authorization_revoked"):
+        for session in self.__sessions.values():
+            subscription = session.subscriptions.pop(broadcaster_id, None)
+            if subscription is not None:
+                subscription["status"] = status
+                self.__dirty = True
+                frame = self.__frame(
+                    "revocation",
+                    {"subscription": subscription},
+                    subscription_type=subscription["type"],
+                    subscription_version=subscription["version"],
+                )
+                await self.__send(session, frame)
+
+    # Traffic
+
+    def __refresh_targets(self) -> None:
+        self.__targets = [
+            (session, subscription)
+            for session in self.__sessions.values()
+            for subscription in session.subscriptions.values()
+            if subscription["type"] == "channel.chat.message"
+        ]
+        # Чат распределён неравномерно: несколько больших каналов дают основную часть
+        self.__weights = list(
+            accumulate(
+                1 / (rank + 1) ** self.__skew for rank in range(len(self.__targets))
+            )
+        )
+        self.__dirty = False
+
+    async def __generate(self) -> None:
+        replay = self.__replay
+        last = monotonic()
+        due = 0.0
+        position = 0
+        while True:
+            await asyncio.sleep(TICK)
+            now = monotonic()
+            due += self.rate * (now - last)
+            last = now
+            if self.__dirty:
+                self.__refresh_targets()
+            if not self.__targets or not self.rate:
+                due = 0.0
+                continue
+
+            batch = int(due)
+            due -= batch
+            if replay:
+                for _ in range(batch):
+                    event = replay[position % len(replay)]
+                    position += 1
+                    # Каналы записи раскладываются по подписанным каналам
+                    target = hash(event["broadcaster_user_id"]) % len(self.__targets)
+                    session, subscription = self.__targets[target]
+                    await self.__send(session, self.__chat_frame(subscription, event))
+            else:
+                targets = random.choices(
+                    self.__targets, cum_weights=self.__weights, k=batch
+                )
+                for session, subscription in targets:
+                    await self.__send(session, self.__chat_frame(subscription))
+            self.sent += batch
+
+    async def __reconnect_all(self) -> None:
+        while True:
+            await asyncio.sleep(self.__reconnect_every)
+            for session in list(self.__sessions.values()):
+                await self.reconnect(session)
+
+    async def __start(self, app: web.Application) -> None:
+        app["tasks"] = [asyncio.create_task(self.__generate())]
+        if self.__reconnect_every:
+            app["tasks"].append(asyncio.create_task(self.__reconnect_all()))
+
+    async def __stop(self, app: web.Application) -> None:
+        for task in app["tasks"]:
+            task.cancel()
+
+    # Helix
+
+    def __limit(self, response: web.Response) -> web.Response:
+        if self.__helix_limit:
+            reset, remaining = self.__helix_window
+            response.headers["Ratelimit-Limit"] = str(self.__helix_limit)
+            response.headers["Ratelimit-Remaining"] = str(remaining)
+            response.headers["Ratelimit-Reset"] = str(int(reset))
+        return response
+
+    def __take(self) -> bool:
+        if not self.__helix_limit:
+            return True
+        reset, remaining = self.__helix_window
+        if time() >= reset:
+            reset, remaining = time() + 60, self.__helix_limit
+        if remaining <= 0:
+            return False
+        self.__helix_window = (reset, remaining - 1)
+        return True
+
+    def __error(self, status: int, message: str) -> web.Response:
+        return self.__limit(
+            web.json_response(
+                {
+                    "error": HTTPStatus(status).phrase,
+                    "status": status,
+                    "message": message,
+                },
+                status=status,
+            )
+        )
+
+    async def __helix(self, request: web.Request) -> web.Response:
+        if not self.__take():
+            return self.__error(429, "Too Many Requests")
+        if request.method == "GET":
+            return self.__list(request)
+        if request.method == "POST":
+            return await self.__create(request)
+        if request.method == "DELETE":
+            return self.__delete(request)
+        return self.__error(405, "Method Not Allowed")
+
+    def __list(self, request: web.Request) -> web.Response:
+        subscriptions = [
+            subscription
+            for subscription in self.__subscriptions.values()
+            if request.query.get("type") in (None, subscription["type"])
+            and request.query.get("status") in (None, subscription["status"])
+        ]
+        start = int(request.query.get("after", 0))
+        end = start + PAGE_SIZE
+        return self.__limit(
+            web.json_response(
+                {
+                    "data": subscriptions[start:end],
+                    "total": len(subscriptions),
+                    "pagination": (
+                        {"cursor": str(end)} if end < len(subscriptions) else {}
+                    ),
+                }
+            )
+        )
+
+    async def __create(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        session = self.__sessions.get(body["transport"].get("session_id"))
+        if session is None:
+            return self.__error(400, "websocket transport session does not exist")
+
+        broadcaster_id = body["condition"]["broadcaster_user_id"]
+        if broadcaster_id in session.subscriptions:
+            return self.__error(409, "subscription already exists")
+
+        subscription = {
+            "id": str(uuid4()),
+            "status": "enabled",
+            "type": body["type"],
+            "version": body["version"],
+            "condition": body["condition"],
+            "created_at": timestamp(),
+            "transport": {
+                "method": "websocket",
+                "session_id": session.id,
+                "connected_at": timestamp(),
+            },
+            "cost": 0,
+        }
+        self.__subscriptions[subscription["id"]] = subscription
+        session.subscriptions[broadcaster_id] = subscription
+        self.__dirty = True
+        return self.__limit(web.json_response({"data": [subscription]}, status=202))
+
+    def __delete(self, request: web.Request) -> web.Response:
+        subscription = self.__subscriptions.pop(request.query.get("id"), None)
+        if subscription is None:
+            return self.__error(404, "subscription not found")
+
+        session = self.__sessions.get(subscription["transport"]["session_id"])
+        if session is not None:
+            broadcaster_id = subscription["condition"]["broadcaster_user_id"]
+            if session.subscriptions.get(broadcaster_id) is subscription:
+                del session.subscriptions[broadcaster_id]
+                self.__dirty = True
+        return self.__limit(web.Response(status=204))
+
+    # Control
+
+    async def __set_rate(self, request: web.Request) -> web.Response:
+        self.rate = float(request.query["value"])
+        logger.info(f"Rate set to {self.rate:.0f} msgs/s")
+        return web.json_response(self.stats())
+
+    async def __control_reconnect(self, request: web.Request) -> web.Response:
+        session_id = request.query.get("session")
+        for session in list(self.__sessions.values()):
+            if session_id in (None, session.id):
+                await self.reconnect(session)
+        return web.json_response(self.stats())
+
+    async def __control_revoke(self, request: web.Request) -> web.Response:
+        await self.revoke(
+            request.query["broadcaster_user_id"],
+            request.query.get("status", "authorization_revoked"),
+        )
+        return web.json_response(self.stats())
+
+    async def __stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+
+def load_replay(path: Path) -> list[dict]:
+    """События channel.chat.message из записанных кадров, остальные кадры пропускаются"""
+    events = []
+    for line in path.read_bytes().splitlines():
+        if not line.strip():
+            continue
+        message = orjson.loads(line)
+        if message["metadata"]["message_type"] == "notification":
+            event = message["payload"].get("event")
+            if event and "broadcaster_user_id" in event:
+                events.append(event)
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Twitch EventSub simulator")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--rate", type=float, default=0.0, help="chat msgs/s")
+    parser.add_argument("--skew", type=float, default=1.0, help="0 is uniform")
+    parser.add_argument("--replay", type=Path, help="recorded frames, JSONL")
+    parser.add_argument("--reconnect-every", type=float, default=0.0)
+    parser.add_argument("--helix-limit", type=int, default=0, help="requests/min")
+    args = parser.parse_args()
+
+    simulator = Simulator(
+        rate=args.rate,
+        skew=args.skew,
+        replay=load_replay(args.replay) if args.replay else None,
+        reconnect_every=args.reconnect_every,
+        helix_limit=args.helix_limit,
+    )
+    web.run_app(simulator.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import asyncio
 import os
 import sys
 import logging
+from pathlib import Path
 from asyncio import CancelledError
 from typing import Literal
 
@@ -16,7 +17,8 @@ from websockets.exceptions import (
 
 from kafkaclient import Client
 from .channels import Channels
-
+from .irc import IrcEvent, parse_frame
+from .outbound import Outbound, Priority
 
 load_dotenv(".env")
 
@@ -30,6 +32,10 @@ LOOP = asyncio.new_event_loop()
 TOKEN = os.getenv("twitch_token")
 MONGODB_USERNAME = os.getenv("mongodb_username")
 MONGODB_PASSWORD = os.getenv("mongodb_password")
+# Верифицированным ботам Twitch разрешает 2000 JOIN за 10 секунд вместо 20
+VERIFIED = os.getenv("twitch_verified") == "1"
+# Снимок каналов для быстрого старта без чтения всей таблицы users
+CHANNELS_SNAPSHOT = Path(os.getenv("channels_snapshot", "channels.json"))
 asyncio.set_event_loop(LOOP)
 
 client = Client("twitchbot", LOOP)
@@ -50,11 +56,15 @@ class TwitchBot:
             connect=False,
         )["holy_bot"]
 
-        self.channels = Channels(self)
+        self.channels = Channels(self, verified=VERIFIED, snapshot=CHANNELS_SNAPSHOT)
         # self.timer = Timer(self)
 
         self.connected: asyncio.Event = asyncio.Event()
         self.thread_task: asyncio.Task = None
+        # Разобранные кадры, их по порядку обрабатывает одна задача
+        self.events: asyncio.Queue[list[IrcEvent]] = asyncio.Queue()
+        self.consumer_task: asyncio.Task = None
+        self.outbound = Outbound(self._send_privmsg)
         self._internal_events = {
             "PRIVMSG": self._privmsg,
             "PING": self._ping,
@@ -62,6 +72,7 @@ class TwitchBot:
             "JOIN": self._join,
             "PART": self._part,
             "GLOBALUSERSTATE": self._globaluserstate,
+            "USERSTATE": self._userstate,
         }
 
     # Start and connect
@@ -78,6 +89,9 @@ class TwitchBot:
     async def close(self):
         if self.thread_task:
             self.thread_task.cancel()
+        if self.consumer_task:
+            self.consumer_task.cancel()
+        self.outbound.stop()
         if self.ws:
             await self.ws.close()
         await client.stop()
@@ -112,6 +126,9 @@ class TwitchBot:
         await self._send(f"PASS oauth:{self.token}")
         await self._send(f"NICK {KAPPA}")
         await self.channels.join_all_channels()
+        if self.consumer_task is None:
+            self.consumer_task = self.loop.create_task(self._consume())
+        self.outbound.start()
         self.thread_task = self.loop.create_task(self._thread())
 
     # Heart
@@ -123,11 +140,10 @@ class TwitchBot:
             while True:
                 data = await self.ws.recv()
                 if data:
-                    for event in data.split("\r\n"):
-                        if not event:
-                            continue
-                        logger.trace(f"< {event}")
-                        self.loop.create_task(self._process_event(event))
+                    logger.trace(f"< {data}")
+                    events = parse_frame(data, self._internal_events)
+                    if events:
+                        self.events.put_nowait(events)
                 else:
                     logger.error("Соединение скорее всего закрыто.")
                     raise Exception("CONNECTION CLOSED")
@@ -138,26 +154,28 @@ class TwitchBot:
             self.connected.clear()
             await self._connect()
 
-    async def _process_event(self, data: str) -> None:
-        data = data.strip()
-        parsed = self._parse_event(data)
-        if not parsed:
-            return
-        command = parsed["command"]
-        try:
-            await self._internal_events[command](parsed)
-        except Exception as e:
-            logger.exception(e)
+    async def _consume(self) -> None:
+        while True:
+            for event in await self.events.get():
+                try:
+                    await self._internal_events[event["command"]](event)
+                except Exception as e:
+                    logger.exception(e)
 
     # Sending messages
 
-    async def send_chat_message_by_id(self, text: str, id: str = None):
+    async def send_chat_message_by_id(
+        self, text: str, id: str = None, priority: Priority = Priority.COMMAND
+    ):
         channel = self.channels.get(id)
-        login = channel["login"]
-        await self.send_chat_message(text, login)
+        login = channel.login
+        await self.send_chat_message(text, login, priority)
 
-    async def send_chat_message(self, text: str, login: str):
-        await self._send_privmsg(text, login)
+    async def send_chat_message(
+        self, text: str, login: str, priority: Priority = Priority.COMMAND
+    ):
+        """Ставит сообщение в очередь outbound, оно уйдёт с учётом лимитов Twitch"""
+        self.outbound.send(login, text.strip()[:499], priority)
 
     async def _send(self, data: str) -> None:
         try:
@@ -181,13 +199,11 @@ class TwitchBot:
             logins = []
         if ids:
             for id in ids:
-                login = (await self.channels.get_from_db(id=id))["login"]
+                login = (await self.channels.get_from_db(id=id)).login
                 logins.append(login)
         if not init:
             self.channels.init_statuses(logins)
-        join = ",".join(f"#{login}" for login in logins)
-        if join:
-            await self._send(f"JOIN {join}")
+        await self.channels.join(logins)
         if not init:
             statuses = await self.channels.get_statuses(logins)
             return statuses
@@ -201,88 +217,15 @@ class TwitchBot:
                 self.channels.pop(login=login)
         if ids:
             for id in ids:
-                login = self.channels.pop(id=id)["login"]
+                login = self.channels.pop(id=id).login
                 logins.append(login)
         part = ",".join(f"#{login}" for login in logins)
         if part:
             await self._send(f"PART {part}")
 
-    # Parsing events
-
-    def _parse_event(self, message: str) -> dict:
-        idx = 0
-        event = {"text": None, "command": None}
-        # Tags
-        if message[idx] == "@":
-            end_idx = message.find(" ")
-            self._parse_tags(message[1:end_idx], event)
-            idx = end_idx + 1
-        # Source
-        if message[idx] == ":":
-            idx += 1
-            end_idx = message.find(" ", idx)
-            source_parts = message[idx:end_idx].split("!")
-            event["login"] = source_parts[0] if len(source_parts) == 2 else None
-            idx = end_idx + 1
-        end_idx = message.find(":", idx)
-        if end_idx == -1:
-            end_idx = len(message)
-        command_parts = message[idx:end_idx].strip().split(" ")
-        if command_parts[0] in self._internal_events:
-            event["command"] = command_parts[0]
-            if len(command_parts) == 2:
-                event["channel"] = command_parts[1].replace("#", "")
-        else:
-            return None
-        if end_idx != len(message):
-            idx = end_idx + 1
-            event["text"] = message[idx:]
-        return event
-
-    @staticmethod
-    def _parse_tags(tags: str, event: dict) -> None:
-        tags_to_ignore = ("client-nonce", "flags", "emote-sets")
-        parsed_tags = tags.split(";")
-        for tag in parsed_tags:
-            parsed_tag = tag.split("=")
-            if parsed_tag[1] in tags_to_ignore:
-                continue
-            elif not parsed_tag[1]:
-                event[parsed_tag[0]] = None
-            elif parsed_tag[0] in ("badges", "badge-info"):
-                event[parsed_tag[0]] = tuple(
-                    pair.split("/")[0] for pair in parsed_tag[1].split(",")
-                )
-            elif parsed_tag[0] == "emotes":
-                event[parsed_tag[0]] = {}
-                for emote in parsed_tag[1].split("/"):
-                    emote_parts = emote.split(":")
-                    event[parsed_tag[0]][emote_parts[0]] = []
-                    positions = emote_parts[1].split(",")
-                    for position in positions:
-                        position_parts = position.split("-")
-                        event[parsed_tag[0]][emote_parts[0]].append(
-                            {
-                                "start_position": position_parts[0],
-                                "end_position": position_parts[1],
-                            }
-                        )
-            elif parsed_tag[0] in (
-                "first-msg",
-                "mod",
-                "subscriber",
-                "turbo",
-                "emote-only",
-            ):
-                event[parsed_tag[0]] = parsed_tag[1] == "1"
-            elif parsed_tag[0] in ("tmi-sent-ts"):
-                event[parsed_tag[0]] = int(parsed_tag[1]) / 1000
-            else:
-                event[parsed_tag[0]] = parsed_tag[1]
-
     # Events
 
-    async def _privmsg(self, parsed: dict) -> None:
+    async def _privmsg(self, parsed: IrcEvent) -> None:
         if parsed["user-id"] == self.bot["user-id"]:
             return
         # await self.commands.execute_command(parsed)
@@ -328,7 +271,15 @@ class TwitchBot:
                 {"login": parsed["channel"]}, {"$set": {"bot_enabled": False}}
             )
 
+    async def _userstate(self, parsed: IrcEvent) -> None:
+        # Приходит после входа в канал и после каждого нашего сообщения
+        badges = parsed.get("badges") or ()
+        self.outbound.set_moderator(
+            parsed["channel"],
+            bool(parsed.get("mod")) or "broadcaster" in badges or "vip" in badges,
+        )
+
     async def _globaluserstate(self, parsed: dict) -> None:
-        self.bot.update(parsed)
+        self.bot.update(parsed.decoded())
         self.bot["login"] = self.bot["display-name"].lower()
         logger.info(f"Успешно залогинился как {self.bot['display-name']}")
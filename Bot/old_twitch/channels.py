@@ -1,57 +1,193 @@
 from typing import TYPE_CHECKING
 import asyncio
+from pathlib import Path
+from time import monotonic, time
 
+from loguru import logger
+
+from .outbound import SlidingWindow
+from .registry import Change, Channel, ChannelRegistry
 
 if TYPE_CHECKING:
     from twitchbot.holybot import HolyBot
 
+# Лимит Twitch на попытки JOIN считается на аккаунт, а не на соединение
+JOIN_LIMIT = 20
+VERIFIED_JOIN_LIMIT = 2000
+JOIN_WINDOW = 10.0
+# Запас на задержку сети, чтобы JOIN не попали в одно окно на стороне Twitch
+JOIN_SAFETY = 0.5
+# Каналов в одной команде JOIN
+JOIN_BATCH = 20
+PROGRESS_INTERVAL = 10.0
+PROJECTION = {"_id": True, "login": True}
+# Снимок старше этого считается устаревшим и каналы читаются из базы
+SNAPSHOT_TTL = 24 * 60 * 60.0
+# Изменения копятся, чтобы не переписывать снимок на каждый JOIN и PART
+SNAPSHOT_DELAY = 5.0
+
 
 class Channels:
-    def __init__(self, bot: "HolyBot") -> None:
+    def __init__(
+        self, bot: "HolyBot", verified: bool = False, snapshot: Path | None = None
+    ) -> None:
         self.bot = bot
         self.db = bot.db.users
         self.loop = bot.loop
         self._statuses: dict[str, asyncio.Future] = {}
-        self._channels_by_id: dict[str, dict] = {}
-        self._channels_by_login: dict[str, dict] = {}
-        self._channels: list[dict] = []
-        self.loop.create_task(self._async_init())
+        self.registry = ChannelRegistry()
+        self._snapshot = snapshot
+        self._snapshot_handle: asyncio.TimerHandle | None = None
+        # Каналы взяты из снимка и ещё не сверены с базой
+        self._stale = False
+        self._init_task = self.loop.create_task(self._async_init())
+
+        # Окно переживает переподключения, повторный вход не превышает лимит
+        self._join_rate = SlidingWindow(
+            VERIFIED_JOIN_LIMIT if verified else JOIN_LIMIT, JOIN_WINDOW + JOIN_SAFETY
+        )
+        self._join_task: asyncio.Task | None = None
+        self._join_started = 0.0
+        self._join_total = 0
+        self._join_sent = 0
+        self._joined: set[str] = set()
+        self._failed: set[str] = set()
 
     def __iter__(self):
-        return self._channels.__iter__()
+        return iter(self.registry)
 
     async def _async_init(self):
-        async for user in self.db.find({"bot_enabled": True}):
-            if user not in self._channels:
-                self._channels.append(user)
-            self._channels_by_id[user["_id"]] = user
-            self._channels_by_login[user["login"]] = user
+        snapshot = self._snapshot
+        if (
+            snapshot is not None
+            and snapshot.exists()
+            and time() - snapshot.stat().st_mtime < SNAPSHOT_TTL
+        ):
+            self.registry.load(snapshot)
+            self._stale = True
+            logger.info(f"Загружено {len(self.registry)} каналов из {snapshot}")
+        else:
+            async for user in self.db.find({"bot_enabled": True}, PROJECTION):
+                self.registry.add(Channel.from_document(user))
+            self._save_snapshot()
+        if snapshot is not None:
+            self.registry.subscribe(self._schedule_snapshot)
 
-    async def join_all_channels(self):
-        for i in range(len(self._channels))[::20]:
-            await self.bot.join_channels(
-                logins=list(channel["login"] for channel in self._channels[i : i + 20]),
-                init=True,
+    def _schedule_snapshot(self, change: Change, channel: Channel):
+        if self._snapshot_handle is None:
+            self._snapshot_handle = self.loop.call_later(
+                SNAPSHOT_DELAY, self._save_snapshot
             )
-            await asyncio.sleep(11.0)
 
-    async def get_from_db(self, **kwargs) -> dict | None:
+    def _save_snapshot(self):
+        self._snapshot_handle = None
+        if self._snapshot is not None:
+            self.registry.save(self._snapshot)
+
+    async def join_all_channels(self):
+        """
+        Запускает вход во все каналы в фоне и сразу возвращается.
+
+        Новое соединение IRC не помнит каналы, поэтому после переподключения прошлый
+        план останавливается и начинается новый, а окно лимита остаётся общим.
+        """
+        if self._join_task is not None:
+            self._join_task.cancel()
+        self._joined.clear()
+        self._failed.clear()
+        self._join_task = self.loop.create_task(self._join_all())
+
+    async def join(self, logins: list[str]) -> None:
+        """Отправляет JOIN пачками так быстро, как позволяет лимит Twitch"""
+        index = 0
+        while index < len(logins):
+            now = monotonic()
+            delay = self._join_rate.delay(now)
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            batch = []
+            while (
+                index < len(logins)
+                and len(batch) < JOIN_BATCH
+                and not self._join_rate.delay(now)
+            ):
+                self._join_rate.take(now)
+                batch.append(logins[index])
+                index += 1
+            self._join_sent += len(batch)
+            await self.bot._send("JOIN " + ",".join(f"#{login}" for login in batch))
+
+    def progress(self) -> dict[str, int | float | None]:
+        elapsed = monotonic() - self._join_started if self._join_started else 0.0
+        rate = self._join_rate.limit / self._join_rate.window
+        return {
+            "total": self._join_total,
+            "sent": self._join_sent,
+            "joined": len(self._joined),
+            "failed": len(self._failed),
+            "elapsed": round(elapsed, 1),
+            "eta": round(max(self._join_total - self._join_sent, 0) / rate, 1),
+        }
+
+    async def _join_all(self):
+        await self._init_task
+        logins = [channel.login for channel in self.registry]
+        self._join_total = len(logins)
+        self._join_sent = 0
+        self._join_started = monotonic()
+        reporter = self.loop.create_task(self._report_progress())
+        try:
+            await self.join(logins)
+            if self._stale:
+                self._stale = False
+                await self._refresh()
+            # Подтверждения приходят уже после последнего JOIN
+            await asyncio.sleep(JOIN_WINDOW)
+        finally:
+            reporter.cancel()
+        logger.info(f"Вход в каналы завершён: {self.progress()}")
+
+    async def _refresh(self):
+        """Догоняет изменения в базе, случившиеся пока бот был выключен"""
+        missing = {channel.id for channel in self.registry}
+        added = []
+        async for user in self.db.find({"bot_enabled": True}, PROJECTION):
+            channel = Channel.from_document(user)
+            if channel.id not in self.registry:
+                added.append(channel.login)
+            missing.discard(channel.id)
+            self.registry.add(channel)
+        removed = [self.registry.get(id=id).login for id in missing]
+        if added:
+            await self.bot.join_channels(logins=added, init=True)
+        if removed:
+            await self.bot.leave_channels(logins=removed)
+        logger.info(f"Снимок каналов сверен с базой: +{len(added)} -{len(removed)}")
+
+    async def _report_progress(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            logger.info(f"Вход в каналы: {self.progress()}")
+
+    async def get_from_db(self, **kwargs) -> Channel | None:
         if "id" in kwargs:
             kwargs["_id"] = kwargs.pop("id")
         user = await self.db.find_one(kwargs)
         if not user:
             return None
-        if user not in self._channels:
-            self._channels.append(user)
-        self._channels_by_id[user["_id"]] = user
-        self._channels_by_login[user["login"]] = user
-        return user
+        return self.registry.add(Channel.from_document(user))
 
     def init_statuses(self, logins: list[str]):
         for login in logins:
             self._statuses[login] = self.loop.create_future()
 
     def set_status(self, login: str, status: dict):
+        if status["success"]:
+            self._joined.add(login)
+        else:
+            self._failed.add(login)
         if login in self._statuses:
             self._statuses[login].set_result(status)
 
@@ -66,23 +202,8 @@ class Channels:
             results[login] = result
         return results
 
-    def get(self, id: str = None, login: str = None) -> dict:
-        if id and id in self._channels_by_id:
-            return self._channels_by_id.get(id)
-        elif login and login in self._channels_by_login:
-            return self._channels_by_login.get(login)
-        return None
-
-    def pop(self, id: str = None, login: str = None) -> dict | None:
-        user = None
-        if id:
-            user = self._channels_by_id.get(id, None)
-        elif login:
-            user = self._channels_by_login.get(login, None)
-        if not user:
-            return None
-        self._channels_by_id.pop(user["_id"], None)
-        self._channels_by_login.pop(user["login"], None)
-        if user in self._channels:
-            self._channels.remove(user)
-        return user
+    def get(self, id: str = None, login: str = None) -> Channel | None:
+        return self.registry.get(id, login)
+
+    def pop(self, id: str = None, login: str = None) -> Channel | None:
+        return self.registry.remove(id, login)
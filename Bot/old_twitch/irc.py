@@ -0,0 +1,129 @@
+from sys import intern
+from typing import Container
+
+TAGS_TO_IGNORE = frozenset(("client-nonce", "flags", "emote-sets"))
+BOOL_TAGS = frozenset(("first-msg", "mod", "subscriber", "turbo", "emote-only"))
+
+
+def decode_badges(value: str) -> tuple[str, ...]:
+    return tuple(pair.partition("/")[0] for pair in value.split(","))
+
+
+def decode_emotes(value: str) -> dict[str, list[dict[str, str]]]:
+    emotes = {}
+    for emote in value.split("/"):
+        emote_id, _, positions = emote.partition(":")
+        emotes[emote_id] = [
+            {"start_position": start, "end_position": end}
+            for start, _, end in (
+                position.partition("-") for position in positions.split(",")
+            )
+        ]
+    return emotes
+
+
+# Теги, которые разбираются только при первом обращении
+LAZY_TAGS = {
+    "badges": decode_badges,
+    "badge-info": decode_badges,
+    "emotes": decode_emotes,
+}
+
+
+class IrcEvent(dict):
+    """
+    Разобранная строка IRC.
+
+    badges, badge-info и emotes хранятся строкой, пока их не запросят: большинство
+    обработчиков их не читает.
+    """
+
+    __slots__ = ("lazy",)
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.lazy: dict[str, str] | None = None
+
+    def __missing__(self, key: str):
+        lazy = self.lazy
+        if lazy is None or key not in lazy:
+            raise KeyError(key)
+        value = self[key] = LAZY_TAGS[key](lazy.pop(key))
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return dict.__contains__(self, key) or (
+            self.lazy is not None and key in self.lazy
+        )
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def decoded(self) -> dict:
+        """Обычный словарь со всеми разобранными тегами"""
+        for key in list(self.lazy or ()):
+            self[key]
+        return dict(self)
+
+
+def parse_frame(data: str, commands: Container[str]) -> list[IrcEvent]:
+    """
+    Разбирает все строки кадра websocket за один проход.
+
+    Команда определяется до разбора тегов, строки с командами не из commands
+    отбрасываются сразу. Ключи тегов интернируются, поэтому одинаковые ключи
+    всех событий ссылаются на одну строку.
+    """
+    events = []
+    for line in data.split("\r\n"):
+        if not line:
+            continue
+
+        idx = 0
+        tags = None
+        if line[0] == "@":
+            idx = line.find(" ") + 1
+            tags = line[1 : idx - 1]
+        source = None
+        if line[idx] == ":":
+            end_idx = line.find(" ", idx)
+            source = line[idx + 1 : end_idx]
+            idx = end_idx + 1
+        text_idx = line.find(":", idx)
+        command_parts = (line[idx:text_idx] if text_idx != -1 else line[idx:]).split()
+        if not command_parts or command_parts[0] not in commands:
+            continue
+
+        event = IrcEvent()
+        event["command"] = command_parts[0]
+        event["text"] = line[text_idx + 1 :] if text_idx != -1 else None
+        if len(command_parts) == 2:
+            event["channel"] = command_parts[1].replace("#", "")
+        if source is not None:
+            name, separator, _ = source.partition("!")
+            event["login"] = name if separator else None
+
+        if tags:
+            lazy = None
+            for tag in tags.split(";"):
+                key, _, value = tag.partition("=")
+                if key in TAGS_TO_IGNORE:
+                    continue
+                key = intern(key)
+                if not value:
+                    event[key] = None
+                elif key in LAZY_TAGS:
+                    if lazy is None:
+                        lazy = event.lazy = {}
+                    lazy[key] = value
+                elif key in BOOL_TAGS:
+                    event[key] = value == "1"
+                elif key == "tmi-sent-ts":
+                    event[key] = int(value) / 1000
+                else:
+                    event[key] = value
+        events.append(event)
+    return events
@@ -0,0 +1,218 @@
+import asyncio
+from collections import OrderedDict, deque
+from enum import IntEnum
+from time import monotonic
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+# Лимиты Twitch на PRIVMSG: 20 сообщений за 30 секунд, если бот не модератор
+# канала, 100 за 30 секунд, если модератор, и не чаще раза в секунду в канал без модерки
+WINDOW = 30.0
+GLOBAL_LIMIT = 100
+REGULAR_LIMIT = 20
+CHANNEL_INTERVAL = 1.0
+# Запас на задержку сети, чтобы сообщения не попали в одно окно на стороне Twitch
+SAFETY = 1.0
+# Twitch отбрасывает сообщение, совпадающее с предыдущим за последние 30 секунд
+DUPLICATE_WINDOW = 30.0
+MAX_DEPTH = 1000
+DEPTH_WARNING = 100
+
+Send = Callable[[str, str], Awaitable[None]]
+
+
+class Priority(IntEnum):
+    MODERATION = 0
+    COMMAND = 1
+    TIMER = 2
+
+
+# Сколько сообщение может ждать в очереди, после этого ответ уже не нужен
+TTL = {Priority.MODERATION: None, Priority.COMMAND: 30.0, Priority.TIMER: 60.0}
+
+
+class SlidingWindow:
+    """Не больше limit событий за window секунд, считается по времени каждого события"""
+
+    __slots__ = ("limit", "window", "times")
+
+    def __init__(self, limit: int, window: float) -> None:
+        self.limit = limit
+        self.window = window
+        self.times: deque[float] = deque(maxlen=limit)
+
+    def delay(self, now: float) -> float:
+        if len(self.times) < self.limit:
+            return 0.0
+        return max(self.times[0] + self.window - now, 0.0)
+
+    def take(self, now: float) -> None:
+        self.times.append(now)
+
+
+class Message:
+    __slots__ = ("login", "text", "priority", "created")
+
+    def __init__(self, login: str, text: str, priority: Priority) -> None:
+        self.login = login
+        self.text = text
+        self.priority = priority
+        self.created = monotonic()
+
+
+class ChannelState:
+    __slots__ = ("moderator", "rate", "last_text", "last_sent")
+
+    def __init__(self) -> None:
+        self.moderator = False
+        self.rate = SlidingWindow(1, CHANNEL_INTERVAL + SAFETY / 10)
+        self.last_text: str | None = None
+        self.last_sent = 0.0
+
+
+class Outbound:
+    """
+    Очередь исходящих сообщений чата с учётом лимитов Twitch.
+
+    Сообщения разложены по приоритетам, внутри приоритета каналы обходятся по кругу,
+    чтобы один шумный канал не задерживал остальные. Одинаковые сообщения в канал,
+    которые ещё ждут отправки или только что ушли, не отправляются повторно.
+    """
+
+    def __init__(self, send: Send) -> None:
+        self.__send = send
+        self.__global = SlidingWindow(GLOBAL_LIMIT, WINDOW + SAFETY)
+        self.__regular = SlidingWindow(REGULAR_LIMIT, WINDOW + SAFETY)
+        self.__channels: dict[str, ChannelState] = {}
+        self.__lanes: dict[Priority, OrderedDict[str, deque[Message]]] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self.__depth = dict.fromkeys(Priority, 0)
+        self.__counters = dict.fromkeys(
+            ("queued", "sent", "coalesced", "expired", "dropped"), 0
+        )
+        self.__max_depth = 0
+        self.__wakeup = asyncio.Event()
+        self.__task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    def set_moderator(self, login: str, moderator: bool) -> None:
+        self.__channel(login).moderator = moderator
+
+    def send(
+        self, login: str, text: str, priority: Priority = Priority.COMMAND
+    ) -> bool:
+        """Ставит сообщение в очередь, False если оно слито с таким же или отброшено"""
+        channel = self.__channel(login)
+        lane = self.__lanes[priority]
+        pending = lane.get(login)
+        if (pending and any(message.text == text for message in pending)) or (
+            not channel.moderator
+            and channel.last_text == text
+            and monotonic() - channel.last_sent < DUPLICATE_WINDOW
+        ):
+            self.__counters["coalesced"] += 1
+            return False
+
+        if self.__depth[priority] >= MAX_DEPTH:
+            self.__counters["dropped"] += 1
+            logger.warning(f"Outbound {priority.name} queue is full, dropping message")
+            return False
+
+        if pending is None:
+            pending = lane[login] = deque()
+        pending.append(Message(login, text, priority))
+        self.__depth[priority] += 1
+        self.__counters["queued"] += 1
+        depth = sum(self.__depth.values())
+        if depth > self.__max_depth:
+            self.__max_depth = depth
+            if depth % DEPTH_WARNING == 0:
+                logger.warning(f"Outbound queue depth reached {depth}")
+        self.__wakeup.set()
+        return True
+
+    def stats(self) -> dict[str, int | dict[str, int]]:
+        return {
+            "depth": {priority.name: depth for priority, depth in self.__depth.items()},
+            "max_depth": self.__max_depth,
+            "channels": sum(len(lane) for lane in self.__lanes.values()),
+            **self.__counters,
+        }
+
+    def __channel(self, login: str) -> ChannelState:
+        channel = self.__channels.get(login)
+        if channel is None:
+            channel = self.__channels[login] = ChannelState()
+        return channel
+
+    def __next(self, now: float) -> tuple[Message | None, float]:
+        """Первое сообщение, которое можно отправить сейчас, или сколько ждать"""
+        wait = self.__global.delay(now)
+        if wait:
+            return None, wait
+
+        wait = None
+        for priority, lane in self.__lanes.items():
+            ttl = TTL[priority]
+            for login, pending in list(lane.items()):
+                while ttl is not None and pending and now - pending[0].created > ttl:
+                    pending.popleft()
+                    self.__depth[priority] -= 1
+                    self.__counters["expired"] += 1
+                if not pending:
+                    del lane[login]
+                    continue
+
+                channel = self.__channels[login]
+                delay = (
+                    0.0
+                    if channel.moderator
+                    else max(channel.rate.delay(now), self.__regular.delay(now))
+                )
+                if delay:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+
+                message = pending.popleft()
+                self.__depth[priority] -= 1
+                if pending:
+                    lane.move_to_end(login)
+                else:
+                    del lane[login]
+                return message, 0.0
+        return None, wait
+
+    async def __run(self) -> None:
+        while True:
+            now = monotonic()
+            message, wait = self.__next(now)
+            if message is None:
+                self.__wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.__wakeup.wait(), wait)
+                except TimeoutError:
+                    pass
+                continue
+
+            channel = self.__channels[message.login]
+            self.__global.take(now)
+            if not channel.moderator:
+                self.__regular.take(now)
+                channel.rate.take(now)
+            channel.last_text = message.text
+            channel.last_sent = now
+            self.__counters["sent"] += 1
+            try:
+                await self.__send(message.text, message.login)
+            except Exception as e:
+                logger.exception(e)
@@ -0,0 +1,122 @@
+import os
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Iterator
+
+import orjson
+
+
+class Change(Enum):
+    ADDED = "added"
+    UPDATED = "updated"
+    REMOVED = "removed"
+
+
+class Channel:
+    """Канал, в который входит бот, без остальных полей документа users"""
+
+    __slots__ = ("id", "login")
+
+    def __init__(self, id: str, login: str) -> None:
+        self.id = id
+        self.login = login
+
+    def __repr__(self) -> str:
+        return f"Channel(id={self.id!r}, login={self.login!r})"
+
+    @classmethod
+    def from_document(cls, document: dict) -> "Channel":
+        return cls(document["_id"], document["login"])
+
+    def to_dict(self) -> dict[str, str]:
+        return {"id": self.id, "login": self.login}
+
+
+Listener = Callable[[Change, Channel], None]
+
+
+class ChannelRegistry:
+    """
+    Каналы с поиском по id и по login за O(1).
+
+    Слушатели получают каждое изменение, например чтобы сохранить снимок, с которого
+    бот стартует после перезапуска без чтения всей таблицы users.
+    """
+
+    def __init__(self) -> None:
+        self.__by_id: dict[str, Channel] = {}
+        self.__by_login: dict[str, Channel] = {}
+        self.__listeners: list[Listener] = []
+
+    def __len__(self) -> int:
+        return len(self.__by_id)
+
+    def __iter__(self) -> Iterator[Channel]:
+        return iter(self.__by_id.values())
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.__by_id
+
+    def subscribe(self, listener: Listener) -> Listener:
+        self.__listeners.append(listener)
+        return listener
+
+    def unsubscribe(self, listener: Listener) -> None:
+        self.__listeners.remove(listener)
+
+    def get(self, id: str = None, login: str = None) -> Channel | None:
+        if id:
+            return self.__by_id.get(id)
+        if login:
+            return self.__by_login.get(login)
+        return None
+
+    def add(self, channel: Channel) -> Channel:
+        """Добавляет канал или обновляет login уже известного"""
+        taken = self.__by_login.get(channel.login)
+        if taken is not None and taken.id != channel.id:
+            # Ник освободился и достался другому каналу
+            self.remove(id=taken.id)
+
+        current = self.__by_id.get(channel.id)
+        if current is not None:
+            if current.login == channel.login:
+                return current
+            # Стример сменил ник
+            del self.__by_login[current.login]
+            current.login = channel.login
+            self.__by_login[current.login] = current
+            self.__notify(Change.UPDATED, current)
+            return current
+
+        self.__by_id[channel.id] = channel
+        self.__by_login[channel.login] = channel
+        self.__notify(Change.ADDED, channel)
+        return channel
+
+    def remove(self, id: str = None, login: str = None) -> Channel | None:
+        channel = self.get(id, login)
+        if channel is None:
+            return None
+        del self.__by_id[channel.id]
+        del self.__by_login[channel.login]
+        self.__notify(Change.REMOVED, channel)
+        return channel
+
+    def save(self, path: Path) -> None:
+        """Пишет снимок атомарно, чтобы при падении не остался обрезанный файл"""
+        temporary = path.with_name(f"{path.name}.tmp")
+        temporary.write_bytes(
+            orjson.dumps([channel.to_dict() for channel in self.__by_id.values()])
+        )
+        os.replace(temporary, path)
+
+    def load(self, path: Path) -> None:
+        for record in orjson.loads(path.read_bytes()):
+            channel = Channel(record["id"], record["login"])
+            self.__by_id[channel.id] = channel
+            self.__by_login[channel.login] = channel
+
+    def __notify(self, change: Change, channel: Channel) -> None:
+        for listener in self.__listeners:
+            listener(change, channel)
@@ -1,22 +1,28 @@
 import asyncio
 import os
-from enum import Enum
-from typing import Annotated
+from time import perf_counter
 
+from aiohttp import ClientSession
 from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
 import websockets.asyncio.client
+import websockets.exceptions
 from loguru import logger
-import orjson
 import uvloop
 
-from models import Message, MessageType
+from decoder import ChatMessage, Frame, decode
+from models import MessageType
+from handover import Deduplicator, Handover
+from helix import Helix, HelixError
+from pool import Session, SessionPool
+from reconciler import Reconciler
+from router import Router
 
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 WS_URL = (
     "wss://eventsub.wss.twitch.tv/ws"
     if os.getenv("APP_ENV") == "prod"
-    else "ws://localhost:8080/ws"  # TODO
+    else "ws://localhost:8080/ws"  # Bot/mock/eventsub.py
 )
 
 ERRORS = {
@@ -46,89 +52,197 @@ ERRORS = {
 }
 
 
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 60.0
+STATS_INTERVAL = 60.0
+
+
 class TwitchBot:
     def __init__(
         self,
         client_id: str,
+        token: str,
+        user_id: str,
+        sessions: int = 1,
     ) -> None:
         self._headers = {
             "Client-Id": client_id,
+            "Authorization": f"Bearer {token}",
             "Content-Type": "application/json",
         }
-        self._websockets: dict[str, websockets.ClientConnection] = {}
-        self._functions = {}
+        self._user_id = user_id
+        self.loop = asyncio.new_event_loop()
+        self._http: ClientSession | None = None
+        self._helix: Helix | None = None
+        self._reconciler: Reconciler | None = None
+        self._pool = SessionPool(
+            sessions, self._create_subscription, self._delete_subscription
+        )
+        self._connecting: dict[str, asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._closing = False
+        self._router = Router()
+        self._dedup = Deduplicator()
+
+    # Public methods
+
+    async def join(self, broadcaster_id: str) -> None:
+        self._pool.wanted.add(broadcaster_id)
+        self._ensure_sessions()
+        await self._pool.assign(broadcaster_id)
+
+    async def part(self, broadcaster_id: str) -> None:
+        await self._pool.release(broadcaster_id)
+
+    async def sync(self, broadcaster_ids: set[str]) -> dict:
+        """Приводит подписки к списку каналов, например после перезапуска"""
+        self._pool.wanted.update(broadcaster_ids)
+        self._ensure_sessions()
+        return await self._reconciler.reconcile(broadcaster_ids)
+
+    def on(self, subscription_type: str, broadcaster_id: str | None = None):
+        """Регистрирует обработчик уведомлений, без broadcaster_id для всех каналов"""
+        return self._router.route(subscription_type, broadcaster_id)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": self._pool.stats(),
+            "queues": self._router.stats(),
+            "duplicates": self._dedup.duplicates,
+        }
 
     # Internal events
 
-    def _welcome(self, ws: websockets.ClientConnection, message: Message) -> tuple[str, int]:
-        session = message.payload
-        self._websockets[session["id"]] = ws
-        return session["id"], session["keepalive_timeout_seconds"] + 2
+    def _welcome(self, frame: Frame) -> tuple[str, float]:
+        return frame.session["id"], frame.session["keepalive_timeout_seconds"] + 2
 
-    async def _notification(self, session_id: str, message: Message):
-        id = event["subscription"]["id"]
-        if id in self._functions:
-            await self._functions[id](event)
+    def _notification(self, session: Session, frame: Frame):
+        event = frame.event
+        if isinstance(event, ChatMessage):
+            broadcaster_id = event.broadcaster_user_id
+        else:
+            broadcaster_id = frame.subscription["condition"].get("broadcaster_user_id")
+        self._router.dispatch(frame.subscription_type, broadcaster_id, event)
+
+    async def _revocation(self, session: Session, frame: Frame):
+        subscription = frame.subscription
+        logger.warning(
+            f"Subscription {subscription['type']} revoked: {subscription['status']}"
+        )
 
-    async def _revocation(self, session_id: str, message: Message):
-        pass
+    async def _reconnect(
+        self,
+        session: Session,
+        ws: websockets.asyncio.client.ClientConnection,
+        frame: Frame,
+    ):
+        if session.handover is not None:
+            return
+        logger.info(f"EventSub {session.slot} is reconnecting")
+        session.handover = Handover(ws)
+        self._spawn(self._connect(session.slot, frame.session["reconnect_url"]))
 
-    async def _reconnect(self, session_id: str, message: Message):
-        logger.info("reconnecting")
-        await self._connect(event["session"]["reconnect_url"], session_id)
+    # Helix
 
-    async def _keepalive(self, message: Message):
-        message.metadata
+    async def _create_subscription(
+        self, session_id: str, broadcaster_id: str
+    ) -> str | None:
+        try:
+            subscription = await self._helix.create_subscription(
+                "channel.chat.message",
+                "1",
+                {"broadcaster_user_id": broadcaster_id, "user_id": self._user_id},
+                {"method": "websocket", "session_id": session_id},
+            )
+        except HelixError as e:
+            logger.error(f"Failed to subscribe to {broadcaster_id}: {e}")
+            return None
+        return subscription["id"]
+
+    async def _delete_subscription(self, subscription_id: str) -> None:
+        try:
+            await self._helix.delete_subscription(subscription_id)
+        except HelixError as e:
+            logger.error(f"Failed to delete subscription {subscription_id}: {e}")
 
     # Connecting and health
 
-    async def _connect(self, url: str = None, parent_id: str = None):
-        if not url:
-            url = WS_URL
+    def _spawn(self, coro) -> asyncio.Task:
+        task = self.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
 
-        ws = await websockets.connect(
-            url,
-            # ping_interval=None,
-            # ping_timeout=None,
-        )
-        self.loop.create_task(self._loop(ws, parent_id))
+    def _ensure_sessions(self):
+        """Поднимает слоты без соединения, если для них есть каналы"""
+        if not self._pool.wanted:
+            return
+        for slot, session in self._pool.sessions.items():
+            task = self._connecting.get(slot)
+            if not session.online and (task is None or task.done()):
+                self._connecting[slot] = self._spawn(self._connect(slot))
+
+    async def _connect(self, slot: str, reconnect_url: str = None):
+        delay = RECONNECT_DELAY
+        while not self._closing:
+            try:
+                ws = await websockets.asyncio.client.connect(reconnect_url or WS_URL)
+                break
+            except (OSError, websockets.exceptions.InvalidHandshake) as e:
+                if reconnect_url:
+                    # Подписки остаются на старом соединении, пока Twitch его не закроет,
+                    # после этого слот переподключится с нуля
+                    logger.error(f"Can't reconnect EventSub {slot}: {e}")
+                    self._pool.sessions[slot].handover = None
+                    return
+                logger.warning(
+                    f"Can't connect EventSub {slot}: {e}, retrying in {delay:.0f}s"
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        else:
+            return
+        await self._loop(slot, ws, reconnect_url is not None)
 
     async def _loop(
-        self, ws: websockets.ClientConnection, parent_id: str = None
+        self,
+        slot: str,
+        ws: websockets.asyncio.client.ClientConnection,
+        reconnect: bool = False,
     ) -> None:
-        event = orjson.loads(await ws.recv())
-        session_id, timeout = self._welcome(ws, event)
-        if parent_id:
-            if not self._websockets[parent_id].closed:
-                await self._websockets[parent_id].close()
-            del self._websockets[parent_id]
-        session_id = None
-        timeout = 5.0
+        session = self._pool.sessions[slot]
+        handover = session.handover if reconnect else None
         try:
+            session_id, timeout = self._welcome(decode(await ws.recv(decode=False)))
+            await self._pool.attach(slot, session_id, ws)
+            # Подписки идут в фоне: пока они ждут Helix, соединение должно читать
+            # кадры, иначе Twitch закроет его за пропущенные ping и keepalive
+            self._spawn(self._pool.rebalance())
+            if handover is not None:
+                await self._take_over(session, handover)
+
             while True:
                 try:
-                    event = orjson.loads(
-                        await asyncio.wait_for(ws.recv(), timeout=timeout)
+                    data = await asyncio.wait_for(
+                        ws.recv(decode=False), timeout=timeout
                     )
                 except TimeoutError:
-                    await self._connect(parent_id=session_id)
+                    logger.warning(f"EventSub {slot} missed keepalive")
                     return
-                logger.info(event)
-                message = Message(*event)
-                if message.metadata.message_type == MessageType.WELCOME:
-                    session_id, timeout = self._welcome()
-                elif message.metadata.message_type == MessageType.KEEPALIVE:
-                    self._keepalive(message)
-                elif message.metadata.message_type == MessageType.NOTIFICATION:
-                    self._notification()
-                elif message.metadata.message_type == MessageType.RECONNECT:
-                    self._reconnect()
-                elif message.metadata.message_type == MessageType.REVOKE:
-                    self._revocation()
+                session.on_message()
+                frame = decode(data)
+                message_type = frame.message_type
+                if message_type is MessageType.KEEPALIVE:
+                    continue
+                elif message_type is MessageType.NOTIFICATION:
+                    if not self._dedup.seen(frame.message_id):
+                        self._notification(session, frame)
+                elif message_type is MessageType.RECONNECT:
+                    await self._reconnect(session, ws, frame)
+                elif message_type is MessageType.REVOKE:
+                    await self._revocation(session, frame)
                 else:
-                    logger.error(
-                        f"Unknown message_type: {message.metadata.message_type}"
-                    )
+                    logger.error(f"Unknown message_type: {message_type}")
         except ConnectionClosedOK:
             pass
         except ConnectionClosedError:
@@ -136,21 +250,76 @@ class TwitchBot:
                 ERRORS.get(ws.close_code, f"Websocket closed with {ws.close_code} code")
             )
         except Exception as e:
-            logger.error(e)
+            logger.exception(e)
+        finally:
+            await ws.close()
+            if session.handover is not None and session.handover.parent is ws:
+                session.handover.drained.set()
+            if not self._closing:
+                if await self._pool.detach(slot, ws):
+                    self._spawn(self._pool.rebalance())
+                if session.ws is None:
+                    self._ensure_sessions()
+
+    async def _take_over(self, session: Session, handover: Handover):
+        """
+        Закрывает старое соединение и ждёт, пока оно дочитает полученные кадры.
+
+        Кадры нового соединения до этого момента копятся в его буфере, дубли из
+        перекрывающегося окна отсекаются по message_id.
+        """
+        handover.welcomed = perf_counter()
+        self._spawn(handover.parent.close())
+        if not await handover.wait_drained():
+            logger.warning(f"EventSub {session.slot} old connection didn't drain")
+
+        session.handover = None
+        session.handovers += 1
+        session.handover_gap = perf_counter() - handover.started
+        logger.info(
+            f"EventSub {session.slot} moved to a new connection in "
+            f"{session.handover_gap * 1000:.0f} ms "
+            f"(welcome after {(handover.welcomed - handover.started) * 1000:.0f} ms)"
+        )
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            stats = self.stats()
+            for session in stats["sessions"]:
+                logger.info(
+                    f"EventSub {session['slot']}: {session['subscriptions']} subscriptions, "
+                    f"{session['rate']} msg/s"
+                )
+            queues = stats["queues"]
+            logger.info(
+                f"Queues: {queues['channels']} channels, depth {queues['depth']}, "
+                f"dropped {queues['dropped']}, under pressure {queues['pressure']}"
+            )
 
     # Starting and exiting
 
     def run(self):
-        if self._subscriptions:
-            self.loop.create_task(self._connect())
+        self.loop.create_task(self.start())
         try:
             self.loop.run_forever()
         except KeyboardInterrupt:
             self.loop.run_until_complete(self.exit())
 
-    async def exit(self):
-        for connection in self._websockets.values():
-            await connection.close()
+    async def start(self):
+        self._http = ClientSession(headers=self._headers)
+        self._helix = Helix(self._http)
+        self._reconciler = Reconciler(self._helix, self._pool)
+        self._spawn(self._report())
+        self._ensure_sessions()
 
-    def start(self):
-        self.loop.create_task(self._connect())
+    async def exit(self):
+        self._closing = True
+        for task in self._tasks:
+            task.cancel()
+        await self._router.close()
+        for session in self._pool.sessions.values():
+            if session.ws is not None:
+                await session.ws.close()
+        if self._http is not None:
+            await self._http.close()
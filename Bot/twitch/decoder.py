@@ -0,0 +1,138 @@
+import orjson
+
+from models import ChannelChatMessage, MessageType
+
+MESSAGE_TYPES = {message_type.value: message_type for message_type in MessageType}
+
+# Keepalive приходит раз в несколько секунд на каждую сессию, его можно узнать
+# по началу кадра без разбора JSON
+KEEPALIVE_MARKER = b'"message_type":"session_keepalive"'
+PEEK_SIZE = 160
+
+
+class ChatMessage:
+    """
+    channel.chat.message без валидации pydantic.
+
+    Вложенные объекты (badges, fragments, reply, cheer) остаются словарями, полная
+    модель собирается только по запросу через model().
+    """
+
+    __slots__ = (
+        "broadcaster_user_id",
+        "broadcaster_user_login",
+        "broadcaster_user_name",
+        "chatter_user_id",
+        "chatter_user_login",
+        "chatter_user_name",
+        "message_id",
+        "text",
+        "message_type",
+        "color",
+        "raw",
+    )
+
+    def __init__(self, event: dict) -> None:
+        self.broadcaster_user_id: str = event["broadcaster_user_id"]
+        self.broadcaster_user_login: str = event["broadcaster_user_login"]
+        self.broadcaster_user_name: str = event["broadcaster_user_name"]
+        self.chatter_user_id: str = event["chatter_user_id"]
+        self.chatter_user_login: str = event["chatter_user_login"]
+        self.chatter_user_name: str = event["chatter_user_name"]
+        self.message_id: str = event["message_id"]
+        self.text: str = event["message"]["text"]
+        self.message_type: str = event["message_type"]
+        self.color: str = event["color"]
+        self.raw = event
+
+    @property
+    def badges(self) -> list[dict]:
+        return self.raw["badges"]
+
+    @property
+    def fragments(self) -> list[dict]:
+        return self.raw["message"]["fragments"]
+
+    @property
+    def reply(self) -> dict | None:
+        return self.raw.get("reply")
+
+    @property
+    def cheer(self) -> dict | None:
+        return self.raw.get("cheer")
+
+    def model(self) -> ChannelChatMessage:
+        return ChannelChatMessage(**self.raw)
+
+
+EVENTS = {"channel.chat.message": ChatMessage}
+
+
+class Frame:
+    """Кадр EventSub, payload разбирается только для нужного message_type"""
+
+    __slots__ = (
+        "message_id",
+        "message_type",
+        "timestamp",
+        "subscription_type",
+        "subscription",
+        "session",
+        "event",
+    )
+
+    def __init__(
+        self,
+        message_id: str | None,
+        message_type: MessageType | str,
+        timestamp: str | None,
+        subscription_type: str | None = None,
+        subscription: dict | None = None,
+        session: dict | None = None,
+        event: ChatMessage | dict | None = None,
+    ) -> None:
+        self.message_id = message_id
+        self.message_type = message_type
+        self.timestamp = timestamp
+        self.subscription_type = subscription_type
+        self.subscription = subscription
+        self.session = session
+        self.event = event
+
+
+KEEPALIVE = Frame(None, MessageType.KEEPALIVE, None)
+
+
+def decode(data: str | bytes) -> Frame:
+    if isinstance(data, str):
+        data = data.encode()
+    if KEEPALIVE_MARKER in data[:PEEK_SIZE]:
+        return KEEPALIVE
+
+    message = orjson.loads(data)
+    metadata = message["metadata"]
+    payload = message["payload"]
+    raw_type = metadata["message_type"]
+    message_type = MESSAGE_TYPES.get(raw_type, raw_type)
+
+    if message_type is MessageType.NOTIFICATION:
+        subscription_type = metadata["subscription_type"]
+        event = payload["event"]
+        decoder = EVENTS.get(subscription_type)
+        return Frame(
+            metadata["message_id"],
+            message_type,
+            metadata["message_timestamp"],
+            subscription_type,
+            payload["subscription"],
+            event=event if decoder is None else decoder(event),
+        )
+
+    return Frame(
+        metadata["message_id"],
+        message_type,
+        metadata["message_timestamp"],
+        metadata.get("subscription_type"),
+        payload.get("subscription"),
+        payload.get("session"),
+    )
@@ -0,0 +1,69 @@
+import asyncio
+from collections import OrderedDict
+from time import monotonic, perf_counter
+
+import websockets.asyncio.client
+
+DEDUP_WINDOW = 600.0
+DEDUP_SIZE = 100_000
+DRAIN_TIMEOUT = 5.0
+
+
+class Deduplicator:
+    """
+    Множество недавних message_id с ограничением по времени и размеру.
+
+    Twitch может доставить одно уведомление дважды, в том числе через старое и
+    новое соединение во время session_reconnect.
+    """
+
+    __slots__ = ("duplicates", "__window", "__max_size", "__seen")
+
+    def __init__(self, window: float = DEDUP_WINDOW, max_size: int = DEDUP_SIZE):
+        self.duplicates = 0
+        self.__window = window
+        self.__max_size = max_size
+        self.__seen: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__seen)
+
+    def seen(self, message_id: str) -> bool:
+        now = monotonic()
+        seen = self.__seen
+        if message_id in seen:
+            self.duplicates += 1
+            return True
+
+        seen[message_id] = now
+        expires = now - self.__window
+        while seen:
+            first_id, first_time = next(iter(seen.items()))
+            if first_time >= expires and len(seen) <= self.__max_size:
+                break
+            del seen[first_id]
+        return False
+
+
+class Handover:
+    """
+    Переход сессии на новое соединение после session_reconnect.
+
+    Новое соединение не разбирает свои кадры, пока старое не дочитает всё, что
+    успело получить, поэтому порядок сообщений внутри сессии сохраняется.
+    """
+
+    __slots__ = ("parent", "started", "welcomed", "drained")
+
+    def __init__(self, parent: websockets.asyncio.client.ClientConnection) -> None:
+        self.parent = parent
+        self.started = perf_counter()
+        self.welcomed: float | None = None
+        self.drained = asyncio.Event()
+
+    async def wait_drained(self) -> bool:
+        try:
+            await asyncio.wait_for(self.drained.wait(), DRAIN_TIMEOUT)
+            return True
+        except TimeoutError:
+            return False
@@ -0,0 +1,139 @@
+import asyncio
+import os
+from time import time
+from typing import AsyncIterator
+
+from aiohttp import ClientError, ClientSession
+from loguru import logger
+import orjson
+
+HELIX_URL = (
+    "https://api.twitch.tv/helix"
+    if os.getenv("APP_ENV") == "prod"
+    else "http://localhost:8080"  # Bot/mock/eventsub.py
+)
+# Лимит Helix для пользовательского токена, уточняется по заголовкам ответов
+DEFAULT_LIMIT = 800
+MAX_RETRIES = 5
+# Сколько ждать после 429, если Ratelimit-Reset уже в прошлом
+RETRY_DELAY = 1.0
+
+
+class HelixError(Exception):
+    """Ошибка Helix, status 0 если ответа не было: сеть или таймаут"""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class Helix:
+    """
+    Минимальный клиент Helix, который держится в пределах rate limit.
+
+    Остаток запросов и время сброса берутся из заголовков Ratelimit-*, когда
+    остаток заканчивается, новые запросы ждут сброса окна, а не получают 429.
+    """
+
+    def __init__(self, session: ClientSession) -> None:
+        self.__session = session
+        self.__limit = DEFAULT_LIMIT
+        self.__remaining = DEFAULT_LIMIT
+        self.__reset = 0.0
+        self.__lock = asyncio.Lock()
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: dict | None = None,
+        body: dict | None = None,
+    ) -> dict | None:
+        data = None if body is None else orjson.dumps(body)
+        for attempt in range(MAX_RETRIES):
+            await self.__acquire()
+            try:
+                async with self.__session.request(
+                    method, f"{HELIX_URL}{path}", params=params, data=data
+                ) as response:
+                    self.__update(response.headers)
+                    if response.status == 429:
+                        self.__remaining = 0
+                        self.__reset = max(self.__reset, time() + RETRY_DELAY)
+                        logger.warning(f"Helix rate limit hit on {method} {path}")
+                        continue
+
+                    payload = await response.read()
+                    content = orjson.loads(payload) if payload else None
+                    if response.status >= 400:
+                        message = (content or {}).get("message", response.reason)
+                        raise HelixError(response.status, message)
+                    return content
+            except (ClientError, TimeoutError) as e:
+                # Один неудачный запрос не должен ронять сессию, в которой он шёл
+                raise HelixError(0, f"{method} {path} failed: {e!r}") from e
+        raise HelixError(429, "Too Many Requests")
+
+    async def subscriptions(
+        self, type: str | None = None, status: str | None = None
+    ) -> AsyncIterator[dict]:
+        params = {}
+        if type:
+            params["type"] = type
+        if status:
+            params["status"] = status
+
+        while True:
+            page = await self.request("GET", "/eventsub/subscriptions", params)
+            for subscription in page["data"]:
+                yield subscription
+            cursor = page.get("pagination", {}).get("cursor")
+            if not cursor:
+                return
+            params["after"] = cursor
+
+    async def create_subscription(
+        self, type: str, version: str, condition: dict, transport: dict
+    ) -> dict:
+        body = {
+            "type": type,
+            "version": version,
+            "condition": condition,
+            "transport": transport,
+        }
+        response = await self.request("POST", "/eventsub/subscriptions", body=body)
+        return response["data"][0]
+
+    async def delete_subscription(self, subscription_id: str) -> None:
+        try:
+            await self.request(
+                "DELETE", "/eventsub/subscriptions", params={"id": subscription_id}
+            )
+        except HelixError as e:
+            if e.status != 404:
+                raise
+
+    async def __acquire(self) -> None:
+        async with self.__lock:
+            if self.__remaining <= 0:
+                delay = self.__reset - time()
+                if delay > 0:
+                    logger.info(f"Helix rate limit exhausted, waiting {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                self.__remaining = self.__limit
+            self.__remaining -= 1
+
+    def __update(self, headers) -> None:
+        limit = headers.get("Ratelimit-Limit")
+        remaining = headers.get("Ratelimit-Remaining")
+        reset = headers.get("Ratelimit-Reset")
+        if limit is not None:
+            self.__limit = int(limit)
+        if reset is not None and int(reset) != int(self.__reset):
+            # Новое окно, локальный счётчик заменяется ответом сервера
+            self.__reset = float(reset)
+            if remaining is not None:
+                self.__remaining = int(remaining)
+        elif remaining is not None:
+            # Ответы параллельных запросов приходят не по порядку, берём меньший остаток
+            self.__remaining = min(self.__remaining, int(remaining))
@@ -52,8 +52,8 @@ class ChannelChatMessage(BaseModel):
     color: str
     badges: list
     message_type: str
-    cheer: str | None = None
-    reply: str | None = None
+    cheer: dict | None = None
+    reply: dict | None = None
     channel_points_custom_reward_id: str | None = None
     source_broadcaster_user_id: str | None = None
     source_broadcaster_user_login: str | None = None
@@ -64,7 +64,11 @@ class ChannelChatMessage(BaseModel):
 
 
 class Session(BaseModel):
-    pass
+    id: str
+    status: str
+    connected_at: datetime
+    keepalive_timeout_seconds: int | None = None
+    reconnect_url: str | None = None
 
 
 class Payload(BaseModel):
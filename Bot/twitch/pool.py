@@ -0,0 +1,326 @@
+"""
+Пул EventSub websocket сессий.
+
+Twitch разрешает не больше 3 websocket соединений на один пользовательский токен
+и не больше 300 подписок в соединении, поэтому один бот держит до ~900 каналов на
+websocket транспорте, дальше нужны другие токены или webhook/conduit.
+"""
+
+import asyncio
+import hashlib
+from bisect import bisect, insort
+from time import monotonic
+from typing import TYPE_CHECKING, Awaitable, Callable, Iterator
+
+from loguru import logger
+import websockets.asyncio.client
+
+if TYPE_CHECKING:
+    from handover import Handover
+
+# Лимит Twitch на количество подписок в одной websocket сессии
+MAX_SUBSCRIPTIONS = 300
+RATE_WINDOW = 10.0
+REPLICAS = 64
+SUBSCRIBE_CONCURRENCY = 50
+
+Subscribe = Callable[[str, str], Awaitable[str | None]]
+Unsubscribe = Callable[[str], Awaitable[None]]
+
+
+def hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest())
+
+
+class HashRing:
+    """Консистентное хэширование, при потере узла переезжают только его ключи"""
+
+    def __init__(self, replicas: int = REPLICAS) -> None:
+        self.__replicas = replicas
+        self.__points: list[int] = []
+        self.__owners: dict[int, str] = {}
+
+    def __contains__(self, node: str) -> bool:
+        return hash_key(f"{node}#0") in self.__owners
+
+    def __len__(self) -> int:
+        return len(self.__points) // self.__replicas
+
+    def add(self, node: str) -> None:
+        if node in self:
+            return
+        for replica in range(self.__replicas):
+            point = hash_key(f"{node}#{replica}")
+            self.__owners[point] = node
+            insort(self.__points, point)
+
+    def remove(self, node: str) -> None:
+        if node not in self:
+            return
+        for replica in range(self.__replicas):
+            del self.__owners[hash_key(f"{node}#{replica}")]
+        self.__points = sorted(self.__owners)
+
+    def nodes_for(self, key: str) -> Iterator[str]:
+        """Узлы в порядке обхода кольца от ключа, первый из них основной"""
+        if not self.__points:
+            return
+
+        start = bisect(self.__points, hash_key(key))
+        seen = set()
+        for index in range(len(self.__points)):
+            node = self.__owners[self.__points[(start + index) % len(self.__points)]]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self):
+                    return
+
+
+class Session:
+    """Одна EventSub websocket сессия и её подписки"""
+
+    __slots__ = (
+        "slot",
+        "id",
+        "ws",
+        "subscriptions",
+        "messages",
+        "rate",
+        "handover",
+        "handovers",
+        "handover_gap",
+        "__window_start",
+        "__window_count",
+    )
+
+    def __init__(self, slot: str) -> None:
+        self.slot = slot
+        self.id: str | None = None
+        self.ws: websockets.asyncio.client.ClientConnection | None = None
+        # broadcaster_id -> subscription_id
+        self.subscriptions: dict[str, str] = {}
+        self.messages = 0
+        self.rate = 0.0
+        self.handover: "Handover | None" = None
+        self.handovers = 0
+        # Длительность последнего переезда, кадры нового соединения в это время ждут в буфере
+        self.handover_gap: float | None = None
+        self.__window_start = monotonic()
+        self.__window_count = 0
+
+    @property
+    def online(self) -> bool:
+        return self.id is not None
+
+    def on_message(self) -> None:
+        self.messages += 1
+        self.__window_count += 1
+        now = monotonic()
+        if now - self.__window_start >= RATE_WINDOW:
+            self.rate = self.__window_count / (now - self.__window_start)
+            self.__window_start = now
+            self.__window_count = 0
+
+    def snapshot(self) -> dict[str, str | int | float | None]:
+        return {
+            "slot": self.slot,
+            "session_id": self.id,
+            "subscriptions": len(self.subscriptions),
+            "messages": self.messages,
+            "rate": round(self.rate, 2),
+            "handovers": self.handovers,
+            "handover_gap": self.handover_gap,
+        }
+
+
+class SessionPool:
+    """
+    Распределяет подписки channel.chat.message по нескольким websocket сессиям.
+
+    Каналы привязаны к слотам через консистентное хэширование, поэтому при падении
+    сессии переезжают только её каналы, а после переподключения возвращаются обратно.
+
+    Состояние сессий меняется под коротким __lock, а запросы к Helix идут вне его,
+    под __rebalancing, который только выстраивает перебалансировки в очередь. Так
+    attach() и detach() не ждут пачку подписок, даже если Helix упёрся в лимит.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        subscribe: Subscribe,
+        unsubscribe: Unsubscribe,
+        max_subscriptions: int = MAX_SUBSCRIPTIONS,
+    ) -> None:
+        self.sessions = {f"session-{i}": Session(f"session-{i}") for i in range(size)}
+        self.wanted: set[str] = set()
+        self.__subscribe = subscribe
+        self.__unsubscribe = unsubscribe
+        self.__max_subscriptions = max_subscriptions
+        self.__ring = HashRing()
+        # broadcaster_id -> slot
+        self.__assigned: dict[str, str] = {}
+        self.__lock = asyncio.Lock()
+        self.__rebalancing = asyncio.Lock()
+        self.__semaphore = asyncio.Semaphore(SUBSCRIBE_CONCURRENCY)
+
+    def session_of(self, broadcaster_id: str) -> Session | None:
+        slot = self.__assigned.get(broadcaster_id)
+        return None if slot is None else self.sessions[slot]
+
+    @property
+    def assigned(self) -> int:
+        return len(self.__assigned)
+
+    def stats(self) -> list[dict[str, str | int | float | None]]:
+        return [session.snapshot() for session in self.sessions.values()]
+
+    async def attach(
+        self,
+        slot: str,
+        session_id: str,
+        ws: websockets.asyncio.client.ClientConnection,
+    ) -> None:
+        """Только отмечает сессию, подписки раздаёт rebalance() в фоне"""
+        async with self.__lock:
+            session = self.sessions[slot]
+            session.id = session_id
+            session.ws = ws
+            self.__ring.add(slot)
+        logger.info(f"EventSub {slot} is online as {session_id}")
+
+    async def detach(
+        self, slot: str, ws: websockets.asyncio.client.ClientConnection
+    ) -> bool:
+        """Снимает сессию, True если её каналы надо раздать через rebalance()"""
+        async with self.__lock:
+            session = self.sessions[slot]
+            if session.ws is not ws:
+                # Сессию уже заменило переподключение
+                return False
+
+            # Подписки умирают вместе с сессией, каналы надо раздать другим
+            for broadcaster_id in session.subscriptions:
+                self.__assigned.pop(broadcaster_id, None)
+            logger.warning(
+                f"EventSub {slot} is offline, moving {len(session.subscriptions)} channels"
+            )
+            session.subscriptions.clear()
+            session.id = None
+            session.ws = None
+            self.__ring.remove(slot)
+            return True
+
+    async def adopt(
+        self,
+        desired: set[str],
+        subscriptions: list[tuple[str | None, str | None, str]],
+    ) -> list[str]:
+        """
+        Принимает подписки, уже существующие в Twitch, как (session_id,
+        broadcaster_id, subscription_id). Возвращает id лишних подписок: чужих
+        сессий, ненужных каналов и дублей.
+        """
+        async with self.__lock:
+            self.wanted = set(desired)
+            slots = {
+                session.id: slot
+                for slot, session in self.sessions.items()
+                if session.online
+            }
+            stale = []
+            for session_id, broadcaster_id, subscription_id in subscriptions:
+                known = self.__assigned.get(broadcaster_id)
+                if (
+                    known is not None
+                    and self.sessions[known].subscriptions.get(broadcaster_id)
+                    == subscription_id
+                ):
+                    # Уже известна пулу, если канал больше не нужен, её удалит rebalance
+                    continue
+
+                slot = slots.get(session_id)
+                if slot is None or broadcaster_id not in self.wanted or known:
+                    stale.append(subscription_id)
+                    continue
+                self.sessions[slot].subscriptions[broadcaster_id] = subscription_id
+                self.__assigned[broadcaster_id] = slot
+            return stale
+
+    async def assign(self, broadcaster_id: str) -> None:
+        self.wanted.add(broadcaster_id)
+        await self.rebalance()
+
+    async def release(self, broadcaster_id: str) -> None:
+        self.wanted.discard(broadcaster_id)
+        await self.rebalance()
+
+    async def rebalance(self) -> None:
+        async with self.__rebalancing:
+            async with self.__lock:
+                moves = self.__plan()
+            if moves:
+                await asyncio.gather(*(self.__move(*move) for move in moves))
+
+            unassigned = len(self.wanted) - len(self.__assigned)
+            if unassigned and self.__ring:
+                logger.warning(
+                    f"{unassigned} channels don't fit into EventSub sessions"
+                )
+
+    def __plan(self) -> list[tuple[str, str | None, str | None]]:
+        """Список переездов (канал, откуда, куда) с учётом лимита подписок"""
+        counts = {
+            slot: len(session.subscriptions) for slot, session in self.sessions.items()
+        }
+        moves = []
+
+        for broadcaster_id, slot in list(self.__assigned.items()):
+            if broadcaster_id not in self.wanted:
+                moves.append((broadcaster_id, slot, None))
+                counts[slot] -= 1
+
+        for broadcaster_id in self.wanted:
+            current = self.__assigned.get(broadcaster_id)
+            for slot in self.__ring.nodes_for(broadcaster_id):
+                if slot == current:
+                    break
+                if counts[slot] < self.__max_subscriptions:
+                    moves.append((broadcaster_id, current, slot))
+                    counts[slot] += 1
+                    if current is not None:
+                        counts[current] -= 1
+                    break
+        return moves
+
+    async def __move(
+        self, broadcaster_id: str, source: str | None, target: str | None
+    ) -> None:
+        async with self.__semaphore:
+            if target is not None:
+                session = self.sessions[target]
+                session_id = session.id
+                if session_id is None:
+                    return
+                subscription_id = await self.__subscribe(session_id, broadcaster_id)
+                if subscription_id is None:
+                    return
+                async with self.__lock:
+                    if session.id != session_id:
+                        # Сессия умерла, пока шёл запрос, подписка умерла вместе с ней.
+                        # Канал раздаст rebalance() после detach()
+                        return
+                    session.subscriptions[broadcaster_id] = subscription_id
+                    self.__assigned[broadcaster_id] = target
+            else:
+                async with self.__lock:
+                    self.__assigned.pop(broadcaster_id, None)
+
+            if source is not None:
+                async with self.__lock:
+                    subscription_id = self.sessions[source].subscriptions.pop(
+                        broadcaster_id, None
+                    )
+                if subscription_id is not None:
+                    await self.__unsubscribe(subscription_id)
@@ -0,0 +1,77 @@
+import asyncio
+from time import perf_counter
+
+from loguru import logger
+
+from helix import Helix, HelixError
+from pool import SessionPool
+
+DELETE_CONCURRENCY = 50
+
+
+class Reconciler:
+    """
+    Сводит подписки Twitch к нужному списку каналов.
+
+    Существующие подписки читаются страницами, живые подписки текущих сессий
+    остаются на месте, лишние удаляются, а недостающие создаются пулом
+    параллельно. Скорость ограничивает только rate limit Helix.
+    """
+
+    def __init__(
+        self,
+        helix: Helix,
+        pool: SessionPool,
+        subscription_type: str = "channel.chat.message",
+    ) -> None:
+        self.__helix = helix
+        self.__pool = pool
+        self.__type = subscription_type
+        self.__semaphore = asyncio.Semaphore(DELETE_CONCURRENCY)
+
+    async def reconcile(self, desired: set[str]) -> dict[str, int | float]:
+        start = perf_counter()
+        existing = []
+        async for subscription in self.__helix.subscriptions(self.__type):
+            if subscription["status"] != "enabled":
+                existing.append((None, None, subscription["id"]))
+                continue
+            existing.append(
+                (
+                    subscription["transport"].get("session_id"),
+                    subscription["condition"].get("broadcaster_user_id"),
+                    subscription["id"],
+                )
+            )
+
+        stale = await self.__pool.adopt(desired, existing)
+        before = self.__pool.assigned
+        kept = sum(1 for id in desired if self.__pool.session_of(id) is not None)
+        deleted, _ = await asyncio.gather(self.__delete(stale), self.__pool.rebalance())
+
+        result = {
+            "desired": len(desired),
+            "kept": kept,
+            "created": self.__pool.assigned - kept,
+            # Подписки ненужных каналов, уже известные пулу, снимает rebalance
+            "deleted": deleted + before - kept,
+            "missing": len(desired) - self.__pool.assigned,
+            "seconds": round(perf_counter() - start, 3),
+        }
+        logger.info(f"EventSub subscriptions reconciled: {result}")
+        return result
+
+    async def __delete(self, subscription_ids: list[str]) -> int:
+        async def delete(subscription_id: str) -> bool:
+            async with self.__semaphore:
+                try:
+                    await self.__helix.delete_subscription(subscription_id)
+                    return True
+                except HelixError as e:
+                    logger.error(
+                        f"Failed to delete subscription {subscription_id}: {e}"
+                    )
+                    return False
+
+        results = await asyncio.gather(*(delete(id) for id in subscription_ids))
+        return sum(results)
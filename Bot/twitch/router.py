@@ -0,0 +1,178 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, Awaitable, Callable
+
+from loguru import logger
+
+QUEUE_SIZE = 256
+IDLE_TIMEOUT = 60.0
+# Доля заполнения очереди, после которой канал считается перегруженным
+PRESSURE_LEVEL = 0.8
+
+Handler = Callable[[Any], Awaitable[None]]
+
+
+class ChannelQueue:
+    """Очередь событий одного канала, обработчики вызываются строго по порядку"""
+
+    __slots__ = (
+        "key",
+        "queue",
+        "worker",
+        "enqueued",
+        "processed",
+        "dropped",
+        "pressure",
+        "max_depth",
+    )
+
+    def __init__(self, key: str, size: int) -> None:
+        self.key = key
+        self.queue: asyncio.Queue[tuple[list[Handler], Any]] = asyncio.Queue(size)
+        self.worker: asyncio.Task | None = None
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.pressure = 0
+        self.max_depth = 0
+
+    def snapshot(self) -> dict[str, str | int]:
+        return {
+            "channel": self.key,
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "pressure": self.pressure,
+        }
+
+
+class Router:
+    """
+    Таблица маршрутов (тип подписки, broadcaster_id) -> обработчики.
+
+    Уведомления не ждут обработчиков в цикле чтения websocket: они кладутся в очередь
+    канала, которую разбирает отдельная задача. Каналы обрабатываются параллельно,
+    внутри канала порядок сохраняется. Если очередь канала заполнена, событие
+    отбрасывается, чтобы медленный обработчик не остановил чтение сокета.
+    """
+
+    def __init__(
+        self, queue_size: int = QUEUE_SIZE, idle_timeout: float = IDLE_TIMEOUT
+    ) -> None:
+        self.__queue_size = queue_size
+        self.__idle_timeout = idle_timeout
+        self.__pressure_depth = max(int(queue_size * PRESSURE_LEVEL), 1)
+        # broadcaster_id = None значит обработчик для всех каналов
+        self.__routes: defaultdict[tuple[str, str | None], list[Handler]] = defaultdict(
+            list
+        )
+        self.__queues: dict[str, ChannelQueue] = {}
+        # Счётчики по всем каналам, включая уже удалённые очереди
+        self.__totals = dict.fromkeys(
+            ("enqueued", "processed", "dropped", "pressure"), 0
+        )
+        self.__closing = False
+
+    def route(
+        self, subscription_type: str, broadcaster_id: str | None = None
+    ) -> Callable[[Handler], Handler]:
+        def wrapper(handler: Handler) -> Handler:
+            self.__routes[(subscription_type, broadcaster_id)].append(handler)
+            return handler
+
+        return wrapper
+
+    def unroute(self, subscription_type: str, broadcaster_id: str | None = None):
+        self.__routes.pop((subscription_type, broadcaster_id), None)
+
+    def handlers(self, subscription_type: str, broadcaster_id: str) -> list[Handler]:
+        routes = self.__routes
+        specific = routes.get((subscription_type, broadcaster_id))
+        common = routes.get((subscription_type, None))
+        if specific and common:
+            return specific + common
+        return specific or common or []
+
+    def dispatch(self, subscription_type: str, broadcaster_id: str, event: Any) -> bool:
+        """Ставит событие в очередь канала, False если оно отброшено"""
+        handlers = self.handlers(subscription_type, broadcaster_id)
+        if not handlers or self.__closing:
+            return False
+
+        channel = self.__queues.get(broadcaster_id)
+        if channel is None:
+            channel = self.__queues[broadcaster_id] = ChannelQueue(
+                broadcaster_id, self.__queue_size
+            )
+
+        try:
+            channel.queue.put_nowait((handlers, event))
+        except asyncio.QueueFull:
+            channel.dropped += 1
+            self.__totals["dropped"] += 1
+            if channel.dropped % 100 == 1:
+                logger.warning(
+                    f"Queue of {broadcaster_id} is full, dropped {channel.dropped} events"
+                )
+            return False
+
+        channel.enqueued += 1
+        self.__totals["enqueued"] += 1
+        depth = channel.queue.qsize()
+        if depth > channel.max_depth:
+            channel.max_depth = depth
+        if depth >= self.__pressure_depth:
+            channel.pressure += 1
+            self.__totals["pressure"] += 1
+
+        if channel.worker is None:
+            channel.worker = asyncio.create_task(self.__work(channel))
+        return True
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "channels": len(self.__queues),
+            "depth": sum(channel.queue.qsize() for channel in self.__queues.values()),
+            **self.__totals,
+        }
+
+    def channel_stats(self) -> list[dict[str, str | int]]:
+        return [channel.snapshot() for channel in self.__queues.values()]
+
+    async def close(self) -> None:
+        self.__closing = True
+        workers = [
+            channel.worker for channel in self.__queues.values() if channel.worker
+        ]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def __work(self, channel: ChannelQueue) -> None:
+        queue = channel.queue
+        try:
+            while True:
+                if queue.empty():
+                    try:
+                        handlers, event = await asyncio.wait_for(
+                            queue.get(), self.__idle_timeout
+                        )
+                    except TimeoutError:
+                        # Молчащий канал не держит задачу, при новом событии она создастся снова
+                        return
+                else:
+                    handlers, event = queue.get_nowait()
+
+                for handler in handlers:
+                    try:
+                        await handler(event)
+                    except Exception as e:
+                        logger.exception(e)
+                channel.processed += 1
+                self.__totals["processed"] += 1
+        finally:
+            channel.worker = None
+            if queue.empty():
+                del self.__queues[channel.key]
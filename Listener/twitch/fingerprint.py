@@ -0,0 +1,131 @@
+import asyncio
+
+import numpy as np
+
+# 8 кГц моно хватает для пиков до 4 кГц, на которых держится отпечаток
+SAMPLE_RATE = 8000
+WINDOW = 1024
+HOP = 256
+# Окрестность пика: частотные бины и кадры по каждую сторону
+PEAK_FREQUENCY = 10
+PEAK_TIME = 5
+# Пик должен быть громче медианы спектрограммы, в дБ
+PEAK_THRESHOLD = 10.0
+# Сколько целей берётся на каждый якорь и как далеко вперёд, в кадрах (~2 с)
+FAN_OUT = 15
+MAX_DELTA = 63
+# Совпавших хэшей с одним сдвигом во времени, чтобы считать отрывки одной записью
+MIN_VOTES = 20
+
+
+class Fingerprint:
+    """Хэши пар пиков спектрограммы и кадры их якорей"""
+
+    __slots__ = ("hashes", "times", "__order", "__ordered")
+
+    def __init__(self, hashes: np.ndarray, times: np.ndarray) -> None:
+        self.hashes = hashes
+        self.times = times
+        self.__order: np.ndarray | None = None
+        self.__ordered: np.ndarray | None = None
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def index(self) -> tuple[np.ndarray, np.ndarray]:
+        """Порядок сортировки хэшей и хэши в этом порядке, считается один раз"""
+        if self.__order is None:
+            self.__order = np.argsort(self.hashes, kind="stable")
+            self.__ordered = self.hashes[self.__order]
+        return self.__order, self.__ordered
+
+
+async def decode(audio: bytes) -> np.ndarray:
+    """PCM моно SAMPLE_RATE из AAC, декодирует ffmpeg"""
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        *("-loglevel", "error", "-f", "aac", "-i", "pipe:0"),
+        *("-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    output, error = await process.communicate(audio)
+    if process.returncode:
+        raise RuntimeError(f"ffmpeg: {error.decode(errors='replace').strip()}")
+    return np.frombuffer(output, dtype=np.int16)
+
+
+def spectrogram(samples: np.ndarray) -> np.ndarray:
+    """Логарифмическая спектрограмма, кадры по строкам"""
+    if len(samples) < WINDOW:
+        return np.empty((0, WINDOW // 2), dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, WINDOW)[::HOP]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(WINDOW), axis=1))
+    # Последний бин (частота Найквиста) выкинут, чтобы частота влезала в 9 бит
+    return 20 * np.log10(spectrum[:, : WINDOW // 2] + 1e-6, dtype=np.float32)
+
+
+def _maximum(values: np.ndarray, radius: int, axis: int) -> np.ndarray:
+    padding = [(0, 0), (0, 0)]
+    padding[axis] = (radius, radius)
+    padded = np.pad(values, padding, constant_values=-np.inf)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1, axis)
+    return windows.max(axis=-1)
+
+
+def peaks(spectrum: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Кадры и частоты локальных максимумов, отсортированные по времени"""
+    if not spectrum.size:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    # Прямоугольный максимум раскладывается на два одномерных
+    neighbourhood = _maximum(_maximum(spectrum, PEAK_FREQUENCY, 1), PEAK_TIME, 0)
+    mask = (spectrum == neighbourhood) & (
+        spectrum > np.median(spectrum) + PEAK_THRESHOLD
+    )
+    return np.nonzero(mask)
+
+
+def fingerprint(samples: np.ndarray) -> Fingerprint:
+    """
+    Хэши пар пиков как у Shazam: якорь, цель в пределах MAX_DELTA кадров и
+    разница во времени между ними. Хэш не зависит от положения в записи, поэтому
+    отрывки одной песни совпадают со сдвигом по времени.
+    """
+    times, frequencies = peaks(spectrogram(samples))
+    hashes = []
+    anchors = []
+    for shift in range(1, FAN_OUT + 1):
+        delta = times[shift:] - times[:-shift]
+        valid = (delta > 0) & (delta <= MAX_DELTA)
+        hashes.append(
+            (frequencies[:-shift][valid] << 15)
+            | (frequencies[shift:][valid] << 6)
+            | delta[valid]
+        )
+        anchors.append(times[:-shift][valid])
+    return Fingerprint(
+        np.concatenate(hashes).astype(np.uint32),
+        np.concatenate(anchors).astype(np.int32),
+    )
+
+
+def votes(query: Fingerprint, reference: Fingerprint) -> int:
+    """Сколько хэшей совпало с одинаковым сдвигом во времени"""
+    order, ordered = reference.index()
+    left = np.searchsorted(ordered, query.hashes, "left")
+    counts = np.searchsorted(ordered, query.hashes, "right") - left
+    matched = counts > 0
+    if not matched.any():
+        return 0
+    # Каждый хэш запроса в паре со всеми такими же хэшами образца
+    counts = counts[matched]
+    total = counts.sum()
+    first = np.repeat(np.nonzero(matched)[0], counts)
+    within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = order[np.repeat(left[matched], counts) + within]
+    offsets = reference.times[second] - query.times[first]
+    histogram = np.bincount(offsets - offsets.min())
+    # Отрывки режутся не по границе кадра, поэтому соседние сдвиги считаются вместе
+    return int(np.convolve(histogram, np.ones(3, dtype=histogram.dtype)).max())
@@ -0,0 +1,113 @@
+import re
+
+# Значения атрибутов бывают в кавычках и с запятыми внутри: CODECS="avc1.4D401F,mp4a.40.2"
+ATTRIBUTE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+AUDIO_ONLY = "audio_only"
+
+
+class Variant:
+    __slots__ = ("uri", "bandwidth", "codecs", "resolution", "group", "name")
+
+    def __init__(
+        self,
+        uri: str,
+        bandwidth: int,
+        codecs: tuple[str, ...],
+        resolution: str | None,
+        group: str | None,
+        name: str | None,
+    ) -> None:
+        self.uri = uri
+        self.bandwidth = bandwidth
+        self.codecs = codecs
+        self.resolution = resolution
+        # GROUP-ID из #EXT-X-MEDIA, у Twitch это имя рендишена: chunked, 720p60, audio_only
+        self.group = group
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"Variant({self.name or self.group!r}, {self.bandwidth} bps)"
+
+    @property
+    def audio_only(self) -> bool:
+        if self.group == AUDIO_ONLY:
+            return True
+        return bool(self.codecs) and all(
+            codec.startswith("mp4a") for codec in self.codecs
+        )
+
+
+def parse_attributes(line: str) -> dict[str, str]:
+    attributes = {}
+    for key, value in ATTRIBUTE.findall(line.partition(":")[2]):
+        attributes[key] = value.strip('"')
+    return attributes
+
+
+def parse_master(content: str) -> list[Variant]:
+    """Варианты master плейлиста в порядке появления"""
+    names = {}
+    variants = []
+    stream = None
+    for line in content.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MEDIA:"):
+            media = parse_attributes(line)
+            names[media.get("GROUP-ID")] = media.get("NAME")
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            stream = parse_attributes(line)
+        elif line and not line.startswith("#") and stream is not None:
+            group = stream.get("VIDEO")
+            codecs = stream.get("CODECS")
+            variants.append(
+                Variant(
+                    line,
+                    int(stream.get("BANDWIDTH", 0)),
+                    tuple(codecs.split(",")) if codecs else (),
+                    stream.get("RESOLUTION"),
+                    group,
+                    names.get(group),
+                )
+            )
+            stream = None
+    return variants
+
+
+def select_audio(variants: list[Variant]) -> Variant | None:
+    """Рендишен только со звуком, если его нет, то самый лёгкий"""
+    for variant in variants:
+        if variant.audio_only:
+            return variant
+    return min(variants, key=lambda variant: variant.bandwidth, default=None)
+
+
+class MediaPlaylist:
+    __slots__ = ("segments", "target_duration", "ended")
+
+    def __init__(
+        self, segments: list[tuple[str, float]], target_duration: float, ended: bool
+    ) -> None:
+        self.segments = segments
+        self.target_duration = target_duration
+        self.ended = ended
+
+
+def parse_media(content: str, default_duration: float) -> MediaPlaylist:
+    """Сегменты медиаплейлиста с длительностью, включая prefetch сегменты Twitch"""
+    segments = []
+    target_duration = default_duration
+    duration = default_duration
+    ended = False
+    for line in content.splitlines():
+        line = line.strip()
+        if line.startswith("#EXTINF:"):
+            duration = float(line[8:].split(",", 1)[0])
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            target_duration = float(line[22:])
+        elif line.startswith("#EXT-X-TWITCH-PREFETCH:"):
+            segments.append((line[23:], duration))
+        elif line == "#EXT-X-ENDLIST":
+            ended = True
+        elif line and not line.startswith("#"):
+            segments.append((line, duration))
+    return MediaPlaylist(segments, target_duration, ended)
@@ -1,6 +1,8 @@
 import asyncio
+import json
+import random
 import sys
-from time import perf_counter, time
+from time import monotonic
 
 import aiofiles
 import aiohttp
@@ -9,6 +11,12 @@ from loguru import logger
 from shazamio import Shazam
 
 from kafkaclient import Client
+from .fingerprint import Fingerprint, decode, fingerprint
+from .hls import parse_master, parse_media, select_audio
+from .scheduler import PlaylistScheduler, Watcher
+from .segments import MAX_SEGMENTS, SegmentBuffer
+from .songs import SongHistory
+from .ts import AacDemuxer
 
 logger.remove()
 logger.add(sys.stdout, level="TRACE", enqueue=True)
@@ -18,6 +26,18 @@ asyncio.set_event_loop(LOOP)
 
 client = Client("recognizer", LOOP)
 
+# Длительность сегмента Twitch, если в плейлисте нет #EXTINF
+SEGMENT_DURATION = 2.0
+RETRIES = 3
+BACKOFF = 0.25
+MAX_BACKOFF = 2.0
+# Одновременных загрузок сегментов на все каналы
+SEGMENT_CONCURRENCY = 64
+CHUNK_SIZE = 16 * 1024
+TIMEOUT = aiohttp.ClientTimeout(total=10, connect=3)
+# Сколько секунд после !song канал отпечатывается с каждым новым сегментом
+ACTIVE = 300.0
+
 
 @client.wrap_class
 class Listener:
@@ -36,16 +56,34 @@ class Listener:
             }
         )
         self.information = {}
+        self.segment_semaphore = asyncio.Semaphore(SEGMENT_CONCURRENCY)
+        self.scheduler = PlaylistScheduler(self._poll, self._stopped)
 
-    async def _make_request(self, method, url, headers=None, json=None, data=None):
-        for _ in range(3):
+    async def _make_request(
+        self, method, url, headers=None, json=None, data=None
+    ) -> bytes | None:
+        """Тело ответа, соединение сразу возвращается в пул"""
+        for attempt in range(RETRIES):
             try:
                 logger.trace(f"Делаю {method} запрос на {url[:25]}")
-                return await self.session.request(
+                async with self.session.request(
                     method, url, headers=headers, json=json, data=data
-                )
-            except aiohttp.ClientError as e:
-                logger.exception(e)
+                ) as response:
+                    if response.status < 500 and response.status != 429:
+                        return await response.read()
+                    error = f"HTTP {response.status}"
+            except (aiohttp.ClientError, TimeoutError) as e:
+                error = repr(e)
+            await self._backoff(attempt, url, error)
+        return None
+
+    async def _backoff(self, attempt: int, url: str, error: str) -> None:
+        # Полный jitter, чтобы каналы после общего сбоя не повторяли запросы разом
+        delay = random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2**attempt))
+        logger.warning(
+            f"Запрос на {url[:40]} не удался ({error}), повтор через {delay:.2f}с"
+        )
+        await asyncio.sleep(delay)
 
     async def _get_m3u8(self, login: str) -> str:
         operation = {
@@ -70,11 +108,11 @@ class Listener:
             headers=self.headers,
             json=operation,
         )
-        json = await response.json()
-        if "data" not in json:
+        content = json.loads(response) if response else {}
+        if "data" not in content:
             logger.error("Не смог получить PlaybackAccessToken, выхожу.")
             return None
-        playback_token = (await response.json())["data"]["streamPlaybackAccessToken"]
+        playback_token = content["data"]["streamPlaybackAccessToken"]
         logger.trace(f"Успешно получил PlaybackAccessToken {playback_token}")
         response = await self._make_request(
             "GET",
@@ -82,30 +120,53 @@ class Listener:
             f"&token={playback_token['value']}&sig={playback_token['signature']}&allow_source=true&allow_audio_only=true",
             headers=self.headers,
         )
-        playlists = self._m3u8_parser(await response.text())
-        logger.trace(f"Успешно получил плейлисты: {playlists}")
-        if not playlists:
+        if response is None:
             logger.error("Не получил плейлисты, выхожу")
             return None
-        else:
-            return playlists[-1]
+        variants = parse_master(response.decode())
+        logger.trace(f"Успешно получил плейлисты: {variants}")
+        variant = select_audio(variants)
+        if variant is None:
+            logger.error("Не получил плейлисты, выхожу")
+            return None
+        if not variant.audio_only:
+            logger.warning(f"У {login} нет audio_only, беру {variant}")
+        return variant.uri
 
-    def _m3u8_parser(self, content: str) -> list | None:
-        uris = []
-        if content.endswith("#EXT-X-ENDLIST"):
+    async def _download_fragment(self, uri) -> bytearray | None:
+        """
+        AAC сегмента. TS разбирается по мере загрузки, целиком сегмент в памяти
+        не собирается, в буфер попадает только звук.
+        """
+        async with self.segment_semaphore:
+            for attempt in range(RETRIES):
+                demuxer = AacDemuxer()
+                try:
+                    async with self.session.get(uri, headers=self.headers) as response:
+                        if response.status < 500 and response.status != 429:
+                            if response.status != 200:
+                                logger.warning(
+                                    f"Сегмент недоступен: HTTP {response.status}"
+                                )
+                                return None
+                            async for chunk in response.content.iter_chunked(
+                                CHUNK_SIZE
+                            ):
+                                demuxer.feed(chunk)
+                            break
+                        error = f"HTTP {response.status}"
+                except (aiohttp.ClientError, TimeoutError) as e:
+                    error = repr(e)
+                await self._backoff(attempt, uri, error)
+            else:
+                return None
+        if demuxer.audio_pid is None:
+            logger.warning("В сегменте нет AAC дорожки")
             return None
-        for s in content.split():
-            if s.startswith("https"):
-                uris.append(s)
-            elif s.startswith("#EXT-X-TWITCH-PREFETCH:"):
-                uris.append(s.lstrip("#EXT-X-TWITCH-PREFETCH:"))
-        return uris
-
-    async def _download_fragment(self, segments, uri):
-        response = await self._make_request("GET", uri, headers=self.headers)
-        segments[uri] = await response.content.read()
-
-    async def _thread(self, login) -> None:
+        return demuxer.audio
+
+    async def _watch(self, login) -> None:
+        """Получает плейлист канала и отдаёт его планировщику"""
         for _ in range(3):
             stream = await self._get_m3u8(login)
             if stream:
@@ -114,53 +175,49 @@ class Listener:
             logger.info("Не смог получить стрим, повторная попытка через 5 сек.")
             await asyncio.sleep(5)
         else:
-            self.information[login] = {
-                "task": None,
-                "segments": {},
-                "errors": [],
-            }
+            self._stopped(login)
             logger.error("Слишком много неуспешных попыток, выхожу.")
             return
-        segments = self.information[login]["segments"]
+        self.scheduler.add(login, stream, SEGMENT_DURATION)
 
-        while True:
-            try:
-                start_time = perf_counter()
-                response = await self._make_request("GET", stream, headers=self.headers)
-                segments_uri = self._m3u8_parser(await response.text())
-                if segments_uri is None:
-                    # That means that stream has ended and we need to stop function
-                    logger.debug(f"Стрим закончился. Логин: {login}")
-                    break
-                segments_uri = segments_uri[:-7:-1]
-                for uri in segments_uri:
-                    if uri not in segments:
-                        await self._download_fragment(segments, uri)
-                for uri in list(segments):
-                    if uri not in segments_uri:
-                        del segments[uri]
-                    else:
-                        break
-                """
-                audio = b""
-                for segment in segments.values():
-                    audio = audio + segment
-                await self.__save_audio(str(i), audio)
-                i += 1
-                """
-                await asyncio.sleep(2 - (perf_counter() - start_time))
-            except Exception as e:
-                logger.exception(e)
-                timestamp = time()
-                errors = self.information[login]["errors"]
-                for error in errors:
-                    if timestamp - error > 10:
-                        errors.remove(error)
-                errors.append(timestamp)
-                if len(errors) > 5:
-                    logger.error(f"Слишком много ошибок. Выхожу. Логин: {login}")
-                    break
-        self.information[login] = {"task": None, "segments": {}, "errors": []}
+    async def _poll(self, watcher: Watcher) -> float | None:
+        """Одно обновление плейлиста, пауза до следующего по #EXT-X-TARGETDURATION"""
+        response = await self._make_request("GET", watcher.stream, headers=self.headers)
+        if response is None:
+            raise RuntimeError("Не получил плейлист сегментов")
+        playlist = parse_media(response.decode(), SEGMENT_DURATION)
+        if playlist.ended:
+            logger.debug(f"Стрим закончился. Логин: {watcher.login}")
+            return None
+        watcher.target_duration = playlist.target_duration
+        segments = self.information[watcher.login]["segments"]
+        # Новые сегменты качаются параллельно, а в буфер ложатся по порядку.
+        # Старые сегменты вытесняет сам буфер
+        new = [
+            (uri, duration)
+            for uri, duration in playlist.segments[-MAX_SEGMENTS:]
+            if uri not in segments
+        ]
+        downloaded = await asyncio.gather(
+            *(self._download_fragment(uri) for uri, _ in new)
+        )
+        for (uri, duration), data in zip(new, downloaded):
+            if data is not None and not segments.append(uri, data, duration):
+                logger.warning(f"Сегмент {len(data)} байт не влез в буфер")
+        # Пока в канале спрашивают !song, отпечаток считается сразу, а не по запросу.
+        # Отдельной задачей, чтобы декодирование не занимало место обновлений плейлистов
+        requested = self.information[watcher.login]["requested"]
+        if new and monotonic() - requested < ACTIVE:
+            self._fingerprint_task(watcher.login)
+        # RFC 8216 6.3.4: если плейлист не изменился, следующая попытка через
+        # половину target duration
+        if new:
+            return playlist.target_duration
+        return playlist.target_duration / 2
+
+    def _stopped(self, login: str) -> None:
+        self.information[login]["segments"].clear()
+        self.information[login]["fingerprint"] = None
 
     async def __save_audio(self, filename, audio):
         file = await aiofiles.open(f"{filename}.ts", "wb")
@@ -179,55 +236,147 @@ class Listener:
             return None
         if len(shazam_response["matches"]) != 0:
             song_name = f"{shazam_response['track']['subtitle']} - {shazam_response['track']['title']}"
-        return song_name
+        # Пустая строка, если Shazam ответил, но песню не нашёл
+        return song_name or ""
+
+    def _information(self, login: str) -> dict:
+        information = self.information.get(login)
+        if information is None:
+            information = self.information[login] = {
+                "task": None,
+                "segments": SegmentBuffer(),
+                "songs": SongHistory(),
+                # (SegmentBuffer.written, задача отпечатка) последнего буфера
+                "fingerprint": None,
+                "requested": 0.0,
+                # SegmentBuffer.written буфера, в котором Shazam ничего не нашёл
+                "miss": None,
+                "recognizing": None,
+            }
+        return information
+
+    def _fingerprint_task(self, login: str) -> asyncio.Task | None:
+        """
+        Задача отпечатка буфера канала. На канал считается не больше одного
+        отпечатка сразу: пока он не готов, его получают все, кто спросит, даже
+        если в буфер уже пришёл новый сегмент.
+        """
+        information = self.information[login]
+        segments = information["segments"]
+        if not len(segments):
+            return None
+        written = segments.written
+        cached = information["fingerprint"]
+        if cached is not None and (cached[0] == written or not cached[1].done()):
+            return cached[1]
+        task = self.loop.create_task(
+            self.__make_fingerprint(login, bytes(segments.last()))
+        )
+        information["fingerprint"] = (written, task)
+        return task
+
+    async def _fingerprint(self, login: str) -> Fingerprint | None:
+        task = self._fingerprint_task(login)
+        if task is None:
+            return None
+        return await asyncio.shield(task)
+
+    async def __make_fingerprint(self, login: str, audio: bytes) -> Fingerprint | None:
+        try:
+            samples = await decode(audio)
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"Не смог декодировать звук {login}: {e!r}")
+            return None
+        # Спектрограмма считается в потоке, чтобы не держать цикл событий
+        result = await self.loop.run_in_executor(None, fingerprint, samples)
+        # Соседние буферы перекрываются, так узнанная песня тянется дальше буфера
+        song = await self.information[login]["songs"].chain(result)
+        if song is not None:
+            logger.trace(f"Продлил {song.title} новым буфером {login}")
+        return result
+
+    async def _recognize(self, login: str) -> str | None:
+        """Ищет песню среди уже узнанных на канале, Shazam только если не нашлась"""
+        information = self.information[login]
+        songs = information["songs"]
+        segments = information["segments"]
+        written = segments.written
+        if information["miss"] == written:
+            # Shazam уже не узнал этот звук, новых сегментов с тех пор не было
+            return None
+        result = await self._fingerprint(login)
+        if result is not None:
+            song = await songs.find(result)
+            if song is not None:
+                logger.debug(f"Узнал {song.title} по локальному отпечатку {login}")
+                return song.title
+        # shazamio принимает только bytes, это единственная копия
+        audio = bytes(segments.last())
+        title = await self._get_song(audio)
+        if title == "":
+            information["miss"] = written
+            return None
+        if title is not None and result is not None:
+            songs.remember(title, result)
+        return title
 
     @client.event("recognize")
     async def recognize(self, login: str) -> str:
         try:
-            audio = b""
-            if login not in self.information:
-                self.information[login] = {
-                    "task": None,
-                    "segments": {},
-                    "errors": [],
-                }
-            if (
-                self.information[login]["task"] is None
-                or self.information[login]["task"].done()
-            ):
+            information = self._information(login)
+            information["requested"] = monotonic()
+            task = information["task"]
+            if login not in self.scheduler and (task is None or task.done()):
                 await self.on_online(login)
                 await asyncio.sleep(16)
-            for num, segment in enumerate(
-                self.information[login]["segments"].copy().values()
-            ):
-                audio = audio + segment
-            song = await self._get_song(audio)
+            # Одновременные !song в канале ждут одного распознавания
+            pending = information["recognizing"]
+            if pending is None or pending.done():
+                pending = information["recognizing"] = self.loop.create_task(
+                    self._recognize(login)
+                )
+            song = await asyncio.shield(pending)
             return song or "none"
         except Exception as e:
             logger.exception(e)
             return "error"
 
+    @client.event("history")
+    async def history(self, login: str) -> str:
+        if login not in self.information:
+            return "none"
+        songs = [song.title for song in self.information[login]["songs"]]
+        return "; ".join(songs) or "none"
+
     @client.event("online")
     async def on_online(self, login: str):
-        if login not in self.information:
-            self.information[login] = {
-                "task": None,
-                "segments": {},
-                "errors": [],
-            }
+        self._information(login)
         if self.information[login]["task"] is not None:
             if not self.information[login]["task"].done():
                 self.information[login]["task"].cancel()
-        task = self.loop.create_task(self._thread(login))
-        logger.debug(f"Начал _thread для {login}")
+        # Новый стрим получает новый токен, старый плейлист больше не опрашивается
+        self.scheduler.remove(login)
+        task = self.loop.create_task(self._watch(login))
+        logger.debug(f"Начал _watch для {login}")
         self.information[login]["task"] = task
 
     async def start(self) -> None:
-        self.session = aiohttp.ClientSession()
+        # Соединения к CDN переиспользуются между обновлениями плейлистов
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=SEGMENT_CONCURRENCY * 2,
+                limit_per_host=SEGMENT_CONCURRENCY,
+                keepalive_timeout=30,
+                ttl_dns_cache=300,
+            ),
+            timeout=TIMEOUT,
+        )
         self.shazam = Shazam()
+        self.scheduler.start()
         await client.start()
 
     async def stop(self) -> None:
+        self.scheduler.stop()
         await self.session.close()
         await client.stop()
 
@@ -0,0 +1,224 @@
+import asyncio
+import random
+from collections import deque
+from time import monotonic
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+# Шаг колеса и число слотов: 0.1 с и 1024 слота покрывают ~100 секунд за оборот,
+# более дальние таймеры просто ждут нужного оборота
+RESOLUTION = 0.1
+SLOTS = 1024
+# Одновременных обновлений плейлистов на все каналы
+FETCH_CONCURRENCY = 100
+# Первое обновление нового канала случайно сдвинуто в пределах типичного
+# #EXT-X-TARGETDURATION Twitch, чтобы каналы после перезапуска не шли залпом
+STAGGER = 6.0
+# Больше ERROR_LIMIT ошибок за ERROR_WINDOW секунд и канал снимается с прослушки
+ERROR_LIMIT = 5
+ERROR_WINDOW = 10.0
+ERROR_DELAY = 1.0
+
+
+class ErrorRate:
+    """Помнит время последних limit + 1 ошибок, добавление и проверка за O(1)"""
+
+    __slots__ = ("limit", "window", "times", "total")
+
+    def __init__(self, limit: int = ERROR_LIMIT, window: float = ERROR_WINDOW):
+        self.limit = limit
+        self.window = window
+        self.times: deque[float] = deque(maxlen=limit + 1)
+        self.total = 0
+
+    def add(self, now: float) -> bool:
+        """Записывает ошибку, True если за окно их стало больше limit"""
+        self.times.append(now)
+        self.total += 1
+        return len(self.times) > self.limit and now - self.times[0] <= self.window
+
+
+class Watcher:
+    __slots__ = ("login", "stream", "target_duration", "errors", "active", "polls")
+
+    def __init__(self, login: str, stream: str, target_duration: float) -> None:
+        self.login = login
+        self.stream = stream
+        # Обновляется из каждого плейлиста
+        self.target_duration = target_duration
+        self.errors = ErrorRate()
+        self.active = True
+        self.polls = 0
+
+
+class TimerWheel:
+    """
+    Таймеры в кольце слотов по RESOLUTION секунд.
+
+    Постановка O(1), за тик разбирается один слот. Таймер хранит номер тика, в
+    котором сработает, поэтому дальше одного оборота он просто остаётся в слоте.
+    Отмена ленивая: владелец помечает элемент неактивным, колесо его пропускает.
+    """
+
+    __slots__ = ("resolution", "__slots", "__tick", "__count")
+
+    def __init__(self, resolution: float = RESOLUTION, slots: int = SLOTS) -> None:
+        self.resolution = resolution
+        self.__slots: list[list[tuple[int, Watcher]]] = [[] for _ in range(slots)]
+        self.__tick = int(monotonic() / resolution)
+        self.__count = 0
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def schedule(self, watcher: Watcher, delay: float) -> None:
+        now = monotonic()
+        if not self.__count:
+            # Пустое колесо не крутилось, пропускаем простой разом
+            self.__tick = max(self.__tick, int(now / self.resolution))
+        # Не раньше следующего тика, текущий уже мог быть разобран
+        tick = max(self.__tick + 1, int((now + delay) / self.resolution))
+        self.__slots[tick % len(self.__slots)].append((tick, watcher))
+        self.__count += 1
+
+    def advance(self, now: float) -> list[Watcher]:
+        """Наблюдатели, чьё время пришло к моменту now"""
+        due = []
+        target = int(now / self.resolution)
+        while self.__tick < target:
+            self.__tick += 1
+            slot = self.__slots[self.__tick % len(self.__slots)]
+            if not slot:
+                continue
+            waiting = []
+            for tick, watcher in slot:
+                if tick > self.__tick:
+                    waiting.append((tick, watcher))
+                    continue
+                self.__count -= 1
+                if watcher.active:
+                    due.append(watcher)
+            slot[:] = waiting
+        return due
+
+    def next_tick(self) -> float:
+        return (self.__tick + 1) * self.resolution
+
+
+# Одно обновление канала, возвращает паузу до следующего или None, если стрим закончился
+Poll = Callable[[Watcher], Awaitable[float | None]]
+Stop = Callable[[str], None]
+
+
+class PlaylistScheduler:
+    """
+    Общий планировщик обновлений плейлистов для всех каналов.
+
+    Вместо отдельного цикла со sleep на каждый канал один таймер будит каналы по
+    колесу, а число одновременных обновлений ограничено. Следующее обновление
+    планируется только после конца предыдущего, так что канал не опрашивается
+    дважды одновременно.
+    """
+
+    def __init__(
+        self, poll: Poll, stop: Stop, concurrency: int = FETCH_CONCURRENCY
+    ) -> None:
+        self.__poll = poll
+        self.__stop = stop
+        self.__semaphore = asyncio.Semaphore(concurrency)
+        self.__wheel = TimerWheel()
+        self.__watchers: dict[str, Watcher] = {}
+        self.__running: set[asyncio.Task] = set()
+        self.__wakeup = asyncio.Event()
+        self.__task: asyncio.Task | None = None
+        self.__counters = dict.fromkeys(("polls", "errors", "late", "stopped"), 0)
+
+    def __len__(self) -> int:
+        return len(self.__watchers)
+
+    def __contains__(self, login: str) -> bool:
+        return login in self.__watchers
+
+    def start(self) -> None:
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        for task in self.__running:
+            task.cancel()
+
+    def add(self, login: str, stream: str, target_duration: float) -> Watcher:
+        """Начинает опрашивать канал, заменяя прежний плейлист, если он был"""
+        self.remove(login)
+        watcher = self.__watchers[login] = Watcher(login, stream, target_duration)
+        self.__wheel.schedule(watcher, random.uniform(0, STAGGER))
+        self.__wakeup.set()
+        return watcher
+
+    def remove(self, login: str) -> Watcher | None:
+        watcher = self.__watchers.pop(login, None)
+        if watcher is not None:
+            watcher.active = False
+        return watcher
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "channels": len(self.__watchers),
+            "timers": len(self.__wheel),
+            "running": len(self.__running),
+            **self.__counters,
+        }
+
+    async def __run(self) -> None:
+        wheel = self.__wheel
+        while True:
+            if not len(wheel):
+                self.__wakeup.clear()
+                await self.__wakeup.wait()
+            await asyncio.sleep(max(wheel.next_tick() - monotonic(), 0.0))
+            for watcher in wheel.advance(monotonic()):
+                task = asyncio.create_task(self.__fire(watcher))
+                self.__running.add(task)
+                task.add_done_callback(self.__running.discard)
+
+    async def __fire(self, watcher: Watcher) -> None:
+        async with self.__semaphore:
+            if not watcher.active:
+                return
+            started = monotonic()
+            try:
+                delay = await self.__poll(watcher)
+            except Exception as e:
+                logger.exception(e)
+                self.__counters["errors"] += 1
+                if watcher.errors.add(monotonic()):
+                    logger.error(
+                        f"Слишком много ошибок. Выхожу. Логин: {watcher.login}"
+                    )
+                    self.__finish(watcher)
+                    return
+                delay = ERROR_DELAY
+        self.__counters["polls"] += 1
+        watcher.polls += 1
+        if delay is None:
+            self.__finish(watcher)
+            return
+        if not watcher.active:
+            return
+        # Пауза отсчитывается от начала обновления, а не от его конца
+        elapsed = monotonic() - started
+        if elapsed > delay:
+            self.__counters["late"] += 1
+        self.__wheel.schedule(watcher, delay - elapsed)
+        self.__wakeup.set()
+
+    def __finish(self, watcher: Watcher) -> None:
+        if self.__watchers.get(watcher.login) is watcher:
+            del self.__watchers[watcher.login]
+            watcher.active = False
+            self.__counters["stopped"] += 1
+            self.__stop(watcher.login)
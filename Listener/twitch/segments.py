@@ -0,0 +1,116 @@
+from collections import deque
+
+# Шесть сегментов audio_only по ~50 КБ с запасом на видео рендишены
+BUFFER_SIZE = 512 * 1024
+MAX_SEGMENTS = 6
+
+
+class Segment:
+    __slots__ = ("uri", "offset", "length", "duration")
+
+    def __init__(self, uri: str, offset: int, length: int, duration: float) -> None:
+        self.uri = uri
+        # Смещение от начала записи, в буфере лежит по offset % capacity
+        self.offset = offset
+        self.length = length
+        self.duration = duration
+
+
+class SegmentBuffer:
+    """
+    Последние сегменты стрима в кольцевом буфере фиксированного размера.
+
+    Буфер выделен один раз и зеркалирован: каждый байт пишется по i и по i +
+    capacity, поэтому любой отрезок не длиннее capacity лежит в памяти подряд и
+    last() отдаёт его как memoryview без копирования. View остаётся верным, пока
+    в буфер не записано ещё capacity байт.
+    """
+
+    __slots__ = (
+        "capacity",
+        "max_segments",
+        "__buffer",
+        "__view",
+        "__segments",
+        "__uris",
+        "__end",
+    )
+
+    def __init__(self, capacity: int = BUFFER_SIZE, max_segments: int = MAX_SEGMENTS):
+        self.capacity = capacity
+        self.max_segments = max_segments
+        self.__buffer = bytearray(capacity * 2)
+        self.__view = memoryview(self.__buffer)
+        self.__segments: deque[Segment] = deque()
+        self.__uris: set[str] = set()
+        self.__end = 0
+
+    def __len__(self) -> int:
+        return len(self.__segments)
+
+    def __contains__(self, uri: str) -> bool:
+        return uri in self.__uris
+
+    @property
+    def size(self) -> int:
+        if not self.__segments:
+            return 0
+        return self.__end - self.__segments[0].offset
+
+    @property
+    def written(self) -> int:
+        """Сколько байт записано за всё время, меняется с каждым сегментом"""
+        return self.__end
+
+    @property
+    def duration(self) -> float:
+        return sum(segment.duration for segment in self.__segments)
+
+    def append(self, uri: str, data: bytes, duration: float) -> bool:
+        """Дописывает сегмент, вытесняя самые старые. False, если он больше буфера"""
+        length = len(data)
+        if length > self.capacity:
+            return False
+
+        segments = self.__segments
+        while segments and (
+            self.size + length > self.capacity or len(segments) >= self.max_segments
+        ):
+            self.__uris.discard(segments.popleft().uri)
+
+        capacity = self.capacity
+        view = self.__view
+        start = self.__end % capacity
+        head = min(length, capacity - start)
+        tail = length - head
+        view[start : start + head] = data[:head]
+        view[start + capacity : start + capacity + head] = data[:head]
+        if tail:
+            view[:tail] = data[head:]
+            view[capacity : capacity + tail] = data[head:]
+
+        segments.append(Segment(uri, self.__end, length, duration))
+        self.__uris.add(uri)
+        self.__end += length
+        return True
+
+    def last(self, seconds: float | None = None) -> memoryview:
+        """Последние сегменты общей длительностью не меньше seconds, по умолчанию все"""
+        if not self.__segments:
+            return self.__view[:0]
+
+        first = self.__segments[0]
+        if seconds is not None:
+            collected = 0.0
+            for segment in reversed(self.__segments):
+                first = segment
+                collected += segment.duration
+                if collected >= seconds:
+                    break
+
+        start = first.offset % self.capacity
+        return self.__view[start : start + self.__end - first.offset]
+
+    def clear(self) -> None:
+        self.__segments.clear()
+        self.__uris.clear()
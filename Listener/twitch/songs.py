@@ -0,0 +1,105 @@
+import asyncio
+from collections import OrderedDict
+from time import time
+from typing import Iterator
+
+from .fingerprint import MIN_VOTES, Fingerprint, votes
+
+HISTORY_SIZE = 20
+# Отпечатков на песню, каждый покрывает буфер в ~12 секунд
+FINGERPRINTS = 8
+# Сколько секунд после ответа Shazam песню можно продлевать соседними буферами.
+# Перекрытие буферов не отличает ту же песню от следующей, поэтому смена трека
+# узнаётся заново не позже чем через это время
+CHAIN_LIMIT = 90.0
+
+
+class Song:
+    __slots__ = ("title", "fingerprints", "first_heard", "last_heard", "confirmed")
+
+    def __init__(self, title: str) -> None:
+        self.title = title
+        self.fingerprints: list[Fingerprint] = []
+        self.first_heard = self.last_heard = time()
+        # Когда песню последний раз назвал внешний сервис
+        self.confirmed = self.first_heard
+
+    def __repr__(self) -> str:
+        return f"Song({self.title!r})"
+
+
+def _best(
+    fingerprint: Fingerprint, songs: list[tuple[Song, list[Fingerprint]]]
+) -> Song | None:
+    best, best_votes = None, MIN_VOTES - 1
+    for song, references in songs:
+        for reference in references:
+            count = votes(fingerprint, reference)
+            if count > best_votes:
+                best, best_votes = song, count
+    return best
+
+
+class SongHistory:
+    """
+    Песни, узнанные на канале, с отпечатками отрывков, по которым их узнали.
+
+    Отрывок, совпавший с одним из них по сдвигу во времени, узнаётся без внешнего
+    запроса. Пары пиков из разных частей песни не совпадают, поэтому последняя
+    песня продлевается через chain() отпечатками буферов, которые перекрываются с
+    уже узнанным звуком.
+    """
+
+    def __init__(self, size: int = HISTORY_SIZE) -> None:
+        self.size = size
+        self.__songs: OrderedDict[str, Song] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__songs)
+
+    def __iter__(self) -> Iterator[Song]:
+        """От последней услышанной к самой давней"""
+        return reversed(self.__songs.values())
+
+    async def find(self, fingerprint: Fingerprint) -> Song | None:
+        """Сравнение идёт в потоке по снимку истории, цикл событий не ждёт его"""
+        songs = [(song, song.fingerprints) for song in self.__songs.values()]
+        best = await asyncio.get_running_loop().run_in_executor(
+            None, _best, fingerprint, songs
+        )
+        if best is not None and self.__songs.get(best.title) is best:
+            best.last_heard = time()
+            self.__songs.move_to_end(best.title)
+        return best
+
+    async def chain(self, fingerprint: Fingerprint) -> Song | None:
+        """Добавляет отпечаток к последней песне, если он перекрывается с ней"""
+        song = next(iter(self), None)
+        if song is None or time() - song.confirmed > CHAIN_LIMIT:
+            return None
+        match = await asyncio.get_running_loop().run_in_executor(
+            None, _best, fingerprint, [(song, song.fingerprints)]
+        )
+        if match is None or self.__songs.get(song.title) is not song:
+            return None
+        return self.remember(song.title, fingerprint, confirmed=False)
+
+    def remember(
+        self, title: str, fingerprint: Fingerprint, confirmed: bool = True
+    ) -> Song:
+        song = self.__songs.get(title)
+        if song is None:
+            song = self.__songs[title] = Song(title)
+            if len(self.__songs) > self.size:
+                self.__songs.popitem(last=False)
+        else:
+            song.last_heard = time()
+            if confirmed:
+                song.confirmed = song.last_heard
+            self.__songs.move_to_end(title)
+        if len(fingerprint):
+            # Сортировка хэшей образца один раз здесь, а не в каждом сравнении
+            fingerprint.index()
+            # Новый список, а не изменение старого: его может читать поток find()
+            song.fingerprints = [*song.fingerprints[1 - FINGERPRINTS :], fingerprint]
+        return song
@@ -0,0 +1,85 @@
+PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+PAT_PID = 0
+# stream_type AAC в ADTS из ISO/IEC 13818-1
+STREAM_TYPE_AAC = 0x0F
+
+
+def _section(data: bytes, start: int) -> tuple[int, int]:
+    """Начало и конец (без CRC) секции PSI, payload начинается с pointer_field"""
+    start += 1 + data[start]
+    length = ((data[start + 1] & 0x0F) << 8) | data[start + 2]
+    return start, start + 3 + length - 4
+
+
+class AacDemuxer:
+    """
+    Достаёт AAC (ADTS) из MPEG-TS без ffmpeg.
+
+    Данные можно подавать кусками по мере загрузки, неполный пакет в конце куска
+    ждёт следующего. PID аудио находится по PAT и PMT в начале сегмента, из его
+    PES пакетов срезаются заголовки, а кадры ADTS склеиваются как есть.
+    """
+
+    __slots__ = ("audio", "pmt_pid", "audio_pid", "__rest")
+
+    def __init__(self) -> None:
+        self.audio = bytearray()
+        self.pmt_pid: int | None = None
+        self.audio_pid: int | None = None
+        self.__rest = b""
+
+    def feed(self, chunk: bytes) -> None:
+        data = self.__rest + chunk if self.__rest else chunk
+        complete = len(data) - len(data) % PACKET_SIZE
+        self.__rest = bytes(data[complete:])
+        view = memoryview(data)
+        audio = self.audio
+
+        for offset in range(0, complete, PACKET_SIZE):
+            if data[offset] != SYNC_BYTE:
+                continue
+            flags = data[offset + 1]
+            pid = ((flags & 0x1F) << 8) | data[offset + 2]
+            control = data[offset + 3] >> 4 & 0x3
+            if not control & 0x1:
+                # Только adaptation field, без payload
+                continue
+            start = offset + 4
+            if control & 0x2:
+                start += 1 + data[start]
+            end = offset + PACKET_SIZE
+            if start >= end:
+                continue
+            unit_start = flags & 0x40
+
+            if pid == self.audio_pid:
+                if unit_start:
+                    # Заголовок PES: 00 00 01, stream_id, длина, два байта флагов, длина хвоста
+                    start += 9 + data[start + 8]
+                audio += view[start:end]
+            elif pid == PAT_PID and self.pmt_pid is None and unit_start:
+                position, section_end = _section(data, start)
+                for entry in range(position + 8, section_end, 4):
+                    if data[entry] or data[entry + 1]:
+                        self.pmt_pid = ((data[entry + 2] & 0x1F) << 8) | data[entry + 3]
+                        break
+            elif pid == self.pmt_pid and self.audio_pid is None and unit_start:
+                self.__find_audio(data, start)
+
+    def __find_audio(self, data: bytes, start: int) -> None:
+        position, section_end = _section(data, start)
+        info_length = ((data[position + 10] & 0x0F) << 8) | data[position + 11]
+        entry = position + 12 + info_length
+        while entry < section_end:
+            if data[entry] == STREAM_TYPE_AAC:
+                self.audio_pid = ((data[entry + 1] & 0x1F) << 8) | data[entry + 2]
+                return
+            entry += 5 + (((data[entry + 3] & 0x0F) << 8) | data[entry + 4])
+
+
+def demux_aac(data: bytes) -> bytearray:
+    """AAC целого сегмента, пустой bytearray если аудио дорожки нет"""
+    demuxer = AacDemuxer()
+    demuxer.feed(data)
+    return demuxer.audio
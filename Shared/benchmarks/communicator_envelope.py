@@ -0,0 +1,104 @@
+"""
+Бенчмарк конверта сообщений communicator, сообщений в секунду на одно ядро.
+
+Старый путь: Event(function_name, Any(payload)) сериализуется целиком, на приёме
+Event.parse разбирает конверт, а затем payload разбирается второй раз из Any.
+Новый путь: имя функции и type_url в заголовках NATS, тело сообщения сразу
+разбирается в тип обработчика. Сеть не участвует, сообщение собирается вручную.
+
+    python Shared/benchmarks/communicator_envelope.py
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from holybot_shared.communicator.envelope import pack, unpack
+from holybot_shared.communicator.handler import Handler
+from holybot_shared.SharedProto.google.protobuf import Any
+from holybot_shared.SharedProto.holybot.api import (
+    Event,
+    SimpleResponse,
+    UserLoggedIn,
+)
+
+ITERATIONS = 100_000
+PAYLOAD = UserLoggedIn(
+    user_id="123456789", code="x" * 30, redirect_uri="https://example.com/callback"
+)
+
+
+class FakeMsg:
+    __slots__ = ("data", "headers")
+
+    def __init__(self, data: bytes, headers: dict | None) -> None:
+        self.data = data
+        self.headers = headers
+
+
+async def get_token(self, payload: UserLoggedIn) -> SimpleResponse:
+    return SimpleResponse(success=True)
+
+
+handler = Handler("get_token", get_token)
+
+
+async def legacy_roundtrip():
+    event = Event(function_name="get_token", payload=Any.pack(PAYLOAD))
+    msg = FakeMsg(bytes(event), None)
+
+    event = Event.parse(msg.data)
+    return await handler(None, event.payload)
+
+
+async def envelope_roundtrip():
+    headers, data = pack("get_token", PAYLOAD, handler.type_url)
+    msg = FakeMsg(data, headers)
+
+    event = unpack(msg)
+    return await handler(None, event.payload)
+
+
+async def legacy_receive(msg: FakeMsg):
+    event = Event.parse(msg.data)
+    return await handler(None, event.payload)
+
+
+async def envelope_receive(msg: FakeMsg):
+    event = unpack(msg)
+    return await handler(None, event.payload)
+
+
+async def measure(name: str, call) -> float:
+    for _ in range(1000):
+        await call()
+    start = perf_counter()
+    for _ in range(ITERATIONS):
+        await call()
+    rate = ITERATIONS / (perf_counter() - start)
+    print(f"{name:<32} {rate:10.0f} msgs/s")
+    return rate
+
+
+async def main():
+    print("Receive (message -> handler result)")
+    legacy_msg = FakeMsg(
+        bytes(Event(function_name="get_token", payload=Any.pack(PAYLOAD))), None
+    )
+    headers, data = pack("get_token", PAYLOAD)
+    envelope_msg = FakeMsg(data, headers)
+    before = await measure("Event + Any", lambda: legacy_receive(legacy_msg))
+    after = await measure("headers + raw body", lambda: envelope_receive(envelope_msg))
+    print(f"{'speedup':<32} {after / before:10.2f}x\n")
+
+    print("Round trip (serialize -> receive -> handler result)")
+    before = await measure("Event + Any", legacy_roundtrip)
+    after = await measure("headers + raw body", envelope_roundtrip)
+    print(f"{'speedup':<32} {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
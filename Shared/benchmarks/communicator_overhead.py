@@ -0,0 +1,105 @@
+"""
+Микробенчмарк накладных расходов communicator на один вызов.
+
+Сравнивает старый путь (inspect.Signature.bind + apply_defaults на каждый исходящий
+вызов, inspect.iscoroutinefunction + Any.unpack на каждый входящий) с обёртками,
+которые собираются один раз при регистрации. Сеть и сериализация конверта не
+участвуют, send_event заменён на пустую корутину.
+
+    python Shared/benchmarks/communicator_overhead.py
+"""
+
+import asyncio
+import inspect
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from holybot_shared.communicator.handler import Handler
+from holybot_shared.communicator.stub import API
+from holybot_shared.SharedProto.google.protobuf import Any
+from holybot_shared.SharedProto.holybot.api import (
+    Event,
+    SimpleResponse,
+    UserLoggedIn,
+)
+
+ITERATIONS = 100_000
+PAYLOAD = UserLoggedIn(user_id="1", code="code", redirect_uri="https://example.com")
+
+
+class FakeClient:
+    async def send_event(self, *args, **kwargs):
+        return None
+
+
+async def get_token(self, payload: UserLoggedIn) -> SimpleResponse:
+    return SimpleResponse(success=True)
+
+
+def legacy_stub():
+    async def stub(
+        self, payload: UserLoggedIn, *, timeout: int = 10
+    ) -> SimpleResponse: ...
+
+    client = FakeClient()
+    sig = inspect.signature(stub)
+
+    async def wrapper(*args, **kwargs):
+        bound = sig.bind(None, *args, **kwargs)
+        bound.apply_defaults()
+        return await client.send_event(
+            "API",
+            "get_token",
+            wait_for_response=True,
+            response_type=SimpleResponse,
+            payload=bound.arguments.get("payload"),
+            timeout=bound.arguments.get("timeout", 10),
+        )
+
+    return wrapper
+
+
+async def legacy_handler(event: Event):
+    payload = event.payload.unpack()
+    if inspect.iscoroutinefunction(get_token):
+        return await get_token(None, payload)
+    return get_token(None, payload)
+
+
+async def measure(name: str, call) -> float:
+    for _ in range(1000):
+        await call()
+    start = perf_counter()
+    for _ in range(ITERATIONS):
+        await call()
+    elapsed = perf_counter() - start
+    per_call = elapsed / ITERATIONS * 1_000_000
+    print(f"{name:<32} {per_call:8.2f} us/call")
+    return per_call
+
+
+async def main():
+    stub = API(FakeClient())
+    legacy = legacy_stub()
+
+    print("Outbound (stub call -> send_event)")
+    before = await measure("legacy Signature.bind", lambda: legacy(PAYLOAD))
+    after = await measure("precompiled stub", lambda: stub.get_token(PAYLOAD))
+    print(f"{'speedup':<32} {before / after:8.2f}x\n")
+
+    event = Event.parse(
+        bytes(Event(function_name="get_token", payload=Any.pack(PAYLOAD)))
+    )
+    handler = Handler("get_token", get_token)
+
+    print("Inbound (Event -> handler result)")
+    before = await measure("legacy inspect + unpack", lambda: legacy_handler(event))
+    after = await measure("precompiled handler", lambda: handler(None, event.payload))
+    print(f"{'speedup':<32} {before / after:8.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
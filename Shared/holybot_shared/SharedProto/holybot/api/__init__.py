@@ -4,7 +4,10 @@
 # This file has been @generated
 
 __all__ = (
+    "BatchResult",
     "Event",
+    "EventBatch",
+    "EventBatchResponse",
     "SimpleResponse",
     "UserLoggedIn",
 )
@@ -19,6 +22,20 @@ _COMPILER_VERSION = "0.9.0"
 betterproto2.check_compiler_version(_COMPILER_VERSION)
 
 
+@dataclass(eq=False, repr=False)
+class BatchResult(betterproto2.Message):
+    success: "bool" = betterproto2.field(1, betterproto2.TYPE_BOOL)
+
+    message: "str" = betterproto2.field(2, betterproto2.TYPE_STRING)
+
+    payload: "__google__protobuf__.Any | None" = betterproto2.field(
+        3, betterproto2.TYPE_MESSAGE, optional=True
+    )
+
+
+default_message_pool.register_message("holybot.api", "BatchResult", BatchResult)
+
+
 @dataclass(eq=False, repr=False)
 class Event(betterproto2.Message):
     function_name: "str" = betterproto2.field(1, betterproto2.TYPE_STRING)
@@ -31,6 +48,28 @@ class Event(betterproto2.Message):
 default_message_pool.register_message("holybot.api", "Event", Event)
 
 
+@dataclass(eq=False, repr=False)
+class EventBatch(betterproto2.Message):
+    events: "list[Event]" = betterproto2.field(
+        1, betterproto2.TYPE_MESSAGE, repeated=True
+    )
+
+
+default_message_pool.register_message("holybot.api", "EventBatch", EventBatch)
+
+
+@dataclass(eq=False, repr=False)
+class EventBatchResponse(betterproto2.Message):
+    results: "list[BatchResult]" = betterproto2.field(
+        1, betterproto2.TYPE_MESSAGE, repeated=True
+    )
+
+
+default_message_pool.register_message(
+    "holybot.api", "EventBatchResponse", EventBatchResponse
+)
+
+
 @dataclass(eq=False, repr=False)
 class SimpleResponse(betterproto2.Message):
     success: "bool" = betterproto2.field(1, betterproto2.TYPE_BOOL)
@@ -0,0 +1,92 @@
+import asyncio
+from typing import TYPE_CHECKING
+
+from betterproto2 import Message
+
+from holybot_shared.SharedProto.google.protobuf import Any
+from holybot_shared.SharedProto.holybot.api import Event, SimpleResponse
+
+if TYPE_CHECKING:
+    from holybot_shared.communicator import Client
+
+
+class Batch:
+    """Собирает несколько вызовов микросервиса в один EventBatch запрос"""
+
+    def __init__(
+        self,
+        client: "Client",
+        receiver: str,
+        methods: dict[str, type | None],
+        timeout: float,
+    ) -> None:
+        self.__client = client
+        self.__receiver = receiver
+        self.__methods = methods
+        self.__timeout = timeout
+        self.__events: list[Event] = []
+        self.__futures: list[asyncio.Future] = []
+        self.results: list[Message | None] = []
+
+    def __getattr__(self, name: str):
+        if name.startswith("_") or name not in self.__methods:
+            raise AttributeError(name)
+
+        def wrapper(payload: Message = None) -> asyncio.Future:
+            return self.add(name, payload)
+
+        return wrapper
+
+    def add(self, function_name: str, payload: Message = None) -> asyncio.Future:
+        event = Event(function_name=function_name)
+        if payload is not None:
+            event.payload = Any.pack(payload)
+
+        future = asyncio.get_running_loop().create_future()
+        self.__events.append(event)
+        self.__futures.append(future)
+        return future
+
+    async def send(self) -> list[Message | None]:
+        events, futures = self.__events, self.__futures
+        self.__events, self.__futures = [], []
+        if not events:
+            return []
+
+        wait_for_response = any(self.__methods[event.function_name] for event in events)
+        response = await self.__client.send_batch(
+            self.__receiver, events, wait_for_response, self.__timeout
+        )
+
+        results = []
+        for index, (event, future) in enumerate(zip(events, futures)):
+            if not wait_for_response:
+                result = None
+            elif response is None:
+                result = SimpleResponse(success=False, message="No response")
+            elif index >= len(response.results):
+                result = SimpleResponse(success=False, message="Missing result")
+            else:
+                item = response.results[index]
+                if not item.success:
+                    result = SimpleResponse(success=False, message=item.message)
+                elif item.payload is None or not self.__methods[event.function_name]:
+                    result = None
+                else:
+                    result = item.payload.unpack()
+            future.set_result(result)
+            results.append(result)
+
+        self.results.extend(results)
+        return results
+
+    async def __aenter__(self) -> "Batch":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            for future in self.__futures:
+                future.cancel()
+            self.__events, self.__futures = [], []
+            return
+        await self.send()
@@ -0,0 +1,140 @@
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from valkey.asyncio import Valkey
+
+CACHE_TTL_HEADER = "Holybot-Cache-TTL"
+
+Loader = Callable[[], Awaitable[tuple[bytes | None, float]]]
+
+
+class ResponseCache:
+    """
+    LRU кэш сериализованных ответов с TTL.
+
+    Одновременные одинаковые запросы к кэшируемой функции объединяются в один вызов
+    загрузчика. Если передан valkey, он используется как общий второй уровень.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        valkey: "Valkey | None" = None,
+        prefix: str = "holybot:rpc:",
+    ) -> None:
+        self.__max_size = max_size
+        self.__valkey = valkey
+        self.__prefix = prefix.encode()
+        self.__entries: OrderedDict[bytes, tuple[float, bytes]] = OrderedDict()
+        self.__inflight: dict[bytes, asyncio.Future] = {}
+        self.__ttls: dict[str, float] = {}
+
+    @staticmethod
+    def make_key(name: str, data: bytes) -> bytes:
+        return name.encode() + b"\0" + data
+
+    def learn(self, name: str, ttl: float) -> None:
+        if ttl > 0:
+            self.__ttls[name] = ttl
+        else:
+            self.__ttls.pop(name, None)
+
+    def get(self, key: bytes) -> bytes | None:
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < monotonic():
+            del self.__entries[key]
+            return None
+
+        self.__entries.move_to_end(key)
+        return value
+
+    def remaining(self, key: bytes) -> float:
+        entry = self.__entries.get(key)
+        if entry is None:
+            return 0
+        return max(entry[0] - monotonic(), 0)
+
+    def set(self, key: bytes, value: bytes, ttl: float) -> None:
+        self.__entries[key] = (monotonic() + ttl, value)
+        self.__entries.move_to_end(key)
+        if len(self.__entries) > self.__max_size:
+            self.__entries.popitem(last=False)
+
+    async def get_or_load(self, name: str, key: bytes, loader: Loader) -> bytes | None:
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        if name not in self.__ttls:
+            # Функция пока не известна как кэшируемая, объединять вызовы нельзя
+            value, ttl = await loader()
+            if value is not None and ttl > 0:
+                self.set(key, value, ttl)
+            return value
+
+        future = self.__inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.__inflight[key] = future
+        try:
+            value = await self.__load(key, loader)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Помечаем исключение полученным, если никто не ждал этот ключ
+            future.exception()
+            raise
+        finally:
+            del self.__inflight[key]
+
+    async def __load(self, key: bytes, loader: Loader) -> bytes | None:
+        value = await self.__get_shared(key)
+        if value is not None:
+            return value
+
+        value, ttl = await loader()
+        if value is not None and ttl > 0:
+            self.set(key, value, ttl)
+            await self.__set_shared(key, value, ttl)
+        return value
+
+    async def __get_shared(self, key: bytes) -> bytes | None:
+        if self.__valkey is None:
+            return None
+
+        try:
+            async with self.__valkey.pipeline(transaction=False) as pipe:
+                pipe.get(self.__prefix + key)
+                pipe.pttl(self.__prefix + key)
+                value, pttl = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Valkey cache is unavailable: {e}")
+            return None
+
+        if value is not None and pttl > 0:
+            self.set(key, value, pttl / 1000)
+        return value
+
+    async def __set_shared(self, key: bytes, value: bytes, ttl: float) -> None:
+        if self.__valkey is None:
+            return
+
+        try:
+            await self.__valkey.set(self.__prefix + key, value, px=int(ttl * 1000))
+        except Exception as e:
+            logger.warning(f"Valkey cache is unavailable: {e}")
@@ -1,7 +1,8 @@
 import asyncio
 import os
+from time import perf_counter
 import inspect
-from typing import Callable
+from typing import TYPE_CHECKING, AsyncIterator, Callable
 from holybot_shared.SharedProto.google.protobuf import Any
 
 import nats
@@ -9,39 +10,116 @@ import orjson
 from loguru import logger
 from nats.aio.client import Client as NATSClient
 from nats.aio.msg import Msg
-from nats.errors import TimeoutError as NatsTimeoutError
+from nats.aio.subscription import Subscription
+from nats.errors import Error as NatsError, TimeoutError as NatsTimeoutError
+from nats.js import JetStreamContext
+from nats.js.api import ConsumerConfig
+from nats.js.errors import BadRequestError
 from betterproto2 import Message
 
+from holybot_shared.communicator.cache import CACHE_TTL_HEADER, ResponseCache
+from holybot_shared.communicator.dispatcher import Dispatcher
+from holybot_shared.communicator.envelope import Envelope, pack, unpack
+from holybot_shared.communicator.handler import Handler
+from holybot_shared.communicator.latency import IDEMPOTENT_HEADER, LatencyStats
+from holybot_shared.communicator.metrics import Metrics, serve_metrics
+from holybot_shared.communicator.stream import (
+    CREDIT_TIMEOUT,
+    DEFAULT_WINDOW,
+    WINDOW_HEADER,
+    StreamSender,
+    receive_stream,
+)
 from holybot_shared.communicator.stub import API
-from holybot_shared.SharedProto.holybot.api import Event, SimpleResponse
+from holybot_shared.SharedProto.holybot.api import (
+    BatchResult,
+    Event,
+    EventBatch,
+    EventBatchResponse,
+    SimpleResponse,
+)
+
+if TYPE_CHECKING:
+    from valkey.asyncio import Valkey
+
+DURABLE_ACK_WAIT = 30.0
+DURABLE_RETRY_DELAY = 5.0
 
 
 class Client:
     def __init__(
         self,
         name: str,
+        *,
+        max_concurrency: int = 100,
+        max_queue: int = 1000,
+        cache_size: int = 1024,
+        valkey: "Valkey | None" = None,
+        durable: bool = False,
+        fetch_batch: int = 64,
     ) -> None:
         self.__name: str = name
         self.__nats_url: str = os.getenv("NATS_URL")
         self.__class_instance: object = None
         self._nc: NATSClient | None = None
-        self.__events: dict[str, Callable] = {}
+        self._js: JetStreamContext | None = None
+        self.__durable = durable
+        self.__fetch_batch = fetch_batch
+        self.__consumer_task: asyncio.Task | None = None
+        self.__subscriptions: list[Subscription] = []
+        self.__events: dict[str, Handler] = {}
+        self.__dispatcher = Dispatcher(max_concurrency, max_queue)
+        self.__cache = ResponseCache(cache_size, valkey, prefix=f"holybot:rpc:{name}:")
+        self.__latency: dict[str, LatencyStats] = {}
+        self.__metrics = Metrics(name)
+        self.__metrics_server: asyncio.Server | None = None
         self._wrapped_class_ref = None
 
         self.API = API(self)
 
     async def connect(self):
         self._nc = await nats.connect(self.__nats_url)
+        self._js = self._nc.jetstream()
 
-        await self._nc.subscribe(
-            self.__name, cb=self.__nats_callback, queue=self.__name
-        )
+        self.__subscriptions = [
+            await self._nc.subscribe(
+                self.__name, cb=self.__nats_callback, queue=self.__name
+            ),
+            await self._nc.subscribe(
+                f"{self.__name}.batch", cb=self.__batch_callback, queue=self.__name
+            ),
+            await self._nc.subscribe(
+                f"{self.__name}.stream", cb=self.__stream_callback, queue=self.__name
+            ),
+            # Без queue группы, чтобы каждая реплика могла ответить своей статистикой
+            await self._nc.subscribe(f"{self.__name}.stats", cb=self.__stats_callback),
+        ]
+
+        if self.__durable:
+            await self.__start_consumer()
+
+        metrics_port = os.getenv("METRICS_PORT")
+        if metrics_port:
+            self.__metrics_server = await serve_metrics(
+                self.render_metrics, "0.0.0.0", int(metrics_port)
+            )
         logger.info(
             f"Client {self.__name} started and listening on subject '{self.__name}'"
         )
 
     async def close(self):
+        if self.__consumer_task:
+            self.__consumer_task.cancel()
+            try:
+                await self.__consumer_task
+            except asyncio.CancelledError:
+                pass
+        if self.__metrics_server:
+            self.__metrics_server.close()
         if self._nc:
+            for subscription in self.__subscriptions:
+                await subscription.drain()
+            await self.__dispatcher.wait()
             await self._nc.drain()
             await self._nc.close()
 
@@ -52,6 +130,22 @@ class Client:
         except Exception as e:
             logger.exception(e)
 
+    async def __batch_callback(self, msg: Msg):
+        try:
+            await self.__on_batch(msg)
+        except Exception as e:
+            logger.exception(e)
+
+    async def __stream_callback(self, msg: Msg):
+        try:
+            await self.__on_stream(msg)
+        except Exception as e:
+            logger.exception(e)
+
+    async def __stats_callback(self, msg: Msg):
+        if msg.reply:
+            await self._nc.publish(msg.reply, self.render_metrics().encode())
+
     async def send_event(
         self,
         receiver: str,
@@ -60,26 +154,45 @@ class Client:
         wait_for_response: bool,
         timeout: float,
         payload: Message,
+        type_url: str | None = None,
+        cache: ResponseCache | None = None,
+        durable: bool = False,
     ):
-
-        payload_any = Any.pack(payload)
-
-        event = Event(function_name=function_name, payload=payload_any)
+        name = f"{receiver}.{function_name}"
+        headers, data = pack(function_name, payload, type_url)
+        self.__metrics.requests.inc(name)
+        self.__metrics.request_size.observe(name, len(data))
 
         try:
-            logger.info(f"wait_for_response: {wait_for_response}")
             if wait_for_response:
-                response_msg: Msg = await self._nc.request(
-                    receiver, bytes(event), timeout=timeout
-                )
+                if cache is None:
+                    response_data, _ = await self.__request(
+                        receiver, name, headers, data, timeout
+                    )
+                else:
 
-                response_data = response_msg.data
+                    async def load():
+                        response_data, ttl = await self.__request(
+                            receiver, name, headers, data, timeout
+                        )
+                        if ttl > 0:
+                            cache.learn(function_name, ttl)
+                        return response_data, ttl
 
-                logger.trace(f"Response from {receiver}: {response_data}")
+                    response_data = await cache.get_or_load(
+                        function_name, cache.make_key(function_name, data), load
+                    )
+
+                self.__metrics.trace(
+                    "Response from {}: {} bytes", name, len(response_data)
+                )
 
                 return response_type.parse(response_data)
+            elif durable:
+                await self.__publish_durable(receiver, headers, data)
+                return None
             else:
-                await self._nc.publish(receiver, bytes(event))
+                await self._nc.publish(receiver, data, headers=headers)
                 return None
         except NatsTimeoutError:
             logger.error(
@@ -87,15 +200,181 @@ class Client:
             )
             return None
         except Exception as e:
+            self.__metrics.failures.inc(name)
             logger.error(f"Error sending event: {e}")
             return None
 
-    def event(self, name: str = None):
+    async def __publish_durable(
+        self, receiver: str, headers: dict[str, str], data: bytes
+    ):
+        try:
+            await self._js.publish(f"{receiver}.durable", data, headers=headers)
+        except NatsError as e:
+            # Без JetStream событие всё равно уходит, но уже без гарантии доставки
+            logger.warning(f"Durable publish to {receiver} failed, falling back: {e}")
+            await self._nc.publish(receiver, data, headers=headers)
+
+    def latency_stats(self) -> dict[str, dict[str, float | int | None]]:
+        return {
+            name: {
+                **stats.snapshot(),
+                "timeouts": self.__metrics.timeouts.values.get(name, 0),
+                "hedged": self.__metrics.hedged.values.get(name, 0),
+            }
+            for name, stats in self.__latency.items()
+        }
+
+    def render_metrics(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        extra = [
+            "# TYPE holybot_rpc_dispatcher_in_flight gauge",
+            f'holybot_rpc_dispatcher_in_flight{{service="{self.__name}"}} {self.__dispatcher.in_flight}',
+            "# TYPE holybot_rpc_request_quantile_seconds gauge",
+        ]
+        for name, stats in self.__latency.items():
+            for q in (0.5, 0.95, 0.99):
+                value = stats.percentile(q)
+                if value is not None:
+                    extra.append(
+                        f'holybot_rpc_request_quantile_seconds{{service="{self.__name}",function="{name}",quantile="{q}"}} {value}'
+                    )
+        return self.__metrics.render(extra)
+
+    async def __request(
+        self,
+        receiver: str,
+        name: str,
+        headers: dict[str, str],
+        data: bytes,
+        timeout: float,
+    ) -> tuple[bytes, float]:
+        stats = self.__latency.get(name)
+        if stats is None:
+            stats = self.__latency[name] = LatencyStats()
+
+        deadline = stats.timeout(timeout)
+        delay = stats.hedge_delay()
+        start = perf_counter()
+        try:
+            if delay is None or delay >= deadline:
+                response_msg: Msg = await self._nc.request(
+                    receiver, data, timeout=deadline, headers=headers
+                )
+            else:
+                response_msg = await self.__hedged_request(
+                    receiver, name, headers, data, deadline, delay
+                )
+        except NatsTimeoutError:
+            self.__metrics.timeouts.inc(name)
+            stats.observe_timeout(deadline)
+            raise
+        elapsed = perf_counter() - start
+        stats.observe(elapsed)
+        self.__metrics.request_latency.observe(name, elapsed)
+
+        headers = response_msg.headers or {}
+        stats.idempotent = IDEMPOTENT_HEADER in headers
+        return response_msg.data, float(headers.get(CACHE_TTL_HEADER, 0))
+
+    async def __hedged_request(
+        self,
+        receiver: str,
+        name: str,
+        headers: dict[str, str],
+        data: bytes,
+        timeout: float,
+        delay: float,
+    ) -> Msg:
+        """Если ответа нет дольше p95, отправляет второй запрос и берёт первый ответ"""
+        first = asyncio.ensure_future(
+            self._nc.request(receiver, data, timeout=timeout, headers=headers)
+        )
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        self.__metrics.hedged.inc(name)
+        second = asyncio.ensure_future(
+            self._nc.request(receiver, data, timeout=timeout - delay, headers=headers)
+        )
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def send_batch(
+        self,
+        receiver: str,
+        events: list[Event],
+        wait_for_response: bool,
+        timeout: float,
+    ) -> EventBatchResponse | None:
+        batch = EventBatch(events=events)
+
+        try:
+            if wait_for_response:
+                response_msg: Msg = await self._nc.request(
+                    f"{receiver}.batch", bytes(batch), timeout=timeout
+                )
+                return EventBatchResponse.parse(response_msg.data)
+            else:
+                await self._nc.publish(f"{receiver}.batch", bytes(batch))
+                return None
+        except NatsTimeoutError:
+            logger.error(
+                f"Timeout waiting for batch response from {receiver} ({len(events)} events)"
+            )
+            return None
+        except Exception as e:
+            logger.error(f"Error sending batch: {e}")
+            return None
+
+    def open_stream(
+        self,
+        receiver: str,
+        function_name: str,
+        response_type: type[Message],
+        timeout: float,
+        payload: Message,
+        type_url: str | None = None,
+        window: int = DEFAULT_WINDOW,
+    ) -> AsyncIterator[Message]:
+        headers, data = pack(function_name, payload, type_url)
+        return receive_stream(
+            self._nc,
+            f"{receiver}.stream",
+            headers,
+            data,
+            response_type,
+            window,
+            timeout,
+        )
+
+    def event(
+        self,
+        name: str = None,
+        *,
+        concurrency: int | None = None,
+        cache_ttl: float = 0,
+        key: Callable[[Message], str] | None = None,
+        idempotent: bool = False,
+    ):
         def wrapper(func):
             nonlocal name
             if name is None:
                 name = func.__name__
-            self.__events[name] = func
+            self.__dispatcher.set_limit(name, concurrency)
+            self.__events[name] = Handler(name, func, cache_ttl, key, idempotent)
+            self.__cache.learn(name, cache_ttl)
             return func
 
         if inspect.isfunction(name):
@@ -114,29 +393,216 @@ class Client:
         return wrapper
 
     def get_registered_events(self):
-        return self.__events
+        return {name: handler.func for name, handler in self.__events.items()}
 
     async def __on_message(self, msg: Msg):
-        event = Event.parse(msg.data)
-        func = self.__events.get(event.function_name, None)
-        if func is None:
+        event = unpack(msg)
+        handler = self.__events.get(event.function_name, None)
+        if handler is None:
             logger.error(f"Unknown function: {event.function_name}.")
             return
 
-        payload = event.payload
-        if payload is None:
-            payload = {}
-        else:
-            payload = payload.unpack()
+        if not self.__dispatcher.submit(
+            event.function_name, self.__execute(msg, event, handler)
+        ):
+            self.__metrics.rejected.inc(event.function_name)
+            logger.warning(
+                f"Rejected {event.function_name}: {self.__dispatcher.in_flight} events in flight"
+            )
+            if msg.reply:
+                result = SimpleResponse(success=False, message="Service overloaded")
+                await self._nc.publish(msg.reply, bytes(result))
+
+    async def __execute(self, msg: Msg, event: Envelope | Event, handler: Handler):
+        headers = {IDEMPOTENT_HEADER: "1"} if handler.idempotent else None
+
+        if not handler.cache_ttl:
+            data, _ = await self.__run(event, handler)
+            if msg.reply:
+                await self._nc.publish(msg.reply, data, headers=headers)
+            return
+
+        key = handler.cache_key(event.payload)
+        data = await self.__cache.get_or_load(
+            handler.name, key, lambda: self.__run(event, handler)
+        )
+        if msg.reply:
+            ttl = self.__cache.remaining(key)
+            if ttl:
+                headers[CACHE_TTL_HEADER] = f"{ttl:.3f}"
+            await self._nc.publish(msg.reply, data, headers=headers)
 
+    async def __run(
+        self, event: Envelope | Event, handler: Handler
+    ) -> tuple[bytes, float]:
         try:
-            if inspect.iscoroutinefunction(func):
-                result: Message = await func(self.__class_instance, payload)
-            else:
-                result: Message = func(self.__class_instance, payload)
+            result = await self.__call(handler, event)
         except Exception as e:
             logger.exception(f"Error executing event {event.function_name}")
             result = SimpleResponse(success=False, message=str(e))
+            return bytes(result), 0
+
+        data = b"" if result is None else bytes(result)
+        self.__metrics.response_size.observe(handler.name, len(data))
+        if result is None or (
+            isinstance(result, SimpleResponse) and not result.success
+        ):
+            return data, 0
+        return data, handler.cache_ttl
+
+    async def __call(self, handler: Handler, event: Envelope | Event) -> Message | None:
+        metrics = self.__metrics
+        metrics.handled.inc(handler.name)
+        metrics.in_flight.inc(handler.name)
+        start = perf_counter()
+        try:
+            return await handler(self.__class_instance, event.payload)
+        except Exception:
+            metrics.errors.inc(handler.name)
+            raise
+        finally:
+            metrics.in_flight.inc(handler.name, -1)
+            metrics.handler_latency.observe(handler.name, perf_counter() - start)
+
+    async def __start_consumer(self):
+        stream = f"HOLYBOT_{self.__name.upper()}"
+        subject = f"{self.__name}.durable"
+        try:
+            await self._js.add_stream(name=stream, subjects=[subject])
+        except BadRequestError:
+            await self._js.update_stream(name=stream, subjects=[subject])
+
+        subscription = await self._js.pull_subscribe(
+            subject,
+            durable=self.__name,
+            stream=stream,
+            config=ConsumerConfig(ack_wait=DURABLE_ACK_WAIT, max_deliver=5),
+        )
+        self.__consumer_task = asyncio.create_task(self.__consume(subscription))
+        logger.info(f"Client {self.__name} consuming durable events from '{stream}'")
+
+    async def __consume(self, subscription: JetStreamContext.PullSubscription):
+        """Забирает события пачками, но не больше чем есть свободных мест"""
+        while True:
+            await self.__dispatcher.wait_available()
+            batch = min(self.__fetch_batch, self.__dispatcher.available)
+            try:
+                msgs = await subscription.fetch(batch, timeout=5)
+            except NatsTimeoutError:
+                continue
+            except NatsError as e:
+                logger.error(f"Error fetching durable events: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            for msg in msgs:
+                try:
+                    await self.__on_durable(msg)
+                except Exception as e:
+                    logger.exception(e)
+
+    async def __on_durable(self, msg: Msg):
+        event = unpack(msg)
+        handler = self.__events.get(event.function_name, None)
+        if handler is None:
+            logger.error(f"Unknown function: {event.function_name}.")
+            await msg.term()
+            return
+
+        if not self.__dispatcher.submit(
+            event.function_name, self.__execute_durable(msg, event, handler)
+        ):
+            self.__metrics.rejected.inc(event.function_name)
+            await msg.nak(delay=DURABLE_RETRY_DELAY)
+
+    async def __execute_durable(
+        self, msg: Msg, event: Envelope | Event, handler: Handler
+    ):
+        try:
+            await self.__call(handler, event)
+        except Exception:
+            logger.exception(f"Error executing durable event {event.function_name}")
+            await msg.nak(delay=DURABLE_RETRY_DELAY)
+            return
+        await msg.ack()
+
+    async def __on_stream(self, msg: Msg):
+        event = unpack(msg)
+        window = int((msg.headers or {}).get(WINDOW_HEADER, DEFAULT_WINDOW))
+        sender = StreamSender(self._nc, msg.reply, window, CREDIT_TIMEOUT)
+
+        handler = self.__events.get(event.function_name, None)
+        if handler is None or not handler.is_stream:
+            logger.error(f"Unknown stream function: {event.function_name}.")
+            await sender.error(f"Unknown stream function: {event.function_name}")
+            return
+
+        if not self.__dispatcher.submit(
+            event.function_name, self.__execute_stream(sender, event, handler)
+        ):
+            self.__metrics.rejected.inc(event.function_name)
+            logger.warning(
+                f"Rejected stream {event.function_name}: {self.__dispatcher.in_flight} events in flight"
+            )
+            await sender.error("Service overloaded")
+
+    async def __execute_stream(
+        self, sender: StreamSender, event: Envelope | Event, handler: Handler
+    ):
+        self.__metrics.handled.inc(handler.name)
+        await sender.open()
+        stream = handler.stream(self.__class_instance, event.payload)
+        try:
+            async for chunk in stream:
+                if not await sender.send(chunk):
+                    break
+            else:
+                await sender.end()
+        except Exception as e:
+            self.__metrics.errors.inc(handler.name)
+            logger.exception(f"Error executing stream {event.function_name}")
+            await sender.error(str(e) or e.__class__.__name__)
+        finally:
+            await stream.aclose()
+            await sender.close()
+
+    async def __on_batch(self, msg: Msg):
+        batch = EventBatch.parse(msg.data)
+
+        if not self.__dispatcher.submit("batch", self.__execute_batch(msg, batch)):
+            self.__metrics.rejected.inc("batch", len(batch.events))
+            logger.warning(
+                f"Rejected batch of {len(batch.events)} events: {self.__dispatcher.in_flight} events in flight"
+            )
+            if msg.reply:
+                result = BatchResult(success=False, message="Service overloaded")
+                response = EventBatchResponse(results=[result] * len(batch.events))
+                await self._nc.publish(msg.reply, bytes(response))
+
+    async def __execute_batch(self, msg: Msg, batch: EventBatch):
+        results = await asyncio.gather(
+            *(self.__execute_batched(event) for event in batch.events)
+        )
 
         if msg.reply:
-            await self._nc.publish(msg.reply, bytes(result))
+            response = EventBatchResponse(results=results)
+            await self._nc.publish(msg.reply, bytes(response))
+
+    async def __execute_batched(self, event: Event) -> BatchResult:
+        handler = self.__events.get(event.function_name, None)
+        if handler is None:
+            logger.error(f"Unknown function: {event.function_name}.")
+            return BatchResult(
+                success=False, message=f"Unknown function: {event.function_name}"
+            )
+
+        try:
+            async with self.__dispatcher.limit(event.function_name):
+                result = await self.__call(handler, event)
+        except Exception as e:
+            logger.exception(f"Error executing event {event.function_name}")
+            return BatchResult(success=False, message=str(e))
+
+        if result is None:
+            return BatchResult(success=True)
+        return BatchResult(success=True, payload=Any.pack(result))
@@ -0,0 +1,78 @@
+import asyncio
+from contextlib import nullcontext
+from typing import AsyncContextManager, Coroutine
+
+from loguru import logger
+
+
+class Dispatcher:
+    """Запускает обработчики событий в отдельных задачах с ограничением конкурентности"""
+
+    def __init__(self, max_concurrency: int, max_queue: int) -> None:
+        if max_concurrency < 1:
+            raise ValueError(
+                f"max_concurrency must be at least 1, got {max_concurrency}"
+            )
+        if max_queue < 0:
+            raise ValueError(f"max_queue can't be negative, got {max_queue}")
+        self.__semaphore = asyncio.Semaphore(max_concurrency)
+        self.__capacity = max_concurrency + max_queue
+        self.__limits: dict[str, asyncio.Semaphore] = {}
+        self.__tasks: set[asyncio.Task] = set()
+        self.__released = asyncio.Event()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.__tasks)
+
+    @property
+    def available(self) -> int:
+        return max(self.__capacity - len(self.__tasks), 0)
+
+    async def wait_available(self) -> None:
+        while len(self.__tasks) >= self.__capacity:
+            self.__released.clear()
+            await self.__released.wait()
+
+    def set_limit(self, name: str, concurrency: int | None) -> None:
+        if concurrency is None:
+            self.__limits.pop(name, None)
+        elif concurrency < 1:
+            # Семафор на ноль никогда не отпустит, и все вызовы функции зависнут
+            raise ValueError(
+                f"{name} concurrency must be at least 1, got {concurrency}"
+            )
+        else:
+            self.__limits[name] = asyncio.Semaphore(concurrency)
+
+    def limit(self, name: str) -> AsyncContextManager:
+        return self.__limits.get(name) or nullcontext()
+
+    def submit(self, name: str, coro: Coroutine) -> bool:
+        if len(self.__tasks) >= self.__capacity:
+            coro.close()
+            return False
+
+        task = asyncio.create_task(self.__run(name, coro))
+        self.__tasks.add(task)
+        task.add_done_callback(self.__on_done)
+        return True
+
+    async def wait(self) -> None:
+        if self.__tasks:
+            await asyncio.gather(*self.__tasks, return_exceptions=True)
+
+    def __on_done(self, task: asyncio.Task) -> None:
+        self.__tasks.discard(task)
+        self.__released.set()
+
+    async def __run(self, name: str, coro: Coroutine) -> None:
+        try:
+            # Сначала берём лимит функции, чтобы не занимать общий слот в ожидании
+            async with self.limit(name), self.__semaphore:
+                await coro
+        except asyncio.CancelledError:
+            coro.close()
+            raise
+        except Exception as e:
+            logger.exception(e)
@@ -0,0 +1,60 @@
+from betterproto2 import Message
+from nats.aio.msg import Msg
+
+from holybot_shared.SharedProto.holybot.api import Event
+from holybot_shared.SharedProto.message_pool import default_message_pool
+
+FUNCTION_HEADER = "Holybot-Function"
+TYPE_HEADER = "Holybot-Type"
+
+
+class RawPayload:
+    """
+    Payload из тела NATS сообщения, совместим с Any по type_url/value/unpack.
+
+    Тело не копируется и не оборачивается во вложенный Any.
+    """
+
+    __slots__ = ("type_url", "value")
+
+    def __init__(self, type_url: str, value: bytes) -> None:
+        self.type_url = type_url
+        self.value = value
+
+    def unpack(self) -> Message | None:
+        try:
+            message_type = default_message_pool.url_to_type[self.type_url]
+        except KeyError:
+            raise TypeError(f"Can't unpack unregistered type: {self.type_url}")
+        return message_type.parse(self.value)
+
+
+class Envelope:
+    """Событие, у которого имя функции и тип payload лежат в заголовках"""
+
+    __slots__ = ("function_name", "payload")
+
+    def __init__(self, function_name: str, payload: RawPayload | None) -> None:
+        self.function_name = function_name
+        self.payload = payload
+
+
+def pack(
+    function_name: str, payload: Message | None, type_url: str | None = None
+) -> tuple[dict[str, str], bytes]:
+    headers = {FUNCTION_HEADER: function_name}
+    if payload is None:
+        return headers, b""
+    headers[TYPE_HEADER] = type_url or default_message_pool.type_to_url[type(payload)]
+    return headers, bytes(payload)
+
+
+def unpack(msg: Msg) -> Envelope | Event:
+    """Разбирает входящее сообщение, старый формат через Event тоже принимается"""
+    headers = msg.headers
+    if not headers or FUNCTION_HEADER not in headers:
+        return Event.parse(msg.data)
+
+    type_url = headers.get(TYPE_HEADER)
+    payload = None if type_url is None else RawPayload(type_url, msg.data)
+    return Envelope(headers[FUNCTION_HEADER], payload)
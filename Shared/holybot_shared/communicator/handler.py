@@ -0,0 +1,93 @@
+import inspect
+from typing import AsyncIterator, Callable
+
+from betterproto2 import Message
+
+from holybot_shared.communicator.cache import ResponseCache
+from holybot_shared.communicator.envelope import RawPayload
+from holybot_shared.SharedProto.google.protobuf import Any
+from holybot_shared.SharedProto.message_pool import default_message_pool
+
+
+def resolve_type_url(message_type: type | None) -> str | None:
+    if not isinstance(message_type, type) or not issubclass(message_type, Message):
+        return None
+    return default_message_pool.type_to_url.get(message_type)
+
+
+class Handler:
+    """Обработчик события, вся рефлексия выполняется один раз при регистрации"""
+
+    __slots__ = (
+        "name",
+        "func",
+        "is_coroutine",
+        "is_stream",
+        "takes_payload",
+        "payload_type",
+        "type_url",
+        "cache_ttl",
+        "key",
+        "idempotent",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        cache_ttl: float = 0,
+        key: Callable[[Message], str] | None = None,
+        idempotent: bool = False,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.cache_ttl = cache_ttl
+        self.key = key
+        self.idempotent = idempotent or cache_ttl > 0
+        self.is_coroutine = inspect.iscoroutinefunction(func)
+        self.is_stream = inspect.isasyncgenfunction(func)
+
+        try:
+            sig = inspect.signature(func, eval_str=True)
+        except NameError:
+            sig = inspect.signature(func)
+        params = list(sig.parameters.values())[1:]
+
+        self.takes_payload = bool(params)
+        self.payload_type = params[0].annotation if params else None
+        self.type_url = resolve_type_url(self.payload_type)
+
+    def unpack(self, payload: Any | RawPayload | None) -> Message | dict:
+        if payload is None:
+            return {}
+        if payload.type_url == self.type_url:
+            return self.payload_type.parse(payload.value)
+        return payload.unpack()
+
+    def cache_key(self, payload: Any | RawPayload | None) -> bytes:
+        if self.key is not None:
+            data = str(self.key(self.unpack(payload))).encode()
+        elif payload is None:
+            data = b""
+        else:
+            data = payload.value
+        return ResponseCache.make_key(self.name, data)
+
+    async def __call__(
+        self, instance: object, payload: Any | RawPayload | None
+    ) -> Message | None:
+        if self.takes_payload:
+            result = self.func(instance, self.unpack(payload))
+        else:
+            result = self.func(instance)
+
+        if self.is_coroutine:
+            return await result
+        return result
+
+    def stream(
+        self, instance: object, payload: Any | RawPayload | None
+    ) -> AsyncIterator[Message]:
+        if self.takes_payload:
+            return self.func(instance, self.unpack(payload))
+        return self.func(instance)
@@ -0,0 +1,77 @@
+from collections import deque
+
+IDEMPOTENT_HEADER = "Holybot-Idempotent"
+
+MIN_SAMPLES = 20
+RESORT_EVERY = 16
+TIMEOUT_MULTIPLIER = 3.0
+MIN_TIMEOUT = 0.5
+# После стольких таймаутов подряд берётся таймаут вызывающего, а не оценка по p99
+MAX_CONSECUTIVE_TIMEOUTS = 3
+
+
+class LatencyStats:
+    """
+    Скользящее окно задержек одной удалённой функции.
+
+    Перцентили пересчитываются не на каждый вызов, а раз в RESORT_EVERY замеров.
+    Таймаут пишется в окно как замер длиной в дедлайн: настоящая задержка не
+    меньше, и без этого p99 не вырос бы, когда функция стала медленнее.
+    """
+
+    __slots__ = (
+        "idempotent",
+        "count",
+        "consecutive_timeouts",
+        "__samples",
+        "__sorted",
+        "__unsorted",
+    )
+
+    def __init__(self, window: int = 512) -> None:
+        self.idempotent = False
+        self.count = 0
+        self.consecutive_timeouts = 0
+        self.__samples: deque[float] = deque(maxlen=window)
+        self.__sorted: list[float] = []
+        self.__unsorted = 0
+
+    def observe(self, seconds: float) -> None:
+        self.__samples.append(seconds)
+        self.count += 1
+        self.__unsorted += 1
+        self.consecutive_timeouts = 0
+
+    def observe_timeout(self, deadline: float) -> None:
+        consecutive = self.consecutive_timeouts + 1
+        self.observe(deadline)
+        self.consecutive_timeouts = consecutive
+
+    def percentile(self, q: float) -> float | None:
+        if len(self.__samples) < MIN_SAMPLES:
+            return None
+        if self.__unsorted >= RESORT_EVERY or not self.__sorted:
+            self.__sorted = sorted(self.__samples)
+            self.__unsorted = 0
+        return self.__sorted[int(q * (len(self.__sorted) - 1))]
+
+    def timeout(self, limit: float) -> float:
+        if self.consecutive_timeouts >= MAX_CONSECUTIVE_TIMEOUTS:
+            return limit
+        p99 = self.percentile(0.99)
+        if p99 is None:
+            return limit
+        return min(limit, max(MIN_TIMEOUT, p99 * TIMEOUT_MULTIPLIER))
+
+    def hedge_delay(self) -> float | None:
+        if not self.idempotent:
+            return None
+        return self.percentile(0.95)
+
+    def snapshot(self) -> dict[str, float | int | None]:
+        return {
+            "count": self.count,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
@@ -0,0 +1,179 @@
+import asyncio
+from bisect import bisect_left
+from itertools import count
+
+from loguru import logger
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+TRACE_SAMPLE = 100
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Family:
+    """Метрика с одной меткой function, по значению на каждую функцию"""
+
+    def __init__(
+        self, name: str, help: str, kind: str, buckets: tuple[float, ...] = ()
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.buckets = buckets
+        self.values: dict[str, Histogram | float] = {}
+
+    def observe(self, function: str, value: float) -> None:
+        histogram = self.values.get(function)
+        if histogram is None:
+            histogram = self.values[function] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def inc(self, function: str, amount: float = 1) -> None:
+        self.values[function] = self.values.get(function, 0) + amount
+
+    def render(self, service: str) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for function, value in self.values.items():
+            labels = f'service="{service}",function="{function}"'
+            if not isinstance(value, Histogram):
+                lines.append(f"{self.name}{{{labels}}} {value}")
+                continue
+
+            cumulative = 0
+            for bound, bucket in zip(value.buckets, value.counts):
+                cumulative += bucket
+                lines.append(
+                    f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {value.count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {value.sum}")
+            lines.append(f"{self.name}_count{{{labels}}} {value.count}")
+        return lines
+
+
+class Metrics:
+    def __init__(self, service: str) -> None:
+        self.service = service
+        self.__trace_counter = count()
+
+        # Исходящие вызовы, function = "<сервис>.<функция>"
+        self.request_latency = Family(
+            "holybot_rpc_request_seconds",
+            "Latency of outgoing requests",
+            "histogram",
+            LATENCY_BUCKETS,
+        )
+        self.request_size = Family(
+            "holybot_rpc_request_bytes",
+            "Size of outgoing request payloads",
+            "histogram",
+            SIZE_BUCKETS,
+        )
+        self.requests = Family(
+            "holybot_rpc_requests_total", "Outgoing requests", "counter"
+        )
+        self.timeouts = Family(
+            "holybot_rpc_timeouts_total", "Outgoing requests timed out", "counter"
+        )
+        self.failures = Family(
+            "holybot_rpc_failures_total",
+            "Outgoing requests failed with an error",
+            "counter",
+        )
+        self.hedged = Family(
+            "holybot_rpc_hedged_total", "Hedged outgoing requests", "counter"
+        )
+
+        # Входящие события, function = имя обработчика
+        self.handler_latency = Family(
+            "holybot_rpc_handler_seconds",
+            "Execution time of event handlers",
+            "histogram",
+            LATENCY_BUCKETS,
+        )
+        self.response_size = Family(
+            "holybot_rpc_response_bytes",
+            "Size of handler responses",
+            "histogram",
+            SIZE_BUCKETS,
+        )
+        self.handled = Family("holybot_rpc_handled_total", "Handled events", "counter")
+        self.errors = Family(
+            "holybot_rpc_errors_total", "Handlers raised an exception", "counter"
+        )
+        self.rejected = Family(
+            "holybot_rpc_rejected_total",
+            "Events rejected because of overload",
+            "counter",
+        )
+        self.in_flight = Family(
+            "holybot_rpc_in_flight", "Events currently executing", "gauge"
+        )
+
+    def families(self) -> list[Family]:
+        return [value for value in vars(self).values() if isinstance(value, Family)]
+
+    def render(self, extra: list[str] = ()) -> str:
+        lines = []
+        for family in self.families():
+            if family.values:
+                lines.extend(family.render(self.service))
+        lines.extend(extra)
+        return "\n".join(lines) + "\n"
+
+    def trace(self, message: str, *args) -> None:
+        """TRACE лог только для каждого TRACE_SAMPLE вызова, форматирование ленивое"""
+        if next(self.__trace_counter) % TRACE_SAMPLE == 0:
+            logger.trace(message, *args)
+
+
+async def serve_metrics(render, host: str, port: int) -> asyncio.Server:
+    """Минимальный HTTP сервер для Prometheus, отдаёт метрики на любой GET"""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = render().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -1,55 +1,115 @@
-from typing import TYPE_CHECKING
+from collections.abc import AsyncGenerator, AsyncIterator
+from typing import TYPE_CHECKING, get_args, get_origin
 import inspect
 
 from betterproto2 import Message
 
+from holybot_shared.communicator.batch import Batch
+from holybot_shared.communicator.cache import ResponseCache
+from holybot_shared.communicator.handler import resolve_type_url
+
 if TYPE_CHECKING:
     from holybot_shared.communicator import Client
 
 
+def stream_type(annotation) -> type | None:
+    if get_origin(annotation) not in (AsyncIterator, AsyncGenerator):
+        return None
+    return get_args(annotation)[0]
+
+
 class Microservice:
-    def __init__(self, client: "Client"):
+    # Выставляется в stub.py для сервисов, запущенных с Client(durable=True)
+    _durable = False
+
+    def __init__(self, client: "Client", cache_size: int = 256):
         self.__client = client
+        self.__cache = ResponseCache(cache_size) if cache_size else None
+        self.__methods: dict[str, type | None] = {}
 
         for name, value in inspect.getmembers(self):
-            if name.startswith("_") or not inspect.iscoroutinefunction(value):
+            if name.startswith("_") or not inspect.isroutine(value):
                 continue
 
             sig = inspect.signature(value)
-            return_type = (
-                sig.return_annotation
-                if sig.return_annotation != inspect._empty
-                else None
+            if inspect.iscoroutinefunction(value):
+                setattr(self, name, self.__make_method(name, sig))
+            elif stream_type(sig.return_annotation) is not None:
+                setattr(self, name, self.__make_stream_method(name, sig))
+
+    def batch(self, timeout: float = 10) -> Batch:
+        return Batch(self.__client, self.__class__.__name__, self.__methods, timeout)
+
+    @staticmethod
+    def __describe(sig: inspect.Signature) -> tuple[type | None, str | None, float]:
+        params = [
+            param
+            for param in sig.parameters.values()
+            if param.kind
+            in (
+                inspect.Parameter.POSITIONAL_ONLY,
+                inspect.Parameter.POSITIONAL_OR_KEYWORD,
             )
+        ]
+        payload_type = params[0].annotation if params else None
+
+        timeout_param = sig.parameters.get("timeout")
+        default_timeout = (
+            timeout_param.default
+            if timeout_param is not None and timeout_param.default != inspect._empty
+            else 10
+        )
+
+        return payload_type, resolve_type_url(payload_type), default_timeout
 
-            async def wrapper(
-                *args, _name=name, _sig=sig, _return_type=return_type, **kwargs
-            ):
-                bound = _sig.bind(*args, **kwargs)
-                bound.apply_defaults()
-
-                payload = bound.arguments.get("payload")
-                timeout = bound.arguments.get("timeout", 10)
-
-                return await self.__send_request(
-                    _name, bool(_return_type), _return_type, payload, timeout
-                )
-
-            setattr(self, name, wrapper)
-
-    def __send_request(
-        self,
-        function_name: str,
-        response: bool,
-        response_type: type,
-        payload: Message,
-        timeout: int,
-    ):
-        return self.__client.send_event(
-            self.__class__.__name__,
-            function_name,
-            wait_for_response=response,
-            response_type=response_type,
-            payload=payload,
-            timeout=timeout,
+    def __make_method(self, name: str, sig: inspect.Signature):
+        """Собирает обёртку без рефлексии на каждый вызов"""
+        return_type = (
+            sig.return_annotation if sig.return_annotation != inspect._empty else None
         )
+        self.__methods[name] = return_type
+        payload_type, type_url, default_timeout = self.__describe(sig)
+
+        send_event = self.__client.send_event
+        receiver = self.__class__.__name__
+        wait_for_response = return_type is not None
+        cache = self.__cache
+        durable = self._durable
+
+        async def method(payload: Message = None, *, timeout: float = default_timeout):
+            return await send_event(
+                receiver,
+                name,
+                wait_for_response=wait_for_response,
+                response_type=return_type,
+                payload=payload,
+                timeout=timeout,
+                type_url=type_url if type(payload) is payload_type else None,
+                cache=cache,
+                durable=durable,
+            )
+
+        method.__name__ = method.__qualname__ = name
+        method.__signature__ = sig
+        return method
+
+    def __make_stream_method(self, name: str, sig: inspect.Signature):
+        response_type = stream_type(sig.return_annotation)
+        payload_type, type_url, default_timeout = self.__describe(sig)
+
+        open_stream = self.__client.open_stream
+        receiver = self.__class__.__name__
+
+        def method(payload: Message = None, *, timeout: float = default_timeout):
+            return open_stream(
+                receiver,
+                name,
+                response_type=response_type,
+                payload=payload,
+                timeout=timeout,
+                type_url=type_url if type(payload) is payload_type else None,
+            )
+
+        method.__name__ = method.__qualname__ = name
+        method.__signature__ = sig
+        return method
@@ -0,0 +1,143 @@
+import asyncio
+from typing import AsyncIterator
+
+from betterproto2 import Message
+from loguru import logger
+from nats.aio.client import Client as NATSClient
+from nats.aio.msg import Msg
+from nats.aio.subscription import Subscription
+
+from holybot_shared.SharedProto.holybot.api import SimpleResponse
+
+FRAME_HEADER = "Holybot-Frame"
+WINDOW_HEADER = "Holybot-Window"
+
+DATA = "data"
+END = "end"
+ERROR = "error"
+CANCEL = "cancel"
+
+DEFAULT_WINDOW = 64
+CREDIT_TIMEOUT = 30.0
+
+
+class StreamSender:
+    """
+    Отправляет чанки стрима в inbox получателя.
+
+    Получатель подтверждает количество обработанных чанков, отправитель не уходит
+    вперёд больше чем на window неподтверждённых чанков.
+    """
+
+    def __init__(self, nc: NATSClient, inbox: str, window: int, timeout: float) -> None:
+        self.__nc = nc
+        self.__inbox = inbox
+        self.__window = max(window, 1)
+        self.__timeout = timeout
+        self.__ack_inbox: str | None = None
+        self.__subscription: Subscription | None = None
+        self.__credit = asyncio.Event()
+        self.__sent = 0
+        self.__acked = 0
+        self.cancelled = False
+
+    async def open(self) -> None:
+        self.__ack_inbox = self.__nc.new_inbox()
+        self.__subscription = await self.__nc.subscribe(
+            self.__ack_inbox, cb=self.__on_ack
+        )
+
+    async def close(self) -> None:
+        if self.__subscription:
+            await self.__subscription.unsubscribe()
+
+    async def send(self, chunk: Message) -> bool:
+        while not self.cancelled and self.__sent - self.__acked >= self.__window:
+            self.__credit.clear()
+            await asyncio.wait_for(self.__credit.wait(), self.__timeout)
+
+        if self.cancelled:
+            return False
+
+        await self.__nc.publish(
+            self.__inbox,
+            bytes(chunk),
+            reply=self.__ack_inbox,
+            headers={FRAME_HEADER: DATA},
+        )
+        self.__sent += 1
+        return True
+
+    async def end(self) -> None:
+        await self.__nc.publish(self.__inbox, b"", headers={FRAME_HEADER: END})
+
+    async def error(self, message: str) -> None:
+        await self.__nc.publish(
+            self.__inbox, message.encode(), headers={FRAME_HEADER: ERROR}
+        )
+
+    async def __on_ack(self, msg: Msg) -> None:
+        if msg.headers and msg.headers.get(FRAME_HEADER) == CANCEL:
+            self.cancelled = True
+        else:
+            self.__acked = max(self.__acked, int(msg.data))
+        self.__credit.set()
+
+
+async def receive_stream(
+    nc: NATSClient,
+    subject: str,
+    headers: dict[str, str],
+    data: bytes,
+    response_type: type[Message],
+    window: int,
+    timeout: float,
+) -> AsyncIterator[Message]:
+    """
+    Открывает стрим и отдаёт чанки по мере поступления.
+
+    Ошибка на стороне сервиса или таймаут между чанками завершают стрим
+    последним элементом SimpleResponse(success=False).
+    """
+    inbox = nc.new_inbox()
+    queue: asyncio.Queue[Msg] = asyncio.Queue()
+    subscription = await nc.subscribe(inbox, cb=queue.put)
+    ack_every = max(window // 2, 1)
+    ack_subject: str | None = None
+    received = 0
+    finished = False
+
+    try:
+        await nc.publish(
+            subject, data, reply=inbox, headers={**headers, WINDOW_HEADER: str(window)}
+        )
+
+        while True:
+            try:
+                msg = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Timeout waiting for stream chunk from {subject}")
+                finished = True
+                yield SimpleResponse(success=False, message="Timeout")
+                return
+
+            frame = msg.headers.get(FRAME_HEADER) if msg.headers else DATA
+            if frame == END:
+                finished = True
+                return
+            if frame == ERROR:
+                finished = True
+                yield SimpleResponse(success=False, message=msg.data.decode())
+                return
+
+            ack_subject = msg.reply
+            yield response_type.parse(msg.data)
+
+            received += 1
+            if ack_subject and received % ack_every == 0:
+                await nc.publish(ack_subject, str(received).encode())
+    finally:
+        if not finished and ack_subject:
+            # Потребитель вышел из цикла раньше, останавливаем отправителя
+            await nc.publish(ack_subject, b"", headers={FRAME_HEADER: CANCEL})
+        await subscription.unsubscribe()
@@ -2,16 +2,19 @@
 # DO NOT EDIT THIS FILE
 # Implementation are in the microservice.py
 
-from holybot_shared.communicator.microservice import Microservice
 import holybot_shared.SharedProto.holybot.api
 
+from holybot_shared.communicator.microservice import Microservice
+
 
 class API(Microservice):
-    async def test(self, payload: holybot_shared.SharedProto.holybot.api.UserLoggedIn, *, timeout: int = 10) -> holybot_shared.SharedProto.holybot.api.SimpleResponse:
-        ...
+    _durable = True
 
-    async def recheck_tokens(self) -> None:
-        ...
+    async def recheck_tokens(self) -> None: ...
 
-    async def get_token(self, payload: holybot_shared.SharedProto.holybot.api.UserLoggedIn, *, timeout: int = 10) -> holybot_shared.SharedProto.holybot.api.SimpleResponse:
-        ...
+    async def get_token(
+        self,
+        payload: holybot_shared.SharedProto.holybot.api.UserLoggedIn,
+        *,
+        timeout: int = 10
+    ) -> holybot_shared.SharedProto.holybot.api.SimpleResponse: ...
@@ -1,140 +1,365 @@
-import sys
+import ast
+import collections.abc
+import hashlib
+import json
 import os
-import inspect
-import importlib.util
-import importlib.abc
+import sys
 from pathlib import Path
 
-from holybot_shared.communicator import Client
+CLIENT_NAMES = {
+    "holybot_shared.communicator.Client",
+    "holybot_shared.communicator.client.Client",
+}
+
+STUB_FILE = Path(__file__).parent / "stub.py"
+CACHE_FILE = Path(__file__).parent / ".stub_cache.json"
+
+SKIP_DIRS = {
+    "venv",
+    ".venv",
+    "env",
+    ".env",
+    ".git",
+    ".hg",
+    ".svn",
+    "__pycache__",
+    "node_modules",
+    "site-packages",
+    "dist",
+    "build",
+    ".mypy_cache",
+    ".pytest_cache",
+}
+
+
+class QualifyNames(ast.NodeTransformer):
+    def __init__(self, qualify) -> None:
+        self.qualify = qualify
+
+    def visit_Attribute(self, node: ast.Attribute) -> ast.expr:
+        dotted = self.qualify(node)
+        if dotted is None:
+            return self.generic_visit(node)
+        return ast.Name(dotted)
+
+    def visit_Name(self, node: ast.Name) -> ast.expr:
+        dotted = self.qualify(node)
+        return node if dotted is None else ast.Name(dotted)
 
 
 class StubGenerator:
-    @staticmethod
-    def generate_class_stub(client: Client) -> str:
-        original_class = client._wrapped_class_ref
-        if original_class is None:
-            return ""
-
-        class_name = client._Client__name
-        # class_name = original_class.__name__
-        lines = [
-            "from holybot_shared.communicator.microservice import Microservice",
-            "import holybot_shared.SharedProto.holybot.api",
-            "\n",
-            f"class {class_name}(Microservice):",
-        ]
-
-        def write_method(name, func):
-            sig = inspect.signature(func)
-
-            if sig.return_annotation is not inspect.Signature.empty:
-
-                timeout_param = inspect.Parameter(
-                    "timeout",
-                    inspect.Parameter.KEYWORD_ONLY,
-                    default=10,
-                    annotation=int,
-                )
-
-                new_params = list(sig.parameters.values())
-
-                inserted = False
-                for i, param in enumerate(new_params):
-                    if param.kind == inspect.Parameter.VAR_KEYWORD:
-                        new_params.insert(i, timeout_param)
-                        inserted = True
-                        break
-
-                if not inserted:
-                    new_params.append(timeout_param)
-                new_sig = sig.replace(parameters=new_params)
-            else:
-                new_sig = sig.replace(return_annotation=None)
-
-            lines.append(f"    async def {name}{str(new_sig)}:")
-            lines.append("        ...")
+    """
+    Собирает stubs по исходникам без импорта модулей.
+
+    Клиент ищется как присваивание Client(...) на уровне модуля, сервис как класс
+    с @client.wrap_class, а функции как методы с @client.event.
+    """
+
+    def __init__(self, tree: ast.Module) -> None:
+        # Локальное имя -> полное имя, под которым оно импортировано
+        self.__names: dict[str, str] = {}
+        self.__imports: set[str] = set()
+
+        for node in tree.body:
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.asname:
+                        self.__names[alias.asname] = alias.name
+                    else:
+                        root = alias.name.split(".")[0]
+                        self.__names[root] = root
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                for alias in node.names:
+                    self.__names[alias.asname or alias.name] = (
+                        f"{node.module}.{alias.name}"
+                    )
+
+        self.__tree = tree
+
+    def generate(self) -> list[dict]:
+        clients: dict[str, tuple[str, bool]] = {}
+        for node in self.__tree.body:
+            if (
+                isinstance(node, ast.Assign)
+                and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+                and isinstance(node.value, ast.Call)
+                and self.__dotted(node.value.func) in CLIENT_NAMES
+            ):
+                client = self.__describe_client(node.value)
+                if client is not None:
+                    clients[node.targets[0].id] = client
+
+        services = []
+        for node in self.__tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+            for decorator in node.decorator_list:
+                owner = self.__decorator_owner(decorator, "wrap_class")
+                if owner in clients:
+                    self.__imports = set()
+                    name, durable = clients[owner]
+                    services.append(
+                        {
+                            "name": name,
+                            "source": node.name,
+                            "stub": self.__class_stub(node, owner, name, durable),
+                            "imports": sorted(self.__imports),
+                        }
+                    )
+        return services
+
+    def __describe_client(self, call: ast.Call) -> tuple[str, bool] | None:
+        if not call.args or not isinstance(call.args[0], ast.Constant):
+            return None
+        durable = any(
+            keyword.arg == "durable"
+            and isinstance(keyword.value, ast.Constant)
+            and keyword.value.value is True
+            for keyword in call.keywords
+        )
+        return call.args[0].value, durable
+
+    def __class_stub(
+        self, node: ast.ClassDef, client: str, name: str, durable: bool
+    ) -> str:
+        lines = [f"class {name}(Microservice):"]
+        if durable:
+            lines.append("    _durable = True")
             lines.append("")
 
-        for name, func in client.get_registered_events().items():
-            write_method(name, func)
+        for item in node.body:
+            if not isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            for decorator in item.decorator_list:
+                if self.__decorator_owner(decorator, "event") == client:
+                    lines.extend(self.__method_stub(item, self.__event_name(decorator)))
+                    break
 
         return "\n".join(lines)
 
+    def __method_stub(
+        self, func: ast.FunctionDef | ast.AsyncFunctionDef, name: str | None
+    ) -> list[str]:
+        args = func.args
+        params = []
+
+        positional = args.posonlyargs + args.args
+        defaults = [None] * (len(positional) - len(args.defaults)) + args.defaults
+        for index, (arg, default) in enumerate(zip(positional, defaults)):
+            params.append(self.__param(arg, default))
+            if args.posonlyargs and index == len(args.posonlyargs) - 1:
+                params.append("/")
+
+        if args.vararg:
+            params.append("*" + self.__param(args.vararg))
+        elif args.kwonlyargs or func.returns is not None:
+            params.append("*")
+
+        for arg, default in zip(args.kwonlyargs, args.kw_defaults):
+            params.append(self.__param(arg, default))
+        if func.returns is not None:
+            params.append("timeout: int = 10")
+        if args.kwarg:
+            params.append("**" + self.__param(args.kwarg))
+
+        returns = "None" if func.returns is None else self.__annotation(func.returns)
+
+        # Стримы вызываются без await: async for chunk in client.X.name(...)
+        prefix = "def" if self.__is_async_generator(func) else "async def"
+        return [
+            f"    {prefix} {name or func.name}({', '.join(params)}) -> {returns}:",
+            "        ...",
+            "",
+        ]
 
-def scan_project(root_folder: str):
-    abs_root = os.path.abspath(root_folder)
-    sys.path.insert(0, abs_root)
-
-    print(f"--- Scanning folder: {abs_root} ---")
-
-    all_stubs = []
-
-    SKIP_DIRS = {
-        "venv",
-        ".venv",
-        "env",
-        ".env",
-        ".git",
-        ".hg",
-        ".svn",
-        "__pycache__",
-        "node_modules",
-        "site-packages",
-        "dist",
-        "build",
-        ".mypy_cache",
-        ".pytest_cache",
-    }
-
-    for dirpath, dirs, filenames in os.walk(abs_root):
-        dirs[:] = [d for d in dirs if d not in SKIP_DIRS and not d.startswith(".")]
-
-        for file in filenames:
-            if file.endswith(".py") and file != os.path.basename(__file__):
-                full_path = os.path.join(dirpath, file)
-                process_file(full_path, all_stubs)
-
-    output_file = Path(__file__).parent / "stub.py"
-    with open(output_file, "w") as f:
-        f.write("# Auto-generated stubs\n")
-        f.write("# DO NOT EDIT THIS FILE\n")
-        f.write("# Implementation are in the microservice.py\n\n")
-        f.write("\n\n".join(all_stubs))
-
-    print(f"\n[Done] Generated stubs for {len(all_stubs)} classes in '{output_file}'")
+    def __param(self, arg: ast.arg, default: ast.expr | None = None) -> str:
+        text = arg.arg
+        if arg.annotation is not None:
+            text += f": {self.__annotation(arg.annotation)}"
+            if default is not None:
+                text += f" = {ast.unparse(default)}"
+        elif default is not None:
+            text += f"={ast.unparse(default)}"
+        return text
+
+    def __annotation(self, node: ast.expr) -> str:
+        """Заменяет импортированные имена на полные, как их показывал бы inspect"""
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            node = ast.parse(node.value, mode="eval").body
+
+        return ast.unparse(QualifyNames(self.__qualify).visit(node))
+
+    def __qualify(self, node: ast.Name | ast.Attribute) -> str | None:
+        root = node
+        while isinstance(root, ast.Attribute):
+            root = root.value
+        if not isinstance(root, ast.Name) or root.id not in self.__names:
+            return None
+
+        module, _, attr = self.__dotted(node).rpartition(".")
+        if module == "typing" and hasattr(collections.abc, attr):
+            module = "collections.abc"
+        if module:
+            self.__imports.add(module)
+        return f"{module}.{attr}" if module else attr
+
+    def __dotted(self, node: ast.expr) -> str | None:
+        """Полное имя выражения вида a.b.c с учётом импортов модуля"""
+        parts = []
+        while isinstance(node, ast.Attribute):
+            parts.append(node.attr)
+            node = node.value
+        if not isinstance(node, ast.Name):
+            return None
+
+        parts.append(self.__names.get(node.id, node.id))
+        return ".".join(reversed(parts))
 
+    @staticmethod
+    def __decorator_owner(decorator: ast.expr, method: str) -> str | None:
+        if isinstance(decorator, ast.Call):
+            decorator = decorator.func
+        if (
+            isinstance(decorator, ast.Attribute)
+            and decorator.attr == method
+            and isinstance(decorator.value, ast.Name)
+        ):
+            return decorator.value.id
+        return None
 
-def process_file(file_path, results_list):
-    module_name = os.path.splitext(os.path.basename(file_path))[0]
+    @staticmethod
+    def __event_name(decorator: ast.expr) -> str | None:
+        if not isinstance(decorator, ast.Call):
+            return None
+        for node in decorator.args[:1] + [
+            keyword.value for keyword in decorator.keywords if keyword.arg == "name"
+        ]:
+            if isinstance(node, ast.Constant) and isinstance(node.value, str):
+                return node.value
+        return None
 
-    max_retries = 5
-    for attempt in range(max_retries):
+    @staticmethod
+    def __is_async_generator(func: ast.FunctionDef | ast.AsyncFunctionDef) -> bool:
+        if not isinstance(func, ast.AsyncFunctionDef):
+            return False
+
+        nodes = list(func.body)
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, (ast.Yield, ast.YieldFrom)):
+                return True
+            if isinstance(
+                node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+            ):
+                continue
+            nodes.extend(ast.iter_child_nodes(node))
+        return False
+
+
+def scan_file(path: str, cache: dict[str, dict]) -> list[dict]:
+    """Сервисы из файла, файл разбирается только если изменилось содержимое"""
+    stat = os.stat(path)
+    entry = cache.get(path)
+    if (
+        entry is not None
+        and entry["mtime"] == stat.st_mtime_ns
+        and entry["size"] == stat.st_size
+    ):
+        return entry["services"]
+
+    with open(path, "rb") as f:
+        source = f.read()
+    digest = hashlib.sha1(source).hexdigest()
+
+    if entry is not None and entry["hash"] == digest:
+        services = entry["services"]
+    elif b"wrap_class" not in source:
+        services = []
+    else:
         try:
-            spec = importlib.util.spec_from_file_location(module_name, file_path)
-            if not spec or not spec.loader:
-                return
-
-            module = importlib.util.module_from_spec(spec)
-            sys.modules[module_name] = module
+            services = StubGenerator(ast.parse(source, path)).generate()
+        except (SyntaxError, ValueError) as e:
+            print(f"Skipped {os.path.basename(path)} due to error: {e}")
+            services = []
+
+    cache[path] = {
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "hash": digest,
+        "services": services,
+    }
+    return services
+
+
+def render(services: list[dict]) -> str:
+    # Только модули из аннотаций, иначе ruff ругается на неиспользуемый импорт
+    imports = set().union(*(service["imports"] for service in services))
+    lines = [f"import {module}" for module in sorted(imports)]
+    if lines:
+        lines.append("")
+    lines.append("from holybot_shared.communicator.microservice import Microservice")
+
+    return format_source(
+        "# Auto-generated stubs\n"
+        "# DO NOT EDIT THIS FILE\n"
+        "# Implementation are in the microservice.py\n\n"
+        + "\n".join(lines)
+        + "\n\n\n"
+        + "\n\n".join(service["stub"] for service in services)
+    )
+
+
+def format_source(content: str) -> str:
+    """Форматирует stubs black из requirements-dev, чтобы файл проходил проверки"""
+    try:
+        import black
+    except ImportError:
+        print("black is not installed, stubs are written unformatted")
+        return content
+    return black.format_str(content, mode=black.Mode())
+
+
+def scan_project(root_folder: str, force: bool = False):
+    abs_root = os.path.abspath(root_folder)
+    print(f"--- Scanning folder: {abs_root} ---")
 
-            spec.loader.exec_module(module)
+    cache: dict[str, dict] = {}
+    if not force and CACHE_FILE.exists():
+        try:
+            cache = json.loads(CACHE_FILE.read_text())
+        except ValueError:
+            cache = {}
 
-            for name, obj in vars(module).items():
-                if "_wrapped_class_ref" in dir(obj):
+    all_services = []
+    scanned = []
+    for dirpath, dirs, filenames in os.walk(abs_root):
+        dirs[:] = sorted(
+            d for d in dirs if d not in SKIP_DIRS and not d.startswith(".")
+        )
+
+        for file in sorted(filenames):
+            if not file.endswith(".py"):
+                continue
+            full_path = os.path.join(dirpath, file)
+            scanned.append(full_path)
+            for service in scan_file(full_path, cache):
+                print(
+                    f" -> Found Client in {os.path.basename(full_path)}: Wraps '{service['source']}'"
+                )
+                all_services.append(service)
 
-                    if obj._wrapped_class_ref:
-                        print(
-                            f" -> Found Client in {os.path.basename(file_path)}: Wraps '{obj._wrapped_class_ref.__name__}'"
-                        )
-                        stub = StubGenerator.generate_class_stub(obj)
-                        results_list.append(stub)
+    # Удалённые файлы не должны копиться в кэше
+    CACHE_FILE.write_text(json.dumps({path: cache[path] for path in scanned}))
 
-            break
+    content = render(all_services)
+    if STUB_FILE.exists() and STUB_FILE.read_text() == content:
+        print(f"\n[Done] Stubs for {len(all_services)} classes are up to date")
+        return
 
-        except Exception as e:
-            print(f"Skipped {os.path.basename(file_path)} due to error: {e}")
-            break
+    STUB_FILE.write_text(content)
+    print(f"\n[Done] Generated stubs for {len(all_services)} classes in '{STUB_FILE}'")
 
 
 if __name__ == "__main__":
-    scan_project(".")
+    scan_project(".", force="--force" in sys.argv)